@@ -8,8 +8,16 @@ logger = logging.getLogger(__name__)
 
 class RoomPhotoDAO:
     @classmethod
-    def add_new_room_photo(cls, db, firebase_id, room_photo_id):
-        new_room_photo = RoomPhoto(firebase_id=firebase_id, room_photo_id=room_photo_id)
+    def add_new_room_photo(cls, db, firebase_id, room_photo_id, photo=None):
+        photo = photo or {}
+        new_room_photo = RoomPhoto(
+            firebase_id=firebase_id,
+            room_photo_id=room_photo_id,
+            content_hash=photo.get("content_hash"),
+            url=photo.get("url"),
+            thumbnail_url=photo.get("thumbnail_url"),
+            medium_url=photo.get("medium_url"),
+        )
 
         db.add(new_room_photo)
         db.commit()
@@ -35,6 +43,27 @@ class RoomPhotoDAO:
 
         return room_photo.serialize()
 
+    @classmethod
+    def get_room_photos_by_firebase_ids(cls, db, firebase_ids):
+        room_photos = (
+            db.query(RoomPhoto).filter(RoomPhoto.firebase_id.in_(firebase_ids)).all()
+        )
+
+        return {
+            room_photo.firebase_id: room_photo.serialize() for room_photo in room_photos
+        }
+
+    @classmethod
+    def get_room_photo_by_hash(cls, db, content_hash):
+        room_photo = (
+            db.query(RoomPhoto).filter(RoomPhoto.content_hash == content_hash).first()
+        )
+
+        if room_photo is None:
+            return None
+
+        return room_photo.serialize()
+
     @classmethod
     def delete_room_photo(cls, db, firebase_id):
         room_photo = (
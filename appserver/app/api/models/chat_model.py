@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -13,19 +13,31 @@ class MessageDB(MessageSchema):
     receiver_name: str
     sender_uuid: int
     timestamp: int
+    id: Optional[str] = None
 
 
 class ChatPreview(BaseModel):
     other_user: str
     other_uuid: int
     last_message: str
+    timestamp: int
+    unread: int = 0
 
 
 class ChatDB(BaseModel):
     amount: int
     messages: List[MessageDB]
+    next_cursor: Optional[str] = None
+
+
+class ChatUpdates(BaseModel):
+    amount: int
+    messages: List[MessageDB]
+    cursor: Optional[str] = None
+    has_more: bool = False
 
 
 class ChatList(BaseModel):
     amount: int
     chats: List[ChatPreview]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,50 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class RoomMarker(BaseModel):
+    id: int
+    latitude: float
+    longitude: float
+    price_per_day: int
+    type: str
+
+
+class RoomCluster(BaseModel):
+    latitude: float
+    longitude: float
+    count: int
+    min_price: int
+    max_price: int
+
+
+class RoomMap(BaseModel):
+    amount: int
+    markers: List[RoomMarker]
+    clusters: List[RoomCluster]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "amount": 14,
+                "markers": [
+                    {
+                        "id": 9,
+                        "latitude": -34.6,
+                        "longitude": -58.4,
+                        "price_per_day": 67,
+                        "type": "Apartment",
+                    },
+                ],
+                "clusters": [
+                    {
+                        "latitude": -34.9,
+                        "longitude": -57.9,
+                        "count": 13,
+                        "min_price": 20,
+                        "max_price": 872,
+                    },
+                ],
+            }
+        }
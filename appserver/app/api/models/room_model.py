@@ -77,6 +77,7 @@ class RoomUpdate(BaseModel):
 class RoomList(BaseModel):
     amount: int
     rooms: List[RoomDB]
+    next_cursor: Optional[str] = None
 
     class Config:
         schema_extra = {
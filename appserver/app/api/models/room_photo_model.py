@@ -1,11 +1,13 @@
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
 
 class RoomPhoto(BaseModel):
     url: str
+    thumbnail_url: Optional[str] = None
+    medium_url: Optional[str] = None
     firebase_id: int
     id: int
     room_id: int
@@ -16,6 +18,8 @@ class RoomPhoto(BaseModel):
         schema_extra = {
             "example": {
                 "url": "www.google.com",
+                "thumbnail_url": "www.google.com/thumbnail",
+                "medium_url": "www.google.com/medium",
                 "firebase_id": 2,
                 "id": 4,
                 "room_id": 8,
@@ -55,3 +59,15 @@ class RoomPhotoList(BaseModel):
                 ],
             }
         }
+
+
+class RoomPhotoResult(BaseModel):
+    filename: str
+    photo: Optional[RoomPhoto] = None
+    error: Optional[str] = None
+
+
+class RoomPhotoBatch(BaseModel):
+    amount: int
+    room_id: int
+    results: List[RoomPhotoResult]
@@ -3,10 +3,13 @@ from typing import Optional
 
 from app.api.models.booking_model import BookingDB, BookingList, BookingSchema
 from app.dependencies import check_token, get_uuid_from_xtoken
-from app.errors.http_error import (NotAllowedRequestError,
+from app.errors.http_error import (ConflictError, NotAllowedRequestError,
                                    UnauthorizedRequestError)
 from app.services.authsender import AuthSender
+from app.services.availability import booking_index
 from app.services.requester import Requester
+from app.services.room_directory import RoomDirectory
+from app.services.user_directory import UserDirectory
 from app.services.notifier import notifier
 from fastapi import APIRouter, Depends
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_404_NOT_FOUND
@@ -61,13 +64,14 @@ async def get_all_bookings(
         query = query[: (len(query) - 1)]
         path = path + query
 
-    bookings, _ = Requester.payment_fetch(
+    bookings, _ = await Requester.payment_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
 
     # TODO: Change BookingDB model to match camelcase in payment server
     for i in range(len(bookings)):
         bookings[i] = payment_camel_to_snake(bookings[i])
+        booking_index.add(bookings[i])
 
     booking_list = {"amount": len(bookings), "bookings": bookings}
 
@@ -86,8 +90,7 @@ async def create_new_booking(
 ):
 
     room_id = payload.dict()["room_id"]
-    room_path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch("GET", room_path, {HTTP_200_OK})
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.can_book_room(room["owner_uuid"], uuid):
         raise NotAllowedRequestError("Can't create booking of your own room")
@@ -95,6 +98,11 @@ async def create_new_booking(
     if room["blocked"]:
         raise NotAllowedRequestError("Can't create booking because the room is blocked")
 
+    if booking_index.ready and not booking_index.is_free(
+        room_id, payload.date_from, payload.date_to
+    ):
+        raise ConflictError("The room is already booked in those dates")
+
     # Create intent book in payment server
 
     booking_path = "/bookings"
@@ -104,7 +112,7 @@ async def create_new_booking(
         "dateFrom": payload.dict()["date_from"].strftime("%d-%m-%Y"),
         "dateTo": payload.dict()["date_to"].strftime("%d-%m-%Y"),
     }
-    booking, _ = Requester.payment_fetch(
+    booking, _ = await Requester.payment_fetch(
         method="POST",
         path=booking_path,
         expected_statuses={HTTP_201_CREATED},
@@ -120,21 +128,18 @@ async def create_new_booking(
         "date_to": payload.dict()["date_to"].strftime("%Y-%m-%d"),
     }
 
-    booking_room, _ = Requester.room_srv_fetch(
+    booking_room, _ = await Requester.room_srv_fetch(
         "POST", booking_path, {HTTP_201_CREATED}, payload=payload_booking
     )
 
     # TODO: Change BookingDB model to match camelcase in payment server
     booking_camel = payment_camel_to_snake(booking)
+    booking_index.add(booking_camel)
 
     # Send notification
-    sender, _ = Requester.user_srv_fetch(
-        "GET", f"/users/{uuid}", {HTTP_200_OK}
-    )
+    sender_name = await UserDirectory.get_display_name(uuid)
 
-    sender_name = f"{sender['firstname']} {sender['lastname']}"
-
-    notifier.send_new_booking_received_notification(
+    await notifier.send_new_booking_received_notification(
         sender_name, room["title"], room["owner_uuid"]
     )
 
@@ -149,7 +154,7 @@ async def create_new_booking(
 )
 async def accept_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtoken)):
     path = f"/bookings/{booking_id}"
-    booking, _ = Requester.payment_fetch(
+    booking, _ = await Requester.payment_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     room_owner_id = booking["roomOwnerId"]
@@ -159,25 +164,22 @@ async def accept_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtok
 
     path = f"/bookings/{booking_id}/accept"
     payload_accept = {"roomOwnerId": room_owner_id}
-    book_accepted, _ = Requester.payment_fetch(
+    book_accepted, _ = await Requester.payment_fetch(
         "POST", path, {HTTP_200_OK}, payload=payload_accept
     )
 
     # TODO: Change BookingDB model to match camelcase in payment server
     booking_camel = payment_camel_to_snake(book_accepted)
+    booking_index.add(booking_camel)
 
     # Send notification
-    sender, _ = Requester.user_srv_fetch(
-        "GET", f"/users/{booking_camel['room_owner_id']}", {HTTP_200_OK}
-    )
-    sender_name = f"{sender['firstname']} {sender['lastname']}"
-
-    room, _ = Requester.room_srv_fetch(
-        "GET", f"/rooms/{booking_camel['room_id']}", {HTTP_200_OK}
+    sender_name, room = await Requester.fan_out(
+        UserDirectory.get_display_name(booking_camel["room_owner_id"]),
+        RoomDirectory.get_room(booking_camel["room_id"]),
     )
     room_title = room["title"]
 
-    notifier.send_booking_accepted_notification(
+    await notifier.send_booking_accepted_notification(
         sender_name, room_title, booking_camel["booker_id"]
     )
 
@@ -192,7 +194,7 @@ async def accept_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtok
 )
 async def reject_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtoken)):
     path = f"/bookings/{booking_id}"
-    booking, _ = Requester.payment_fetch(
+    booking, _ = await Requester.payment_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     room_id = booking["roomId"]
@@ -203,29 +205,26 @@ async def reject_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtok
 
     path = f"/bookings/{booking_id}/reject"
     payload_reject = {"roomOwnerId": room_owner_id}
-    book_rejected, _ = Requester.payment_fetch(
+    book_rejected, _ = await Requester.payment_fetch(
         "POST", path, {HTTP_200_OK}, payload=payload_reject
     )
 
     # Delete the rejected booking in post server
     booking_path = f"/rooms/{room_id}/bookings/{booking_id}"
-    booking, _ = Requester.room_srv_fetch("DELETE", booking_path, {HTTP_200_OK})
+    booking, _ = await Requester.room_srv_fetch("DELETE", booking_path, {HTTP_200_OK})
 
     # TODO: Change BookingDB model to match camelcase in payment server
     booking_camel = payment_camel_to_snake(book_rejected)
+    booking_index.remove(booking_id)
 
     # Send notification
-    sender, _ = Requester.user_srv_fetch(
-        "GET", f"/users/{booking_camel['room_owner_id']}", {HTTP_200_OK}
-    )
-    sender_name = f"{sender['firstname']} {sender['lastname']}"
-
-    room, _ = Requester.room_srv_fetch(
-        "GET", f"/rooms/{booking_camel['room_id']}", {HTTP_200_OK}
+    sender_name, room = await Requester.fan_out(
+        UserDirectory.get_display_name(booking_camel["room_owner_id"]),
+        RoomDirectory.get_room(booking_camel["room_id"]),
     )
     room_title = room["title"]
 
-    notifier.send_booking_rejected_notification(
+    await notifier.send_booking_rejected_notification(
         sender_name, room_title, booking_camel["booker_id"]
     )
 
@@ -239,7 +238,7 @@ async def reject_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtok
 )
 async def get_booking(booking_id: int):
     path = f"/bookings/{booking_id}"
-    booking, _ = Requester.payment_fetch(
+    booking, _ = await Requester.payment_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
 
@@ -257,7 +256,7 @@ async def get_booking(booking_id: int):
 )
 async def delete_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtoken)):
     path = f"/bookings/{booking_id}"
-    booking, _ = Requester.payment_fetch(
+    booking, _ = await Requester.payment_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     room_id = booking["roomId"]
@@ -267,16 +266,17 @@ async def delete_booking(booking_id: int, uuid: int = Depends(get_uuid_from_xtok
         raise UnauthorizedRequestError("Can't reject other users bookings")
 
     path = f"/bookings/{booking_id}"
-    book_deleted, _ = Requester.payment_fetch("DELETE", path, {HTTP_200_OK})
+    book_deleted, _ = await Requester.payment_fetch("DELETE", path, {HTTP_200_OK})
 
     # Delete the rejected booking in post server,
     # if it is not found it is also OK!
     booking_path = f"/rooms/{room_id}/bookings/{booking_id}"
-    booking, _ = Requester.room_srv_fetch(
+    booking, _ = await Requester.room_srv_fetch(
         "DELETE", booking_path, {HTTP_200_OK, HTTP_404_NOT_FOUND}
     )
 
     # TODO: Change BookingDB model to match camelcase in payment server
     booking_camel = payment_camel_to_snake(book_deleted)
+    booking_index.remove(booking_id)
 
     return booking_camel
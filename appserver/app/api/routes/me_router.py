@@ -1,20 +1,38 @@
+import json
+import os
+from typing import Optional
+
 from app.api.models.booking_model import BookingsUserList
-from app.api.models.chat_model import (ChatDB, ChatList, MessageDB,
-                                       MessageSchema)
+from app.api.models.chat_model import (ChatDB, ChatList, ChatPreview,
+                                       ChatUpdates, MessageDB, MessageSchema)
 from app.api.models.room_model import RoomDB, RoomList
 from app.api.models.token_model import TokenSchema
 from app.api.models.user_model import UserDB, UserSchema, WalletDB
 from app.api.models.user_favorite_room_model import UserFavoriteRoomSchema
 from app.dependencies import check_token, get_uuid_from_xtoken
+from app.errors.http_error import NotFoundError
 from app.services.chat import chat_service
+from app.services.chat_hub import chat_hub
 from app.services.notifier import notifier
 from app.services.photouploader import photouploader
 from app.services.requester import Requester
-from fastapi import APIRouter, Depends, File, Response, UploadFile
+from app.services.room_directory import RoomDirectory
+from app.services.user_directory import UserDirectory
+from app.utils.pagination import MAX_PAGE_SIZE, PAGE_SIZE, page_bounds, paginate
+from fastapi import APIRouter, Depends, File, Header, Query, Response, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
 
 router = APIRouter()
 
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_MAX_PAGE_SIZE = int(os.getenv("CHAT_MAX_PAGE_SIZE", "200"))
+CHAT_STREAM_KEEPALIVE = float(os.getenv("CHAT_STREAM_KEEPALIVE", "15"))
+# streams re-read a chat that has not been synced in this long, to pick up
+# the messages sent through other instances
+CHAT_STREAM_RESYNC_INTERVAL = float(os.getenv("CHAT_STREAM_RESYNC_INTERVAL", "60"))
+
 
 def payment_camel_to_snake(payment_payload):
     booking_camel = {
@@ -43,7 +61,7 @@ def payment_camel_to_snake(payment_payload):
 )
 async def get_current_user(uuid: int = Depends(get_uuid_from_xtoken)):
     path = f"/users/{uuid}"
-    user, _ = Requester.user_srv_fetch(
+    user, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user
@@ -57,7 +75,7 @@ async def get_current_user(uuid: int = Depends(get_uuid_from_xtoken)):
 )
 async def get_current_user_wallet(uuid: int = Depends(get_uuid_from_xtoken)):
     path = f"/wallets/{uuid}"
-    wallet, _ = Requester.payment_fetch(
+    wallet, _ = await Requester.payment_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return wallet
@@ -70,13 +88,15 @@ async def get_current_user_wallet(uuid: int = Depends(get_uuid_from_xtoken)):
     dependencies=[Depends(check_token)],
 )
 async def get_current_user_bookings(uuid: int = Depends(get_uuid_from_xtoken)):
-    path = f"/bookings?roomOwnerId={uuid}"
-    bookings_received, _ = Requester.payment_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
-    path = f"/bookings?bookerId={uuid}"
-    bookings_made, _ = Requester.payment_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
+    received_path = f"/bookings?roomOwnerId={uuid}"
+    made_path = f"/bookings?bookerId={uuid}"
+    (bookings_received, _), (bookings_made, _) = await Requester.fan_out(
+        Requester.payment_fetch(
+            method="GET", path=received_path, expected_statuses={HTTP_200_OK}
+        ),
+        Requester.payment_fetch(
+            method="GET", path=made_path, expected_statuses={HTTP_200_OK}
+        ),
     )
 
     # TODO: Change BookingDB model to match camelcase in payment server
@@ -106,13 +126,17 @@ async def get_current_user_bookings(uuid: int = Depends(get_uuid_from_xtoken)):
     status_code=HTTP_200_OK,
     dependencies=[Depends(check_token)],
 )
-async def get_current_user_rooms(uuid: int = Depends(get_uuid_from_xtoken)):
+async def get_current_user_rooms(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    uuid: int = Depends(get_uuid_from_xtoken),
+):
     path = f"/rooms?owner_uuid={uuid}"
-    rooms, _ = Requester.room_srv_fetch(
+    rooms, _ = await Requester.room_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
 
-    return rooms
+    return paginate(rooms, "rooms", limit, cursor)
 
 
 @router.post(
@@ -161,13 +185,14 @@ async def update_profile_photo(
     file: UploadFile = File(...),
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    image_url = photouploader.upload_profile_photo(file, uuid)
+    image_url = await photouploader.upload_profile_photo(file, uuid)
 
     user_patch = {"photo": image_url}
     user_profile_path = f"/users/{uuid}"
-    user_response, _ = Requester.user_srv_fetch(
+    user_response, _ = await Requester.user_srv_fetch(
         "PATCH", user_profile_path, {HTTP_200_OK}, payload=user_patch
     )
+    UserDirectory.invalidate(uuid)
 
     return user_response
 
@@ -180,10 +205,30 @@ async def update_profile_photo(
 )
 async def get_all_chats(
     _reponse: Response,
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, regex=r"^\d+_\d+$"),
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    chats = chat_service.get_all_chats_from(uuid)
-    return {"amount": len(chats), "chats": chats}
+    chats, next_cursor = chat_service.get_all_chats_from(uuid, limit, before)
+    return {"amount": len(chats), "chats": chats, "next_cursor": next_cursor}
+
+
+@router.post(
+    "/chats/{other_uuid}/read",
+    response_model=ChatPreview,
+    status_code=HTTP_200_OK,
+    dependencies=[Depends(check_token)],
+)
+async def mark_chat_as_read(
+    _reponse: Response,
+    other_uuid: int,
+    uuid: int = Depends(get_uuid_from_xtoken),
+):
+    preview = chat_service.mark_as_read(uuid, other_uuid)
+    if preview is None:
+        raise NotFoundError("Chat")
+
+    return preview
 
 
 @router.get(
@@ -195,11 +240,108 @@ async def get_all_chats(
 async def get_chat(
     _reponse: Response,
     other_uuid: int,
+    limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=CHAT_MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    uuid: int = Depends(get_uuid_from_xtoken),
+):
+    messages, next_cursor = chat_service.get_messages_between(
+        uuid, other_uuid, limit, before
+    )
+
+    return {"amount": len(messages), "messages": messages, "next_cursor": next_cursor}
+
+
+@router.get(
+    "/chats/{other_uuid}/updates",
+    response_model=ChatUpdates,
+    status_code=HTTP_200_OK,
+    dependencies=[Depends(check_token)],
+)
+async def get_chat_updates(
+    _reponse: Response,
+    other_uuid: int,
+    since: Optional[str] = None,
+    limit: int = Query(CHAT_MAX_PAGE_SIZE, ge=1, le=CHAT_MAX_PAGE_SIZE),
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    messages = chat_service.get_messages_between(uuid, other_uuid)
+    messages, cursor, has_more = await run_in_threadpool(
+        chat_service.get_messages_since, uuid, other_uuid, since, limit
+    )
+
+    return {
+        "amount": len(messages),
+        "messages": messages,
+        "cursor": cursor,
+        "has_more": has_more,
+    }
+
+
+@router.get(
+    "/chats/{other_uuid}/stream",
+    status_code=HTTP_200_OK,
+    dependencies=[Depends(check_token)],
+)
+async def stream_chat(
+    other_uuid: int,
+    since: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    uuid: int = Depends(get_uuid_from_xtoken),
+):
+    """
+    Server-sent events stream of the new messages of the chat.
+    Reconnecting clients resume after the Last-Event-ID header (or since)
+    """
+    cursor = last_event_id or since
+    if cursor is None:
+        newest, _ = await run_in_threadpool(
+            chat_service.get_messages_between, uuid, other_uuid, 1
+        )
+        cursor = newest[-1]["id"] if newest else None
+
+    return StreamingResponse(
+        _chat_events(uuid, other_uuid, cursor), media_type="text/event-stream"
+    )
 
-    return {"amount": len(messages), "messages": messages}
+
+async def _chat_events(uuid, other_uuid, cursor):
+    subscription = chat_service.subscribe(uuid, other_uuid)
+    catch_up = cursor is not None
+
+    try:
+        while True:
+            if catch_up or subscription.lagged:
+                # the whole backlog is sent before the live messages, these
+                # are read from the chat too while catching up
+                subscription.clear()
+                messages, cursor, catch_up = await run_in_threadpool(
+                    chat_service.get_messages_since,
+                    uuid,
+                    other_uuid,
+                    cursor,
+                    CHAT_MAX_PAGE_SIZE,
+                )
+                for message in messages:
+                    yield _chat_event(message)
+                continue
+
+            item = await subscription.get(CHAT_STREAM_KEEPALIVE)
+            if item is None:
+                catch_up = chat_service.needs_sync(
+                    uuid, other_uuid, CHAT_STREAM_RESYNC_INTERVAL
+                )
+                yield ": keepalive\n\n"
+                continue
+
+            key, message = item
+            if cursor is None or key > cursor:
+                cursor = key
+                yield _chat_event({**message, "id": key})
+    finally:
+        chat_hub.unsubscribe(subscription)
+
+
+def _chat_event(message):
+    return f"id: {message['id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
 
 
 @router.post(
@@ -214,23 +356,19 @@ async def send_message(
     other_uuid: int,
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    path = f"/users/{uuid}"
-    me, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
+    own_name, other_name = await Requester.fan_out(
+        UserDirectory.get_display_name(uuid),
+        UserDirectory.get_display_name(other_uuid),
     )
 
-    path = f"/users/{other_uuid}"
-    other, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
-
-    own_name = f"{me['firstname']} {me['lastname']}"
-    other_name = f"{other['firstname']} {other['lastname']}"
-
     own_data = {"name": own_name, "uuid": uuid}
     other_data = {"name": other_name, "uuid": other_uuid}
 
-    return chat_service.send_message(payload.dict()["message"], own_data, other_data)
+    message = chat_service.send_message(payload.dict()["message"], own_data, other_data)
+
+    await notifier.send_new_chat_message_notification(own_name, other_uuid)
+
+    return message
 
 
 @router.post(
@@ -244,13 +382,10 @@ async def create_favorite_room(
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
 
-    room_path = f"/rooms/{payload.dict()['room_id']}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=room_path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(payload.dict()["room_id"])
 
     path = f"/users/{uuid}/favorite_rooms"
-    favorite_room, _ = Requester.user_srv_fetch(
+    favorite_room, _ = await Requester.user_srv_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -267,26 +402,34 @@ async def create_favorite_room(
     dependencies=[Depends(check_token)],
 )
 async def get_favorite_rooms(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
     path = f"/users/{uuid}/favorite_rooms"
-    favorite_rooms, _ = Requester.user_srv_fetch(
+    favorite_rooms, _ = await Requester.user_srv_fetch(
         method="GET",
         path=path,
         expected_statuses={HTTP_200_OK},
     )
 
+    # only the rooms of the requested page are asked to the post server
+    favorites = favorite_rooms["favorites"]
+    start, end, next_cursor = page_bounds(len(favorites), limit, cursor)
+
     query = "?"
-    if len(favorite_rooms["favorites"]) > 0:
-        for favorite in favorite_rooms["favorites"]:
+    if end > start:
+        for favorite in favorites[start:end]:
             query = query + f"ids={favorite['room_id']}&"
     else:
         query = query + f"ids={-1}"
 
     room_path = "/rooms" + query
-    rooms, _ = Requester.room_srv_fetch(
+    rooms, _ = await Requester.room_srv_fetch(
         method="GET", path=room_path, expected_statuses={HTTP_200_OK}
     )
+    rooms["amount"] = len(favorites)
+    rooms["next_cursor"] = next_cursor
 
     return rooms
 
@@ -303,19 +446,16 @@ async def delete_favorite_room(
 ):
 
     path = f"/users/{uuid}/favorite_rooms/{favorite_id}"
-    favorite_room, _ = Requester.user_srv_fetch(
+    favorite_room, _ = await Requester.user_srv_fetch(
         method="GET",
         path=path,
         expected_statuses={HTTP_200_OK},
     )
 
-    room_path = f"/rooms/{favorite_room['room_id']}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=room_path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(favorite_room["room_id"])
 
     path = f"/users/{uuid}/favorite_rooms/{favorite_id}"
-    favorite_rooms, _ = Requester.user_srv_fetch(
+    favorite_rooms, _ = await Requester.user_srv_fetch(
         method="DELETE",
         path=path,
         expected_statuses={HTTP_200_OK},
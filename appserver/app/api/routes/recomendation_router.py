@@ -14,7 +14,7 @@ router = APIRouter()
     status_code=HTTP_200_OK
 )
 async def get_recomended_rooms():
-    rooms, _ = Requester.room_srv_fetch(
+    rooms, _ = await Requester.room_srv_fetch(
         method="GET", path="/recomendations", expected_statuses={HTTP_200_OK}
     )
 
@@ -1,10 +1,15 @@
+import asyncio
+import logging
+import os
 from typing import List, Optional
 
 from app.api.crud.room_photo_dao import RoomPhotoDAO
 from app.api.models.room_comment_model import (RoomCommentDB, RoomCommentList,
                                                RoomCommentSchema)
+from app.api.models.room_map_model import RoomMap
 from app.api.models.room_model import RoomDB, RoomList, RoomSchema, RoomUpdate
-from app.api.models.room_photo_model import RoomPhoto, RoomPhotoList
+from app.api.models.room_photo_model import (RoomPhoto, RoomPhotoBatch,
+                                             RoomPhotoList)
 from app.api.models.room_rating_model import (RoomRatingDB, RoomRatingList,
                                               RoomRatingSchema)
 from app.api.models.room_review_model import (RoomReviewDB, RoomReviewList,
@@ -14,15 +19,28 @@ from app.dependencies import check_token, get_uuid_from_xtoken
 from app.errors.http_error import (BadRequestError, NotFoundError,
                                    UnauthorizedRequestError)
 from app.services.authsender import AuthSender
+from app.services.availability import booking_index
 from app.services.photouploader import photouploader
 from app.services.requester import Requester
+from app.services.room_directory import RoomDirectory
+from app.services.room_index import room_index
+from app.services.room_map import build_map
+from app.services.room_search import RoomSearch
+from app.services.user_directory import UserDirectory
 from app.services.notifier import notifier
-from fastapi import APIRouter, Depends, File, Query, UploadFile
+from app.utils.pagination import MAX_PAGE_SIZE, PAGE_SIZE, paginate
+from dateutil import parser
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_404_NOT_FOUND
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
+PHOTO_BATCH_MAX_FILES = int(os.getenv("PHOTO_BATCH_MAX_FILES", "10"))
+PHOTO_BATCH_PARALLELISM = int(os.getenv("PHOTO_BATCH_PARALLELISM", "3"))
+
 
 # -----------------------------------ROOMS------------------------------------- #
 @router.post(
@@ -32,11 +50,7 @@ router = APIRouter()
     dependencies=[Depends(check_token)],
 )
 async def create_room(payload: RoomSchema, uuid: int = Depends(get_uuid_from_xtoken)):
-    path = f"/users/{uuid}"
-    user, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
-    owner = f"{user['firstname']} {user['lastname']}"
+    owner = await UserDirectory.get_display_name(uuid)
 
     req_payload = payload.dict()
     req_payload.update({"owner_uuid": uuid, "owner": owner})
@@ -47,7 +61,7 @@ async def create_room(payload: RoomSchema, uuid: int = Depends(get_uuid_from_xto
     }
 
     # Create room in payment server and generate an ID
-    room_pay_srv, _ = Requester.payment_fetch(
+    room_pay_srv, _ = await Requester.payment_fetch(
         method="POST",
         path="/rooms",
         expected_statuses={HTTP_201_CREATED},
@@ -57,16 +71,31 @@ async def create_room(payload: RoomSchema, uuid: int = Depends(get_uuid_from_xto
     # Add id to the room created in room server
     req_payload["id"] = room_pay_srv["id"]
 
-    room, _ = Requester.room_srv_fetch(
+    room, _ = await Requester.room_srv_fetch(
         method="POST",
         path="/rooms",
         expected_statuses={HTTP_201_CREATED},
         payload=req_payload,
     )
+    RoomDirectory.update(room["id"], room)
+    RoomSearch.invalidate()
 
     return room
 
 
+def _parse_date_range(date_begins, date_ends):
+    try:
+        date_from = parser.parse(date_begins).date()
+        date_to = parser.parse(date_ends).date()
+    except (ValueError, OverflowError) as err:
+        raise BadRequestError("Invalid dates") from err
+
+    if date_from >= date_to:
+        raise BadRequestError("date_begins must be before date_ends")
+
+    return date_from, date_to
+
+
 @router.get("", response_model=RoomList, status_code=HTTP_200_OK)
 async def get_all_rooms(
     date_begins: Optional[str] = None,
@@ -78,52 +107,107 @@ async def get_all_rooms(
     max_price: Optional[int] = None,
     min_price: Optional[int] = None,
     allow_blocked: Optional[bool] = False,
-    only_blocked: Optional[bool] = False
+    only_blocked: Optional[bool] = False,
+    radius: Optional[float] = Query(None, gt=0),
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
 ):
-    query = "?"
-    path = "/rooms"
-
-    if date_begins is not None:
-        query = query + f"date_begins={date_begins}&"
-
-    if date_ends is not None:
-        query = query + f"date_ends={date_ends}&"
-
-    if longitude is not None:
-        query = query + f"longitude={longitude}&"
-
-    if latitude is not None:
-        query = query + f"latitude={latitude}&"
-
-    if people is not None:
-        query = query + f"people={people}&"
-
-    if types is not None:
-        for specific_type in types:
-            query = query + f"types={specific_type}&"
-
-    if min_price is not None:
-        query = query + f"min_price={min_price}&"
-
-    if max_price is not None:
-        query = query + f"max_price={max_price}&"
-
-    if allow_blocked is not None:
-        query = query + f"allow_blocked={allow_blocked}&"
-
-    if only_blocked is not None:
-        query = query + f"only_blocked={only_blocked}&"
-
-    if len(query) > 1:
-        # strip last & in the query
-        query = query[: (len(query) - 1)]
-        path = path + "/" + query
+    # searches by radius or by dates are answered from the in-memory indexes
+    by_radius = radius is not None and latitude is not None and longitude is not None
+    by_dates = date_begins is not None and date_ends is not None
+    location_given = latitude is not None or longitude is not None
+    dates_given = date_begins is not None or date_ends is not None
+    if (
+        room_index.ready and
+        not allow_blocked and
+        not only_blocked and
+        (by_radius or by_dates and not location_given) and
+        (by_dates and booking_index.ready or not dates_given)
+    ):
+        filters = {
+            "min_price": min_price,
+            "max_price": max_price,
+            "people": people,
+            "types": types,
+        }
+        if by_radius:
+            rooms = room_index.within_radius(latitude, longitude, radius, **filters)
+        else:
+            rooms = room_index.matching(**filters)
+
+        if by_dates:
+            date_from, date_to = _parse_date_range(date_begins, date_ends)
+            rooms = [
+                room
+                for room in rooms
+                if booking_index.is_free(room["id"], date_from, date_to)
+            ]
+
+        return paginate({"amount": len(rooms), "rooms": rooms}, "rooms", limit, cursor)
+
+    rooms = await RoomSearch.search(
+        {
+            "date_begins": date_begins,
+            "date_ends": date_ends,
+            "longitude": longitude,
+            "latitude": latitude,
+            "people": people,
+            "types": types,
+            "min_price": min_price,
+            "max_price": max_price,
+            "allow_blocked": allow_blocked,
+            "only_blocked": only_blocked,
+            "radius": radius,
+        }
+    )
+
+    return paginate(rooms, "rooms", limit, cursor)
+
+
+@router.get("/map", response_model=RoomMap, status_code=HTTP_200_OK)
+async def get_rooms_map(
+    south: float = Query(..., ge=-90, le=90),
+    west: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22),
+    people: Optional[int] = None,
+    types: List[str] = Query(None),
+    max_price: Optional[int] = None,
+    min_price: Optional[int] = None,
+):
+    if south > north:
+        raise BadRequestError("south must not be greater than north")
+
+    filters = {
+        "min_price": min_price,
+        "max_price": max_price,
+        "people": people,
+        "types": types,
+    }
 
-    rooms, _ = Requester.room_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    # a viewport crossing the antimeridian is split in two boxes
+    boxes = [(west, east)]
+    if west > east:
+        boxes = [(west, 180), (-180, east)]
+
+    if room_index.ready:
+        rooms = []
+        for box_west, box_east in boxes:
+            rooms.extend(
+                room_index.within_bbox(south, box_west, north, box_east, **filters)
+            )
+    else:
+        all_rooms = await RoomSearch.search(filters)
+        rooms = [
+            room
+            for room in all_rooms["rooms"]
+            if not room.get("blocked") and
+            south <= room["latitude"] <= north and
+            any(left <= room["longitude"] <= right for left, right in boxes)
+        ]
 
-    return rooms
+    return build_map(rooms, zoom)
 
 
 @router.get(
@@ -136,16 +220,14 @@ async def get_room(
     room_id: int,
     uuid: int = Depends(get_uuid_from_xtoken)
 ):
-    path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
-
-    path = f"/users/{uuid}/favorite_rooms/{room_id}"
-    favorite_room, _ = Requester.user_srv_fetch(
-        method="GET",
-        path=path,
-        expected_statuses={HTTP_200_OK, HTTP_404_NOT_FOUND},
+    favorite_path = f"/users/{uuid}/favorite_rooms/{room_id}"
+    room, (favorite_room, _) = await Requester.fan_out(
+        RoomDirectory.get_room(room_id),
+        Requester.user_srv_fetch(
+            method="GET",
+            path=favorite_path,
+            expected_statuses={HTTP_200_OK, HTTP_404_NOT_FOUND},
+        ),
     )
 
     if "room_id" in favorite_room.keys():
@@ -165,10 +247,7 @@ async def update_room(
     room_id: int,
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.has_permission_to_modify(viewer_uuid, room["owner_uuid"]):
         raise BadRequestError("You can't update other users rooms!")
@@ -176,12 +255,14 @@ async def update_room(
     room_req_payload = payload.dict(exclude_unset=True)
 
     path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch(
+    room, _ = await Requester.room_srv_fetch(
         method="PATCH",
         path=path,
         expected_statuses={HTTP_200_OK},
         payload=room_req_payload,
     )
+    RoomDirectory.update(room_id, room)
+    RoomSearch.invalidate()
 
     # TODO: Patch room price in payment server
 
@@ -195,20 +276,19 @@ async def update_room(
     dependencies=[Depends(check_token)],
 )
 async def delete_room(room_id: int, viewer_uuid: int = Depends(get_uuid_from_xtoken)):
-    path = "/rooms" + f"/{room_id}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.has_permission_to_modify(viewer_uuid, room["owner_uuid"]):
         raise BadRequestError("You can't delete other users rooms!")
 
     path = "/rooms" + f"/{room_id}"
-    room, _ = Requester.room_srv_fetch(
+    room, _ = await Requester.room_srv_fetch(
         method="DELETE", path=path, expected_statuses={HTTP_200_OK}
     )
+    RoomDirectory.invalidate(room_id)
+    RoomSearch.invalidate()
 
-    room_pay, _ = Requester.payment_fetch(
+    room_pay, _ = await Requester.payment_fetch(
         method="DELETE", path=path, expected_statuses={HTTP_200_OK}
     )
 
@@ -230,25 +310,18 @@ async def rate_room(
     room_id: int,
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    room_path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=room_path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.has_permission_to_comment(viewer_uuid, room["owner_uuid"]):
         raise BadRequestError("You can't rate your own rooms!")
 
-    user_path = f"/users/{viewer_uuid}"
-    user, _ = Requester.user_srv_fetch(
-        method="GET", path=user_path, expected_statuses={HTTP_200_OK}
-    )
-    reviewer_name = f"{user['firstname']} {user['lastname']}"
+    reviewer_name = await UserDirectory.get_display_name(viewer_uuid)
 
     rating_req_payload = payload.dict()
     rating_req_payload.update({"reviewer": reviewer_name, "reviewer_id": viewer_uuid})
 
     room_rating_path = f"/rooms/{room_id}/ratings"
-    rating, _ = Requester.room_srv_fetch(
+    rating, _ = await Requester.room_srv_fetch(
         method="POST",
         path=room_rating_path,
         expected_statuses={HTTP_201_CREATED},
@@ -256,7 +329,7 @@ async def rate_room(
     )
 
     # Send notification
-    notifier.send_new_room_rating_notification(
+    await notifier.send_new_room_rating_notification(
         reviewer_name, room["title"], rating_req_payload["rating"], room["owner_uuid"]
     )
 
@@ -270,7 +343,7 @@ async def rate_room(
 )
 async def get_room_rating(room_id: int, rating_id: int):
     path = f"/rooms/{room_id}/ratings/{rating_id}"
-    rating, _ = Requester.room_srv_fetch(
+    rating, _ = await Requester.room_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return rating
@@ -281,7 +354,7 @@ async def get_room_rating(room_id: int, rating_id: int):
 )
 async def get_all_room_ratings(room_id: int):
     path = f"/rooms/{room_id}/ratings"
-    ratings, _ = Requester.room_srv_fetch(
+    ratings, _ = await Requester.room_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return ratings
@@ -299,7 +372,7 @@ async def delete_room_rating(
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
     room_path = f"/rooms/{room_id}/ratings/{rating_id}"
-    rating, _ = Requester.room_srv_fetch(
+    rating, _ = await Requester.room_srv_fetch(
         method="GET", path=room_path, expected_statuses={HTTP_200_OK}
     )
 
@@ -307,7 +380,7 @@ async def delete_room_rating(
         raise BadRequestError("You can't delete other users room ratings!")
 
     rating_path = f"/rooms/{room_id}/ratings/{rating_id}"
-    rating, _ = Requester.room_srv_fetch(
+    rating, _ = await Requester.room_srv_fetch(
         method="DELETE", path=rating_path, expected_statuses={HTTP_200_OK}
     )
     return rating
@@ -328,25 +401,18 @@ async def review_room(
     room_id: int,
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    room_path = "/rooms" + f"/{room_id}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=room_path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.has_permission_to_comment(viewer_uuid, room["owner_uuid"]):
         raise BadRequestError("You can't review your own rooms!")
 
-    user_path = "/users" + f"/{viewer_uuid}"
-    user, _ = Requester.user_srv_fetch(
-        method="GET", path=user_path, expected_statuses={HTTP_200_OK}
-    )
-    reviewer_name = f"{user['firstname']} {user['lastname']}"
+    reviewer_name = await UserDirectory.get_display_name(viewer_uuid)
 
     review_payload = payload.dict()
     review_payload.update({"reviewer": reviewer_name, "reviewer_id": viewer_uuid})
 
     review_path = "/rooms" + f"/{room_id}/reviews"
-    review, _ = Requester.room_srv_fetch(
+    review, _ = await Requester.room_srv_fetch(
         method="POST",
         path=review_path,
         expected_statuses={HTTP_201_CREATED},
@@ -354,7 +420,7 @@ async def review_room(
     )
 
     # Send notification
-    notifier.send_new_room_review_notification(
+    await notifier.send_new_room_review_notification(
         reviewer_name, room["title"], room["owner_uuid"]
     )
 
@@ -368,7 +434,7 @@ async def review_room(
 )
 async def get_room_review(room_id: int, review_id: int):
     path = "/rooms" + f"/{room_id}/reviews/{review_id}"
-    review, _ = Requester.room_srv_fetch(
+    review, _ = await Requester.room_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return review
@@ -379,7 +445,7 @@ async def get_room_review(room_id: int, review_id: int):
 )
 async def get_all_room_reviews(room_id: int):
     path = "/rooms" + f"/{room_id}/reviews"
-    reviews, _ = Requester.room_srv_fetch(
+    reviews, _ = await Requester.room_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return reviews
@@ -397,14 +463,14 @@ async def delete_room_review(
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
     review_path = f"/rooms/{room_id}/reviews/{review_id}"
-    review, _ = Requester.room_srv_fetch(
+    review, _ = await Requester.room_srv_fetch(
         method="GET", path=review_path, expected_statuses={HTTP_200_OK}
     )
 
     if not AuthSender.has_permission_to_modify(viewer_uuid, review["reviewer_id"]):
         raise BadRequestError("You can't delete other users room reviews!")
 
-    review, _ = Requester.room_srv_fetch(
+    review, _ = await Requester.room_srv_fetch(
         method="DELETE", path=review_path, expected_statuses={HTTP_200_OK}
     )
     return review
@@ -425,10 +491,7 @@ async def create_room_comment(
     room_id: int,
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    room_path = "/rooms" + f"/{room_id}"
-    room, _ = Requester.room_srv_fetch(
-        method="GET", path=room_path, expected_statuses={HTTP_200_OK}
-    )
+    room = await RoomDirectory.get_room(room_id)
 
     if (
         (payload.dict()["main_comment_id"] is None) and
@@ -436,17 +499,13 @@ async def create_room_comment(
     ):
         raise BadRequestError("You can't comment your own rooms!")
 
-    user_path = "/users" + f"/{viewer_uuid}"
-    user, _ = Requester.user_srv_fetch(
-        method="GET", path=user_path, expected_statuses={HTTP_200_OK}
-    )
-    commentator = f"{user['firstname']} {user['lastname']}"
+    commentator = await UserDirectory.get_display_name(viewer_uuid)
 
     comment_payload = payload.dict()
     comment_payload.update({"commentator": commentator, "commentator_id": viewer_uuid})
 
     comment_path = "/rooms" + f"/{room_id}/comments"
-    comment, _ = Requester.room_srv_fetch(
+    comment, _ = await Requester.room_srv_fetch(
         method="POST",
         path=comment_path,
         expected_statuses={HTTP_201_CREATED},
@@ -456,22 +515,22 @@ async def create_room_comment(
     # Send notifications
     if (comment_payload["main_comment_id"] is None):
         # send notification to room_owner
-        notifier.send_new_comment_notification(
+        await notifier.send_new_comment_notification(
             commentator, room["title"], room["owner_uuid"]
         )
     elif (viewer_uuid == room["owner_uuid"]):
         # send notification answer to main_comment_owner
-        main_comment, _ = Requester.room_srv_fetch(
+        main_comment, _ = await Requester.room_srv_fetch(
             method="GET",
             path=comment_path + f'/{comment_payload["main_comment_id"]}',
             expected_statuses={HTTP_200_OK}
         )
-        notifier.send_answered_comment_notification(
+        await notifier.send_answered_comment_notification(
             commentator, room["title"], main_comment["commentator_id"]
         )
     else:
         # send notification answer to owner
-        notifier.send_answered_comment_notification(
+        await notifier.send_answered_comment_notification(
             commentator, room["title"], room["owner_uuid"]
         )
 
@@ -483,7 +542,7 @@ async def create_room_comment(
 )
 async def get_all_room_comments(room_id: int):
     path = "/rooms" + f"/{room_id}/comments"
-    comments, _ = Requester.room_srv_fetch(
+    comments, _ = await Requester.room_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return comments
@@ -501,14 +560,14 @@ async def delete_room_comment(
     viewer_uuid: int = Depends(get_uuid_from_xtoken),
 ):
     comment_path = f"/rooms/{room_id}/comments/{comment_id}"
-    comment, _ = Requester.room_srv_fetch(
+    comment, _ = await Requester.room_srv_fetch(
         method="GET", path=comment_path, expected_statuses={HTTP_200_OK}
     )
 
     if not AuthSender.has_permission_to_modify(viewer_uuid, comment["commentator_id"]):
         raise BadRequestError("You can't delete other users room comments!")
 
-    comment, _ = Requester.room_srv_fetch(
+    comment, _ = await Requester.room_srv_fetch(
         method="DELETE", path=comment_path, expected_statuses={HTTP_200_OK}
     )
     return comment
@@ -530,31 +589,118 @@ async def add_room_picture(
     db: Session = Depends(get_db),
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    room_path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch("GET", room_path, {HTTP_200_OK})
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.has_permission_to_modify(room["owner_uuid"], uuid):
         raise UnauthorizedRequestError("You can't add photos to another user room!")
 
-    image_url, firebase_id = photouploader.upload_room_photo(file, room_id)
+    return await _add_room_photo(db, room_id, file, asyncio.Lock())
+
+
+@router.post(
+    "/{room_id}/photos/batch",
+    response_model=RoomPhotoBatch,
+    status_code=HTTP_201_CREATED,
+    dependencies=[Depends(check_token)],
+)
+async def add_room_pictures(
+    room_id: int,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    uuid: int = Depends(get_uuid_from_xtoken),
+):
+    if len(files) > PHOTO_BATCH_MAX_FILES:
+        raise BadRequestError(
+            f"Can't upload more than {PHOTO_BATCH_MAX_FILES} photos at once"
+        )
+
+    room = await RoomDirectory.get_room(room_id)
+
+    if not AuthSender.has_permission_to_modify(room["owner_uuid"], uuid):
+        raise UnauthorizedRequestError("You can't add photos to another user room!")
+
+    semaphore = asyncio.Semaphore(PHOTO_BATCH_PARALLELISM)
+    db_lock = asyncio.Lock()
+
+    async def add_photo(file):
+        result = {"filename": file.filename, "photo": None, "error": None}
+        async with semaphore:
+            try:
+                result["photo"] = await _add_room_photo(db, room_id, file, db_lock)
+            except HTTPException as err:
+                result["error"] = err.detail
+            except Exception:  # pylint: disable=broad-except
+                # one failed photo must not fail the photos next to it
+                logger.exception(
+                    "Failed to add photo %s to room %s", file.filename, room_id
+                )
+                result["error"] = "The photo could not be stored"
+
+        return result
+
+    results = await asyncio.gather(*(add_photo(file) for file in files))
+
+    return {"amount": len(results), "room_id": room_id, "results": results}
+
+
+async def _add_room_photo(db, room_id, file, db_lock):
+    # the queries run in worker threads, one at a time as they share the session
+    async def find_duplicate(content_hash):
+        async with db_lock:
+            return await run_in_threadpool(
+                RoomPhotoDAO.get_room_photo_by_hash, db, content_hash
+            )
+
+    photo = await photouploader.upload_room_photo(file, room_id, find_duplicate)
+    new_photo_request = {k: v for k, v in photo.items() if k != "content_hash"}
 
     room_photo_path = f"/rooms/{room_id}/photos"
-    new_photo_request = {"url": image_url, "firebase_id": firebase_id}
-    photo_response, _ = Requester.room_srv_fetch(
+    photo_response, _ = await Requester.room_srv_fetch(
         "POST", room_photo_path, {HTTP_201_CREATED}, payload=new_photo_request
     )
-    # photo_id = photo_response["id"]
-
-    # RoomPhotoDAO.add_new_room_photo(db, firebase_id, photo_id)
+    # the post server may not store the variants, the client still gets them
+    for key, value in new_photo_request.items():
+        photo_response.setdefault(key, value)
+
+    # indexed by content so the same picture is not uploaded twice
+    async with db_lock:
+        await run_in_threadpool(
+            RoomPhotoDAO.add_new_room_photo,
+            db,
+            photo["firebase_id"],
+            photo_response["id"],
+            photo,
+        )
     return photo_response
 
 
+async def _add_variant_urls(db, photos):
+    # the post server may not store the variants, the appserver does
+    stored_photos = await run_in_threadpool(
+        RoomPhotoDAO.get_room_photos_by_firebase_ids,
+        db,
+        [photo["firebase_id"] for photo in photos],
+    )
+    for photo in photos:
+        stored_photo = stored_photos.get(photo["firebase_id"])
+        if stored_photo is None:
+            continue
+
+        for key in ("thumbnail_url", "medium_url"):
+            if photo.get(key) is None:
+                photo[key] = stored_photo[key]
+
+
 @router.get("/{room_id}/photos", response_model=RoomPhotoList, status_code=HTTP_200_OK)
 async def get_all_room_photos(
     room_id: int,
+    db: Session = Depends(get_db),
 ):
     room_photo_path = f"/rooms/{room_id}/photos"
-    photo_response, _ = Requester.room_srv_fetch("GET", room_photo_path, {HTTP_200_OK})
+    photo_response, _ = await Requester.room_srv_fetch(
+        "GET", room_photo_path, {HTTP_200_OK}
+    )
+    await _add_variant_urls(db, photo_response["room_photos"])
     return photo_response
 
 
@@ -574,7 +720,10 @@ async def get_room_photo(
     # room_photo_path = f"/rooms/{room_id}/photos/{photo_id}"
     room_photo_path = f"/rooms/{room_id}/photos/{firebase_id}"
 
-    photo_response, _ = Requester.room_srv_fetch("GET", room_photo_path, {HTTP_200_OK})
+    photo_response, _ = await Requester.room_srv_fetch(
+        "GET", room_photo_path, {HTTP_200_OK}
+    )
+    await _add_variant_urls(db, [photo_response])
     return photo_response
 
 
@@ -590,8 +739,7 @@ async def delete_room_photo(
     db: Session = Depends(get_db),
     uuid: int = Depends(get_uuid_from_xtoken),
 ):
-    room_path = f"/rooms/{room_id}"
-    room, _ = Requester.room_srv_fetch("GET", room_path, {HTTP_200_OK})
+    room = await RoomDirectory.get_room(room_id)
 
     if not AuthSender.has_permission_to_modify(room["owner_uuid"], uuid):
         raise UnauthorizedRequestError("You can't delete photos of another user room!")
@@ -603,7 +751,7 @@ async def delete_room_photo(
 
     # room_photo_path = f"/rooms/{room_id}/photos/{photo_id}"
     room_photo_path = f"/rooms/{room_id}/photos/{firebase_id}"
-    photo_response, _ = Requester.room_srv_fetch(
+    photo_response, _ = await Requester.room_srv_fetch(
         "DELETE", room_photo_path, {HTTP_200_OK}
     )
     return photo_response
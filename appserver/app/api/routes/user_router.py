@@ -12,6 +12,7 @@ from app.dependencies import check_token, get_uuid_from_xtoken
 from app.errors.http_error import UnauthorizedRequestError
 from app.services.authsender import AuthSender
 from app.services.requester import Requester
+from app.services.user_directory import UserDirectory
 from app.services.notifier import notifier
 from fastapi import APIRouter, Depends, Header
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
@@ -33,7 +34,7 @@ async def create_user(
 ):
     auth_payload = {"email": payload.dict()["email"]}
     auth_header = {"x-access-token": x_access_token}
-    registered_user, _ = Requester.auth_srv_fetch(
+    registered_user, _ = await Requester.auth_srv_fetch(
         method="POST",
         path="/user/registered",
         expected_statuses={HTTP_201_CREATED},
@@ -43,7 +44,7 @@ async def create_user(
     path = "/users"
     payload_user = payload.dict()
     payload_user.update({"id": registered_user["uuid"]})
-    user, _ = Requester.user_srv_fetch(
+    user, _ = await Requester.user_srv_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -53,7 +54,7 @@ async def create_user(
     # create wallet
     path = "/wallets"
     payload_wallet = {"uuid": registered_user["uuid"]}
-    wallet, _ = Requester.payment_fetch(
+    wallet, _ = await Requester.payment_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -66,7 +67,7 @@ async def create_user(
 @router.get("/{user_id}", response_model=UserDB, status_code=HTTP_200_OK)
 async def get_user(user_id: int):
     path = f"/users/{user_id}"
-    user, _ = Requester.user_srv_fetch(
+    user, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user
@@ -87,12 +88,14 @@ async def update_user(
         raise UnauthorizedRequestError("You can't update info about other users")
 
     path = f"/users/{user_id}"
-    new_user_info, _ = Requester.user_srv_fetch(
+    new_user_info, _ = await Requester.user_srv_fetch(
         method="PATCH",
         path=path,
         expected_statuses={HTTP_200_OK},
         payload=payload.dict(exclude_unset=True),
     )
+    UserDirectory.invalidate(user_id)
+
     return new_user_info
 
 
@@ -110,25 +113,29 @@ async def delete_user(
         raise UnauthorizedRequestError("You can't delete other users")
 
     path = f"/users/{user_id}"
-    new_user_info, _ = Requester.user_srv_fetch(
+    new_user_info, _ = await Requester.user_srv_fetch(
         method="DELETE", path=path, expected_statuses={HTTP_200_OK}
     )
 
     auth_path = f"/user/registered/{uuid}"
-    Requester.auth_srv_fetch(
+    await Requester.auth_srv_fetch(
         "DELETE",
         path=auth_path,
         expected_statuses={HTTP_200_OK},
         extra_headers=auth_header
     )
 
+    # the deleted user tokens must not be accepted from the cache
+    AuthSender.invalidate_user_tokens(user_id)
+    UserDirectory.invalidate(user_id)
+
     return new_user_info
 
 
 @router.get("", response_model=UserListSchema, status_code=HTTP_200_OK)
 async def get_all_users():
     path = "/users"
-    users, _ = Requester.user_srv_fetch(
+    users, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return users
@@ -154,19 +161,16 @@ async def create_host_review(
     if not AuthSender.has_permission_to_comment(uuid, user_id):
         raise UnauthorizedRequestError("You can't create a review of yourself")
 
-    path = f"/users/{uuid}"
-    me, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    reviewer_name = await UserDirectory.get_display_name(uuid)
 
     new_payload = {
         "review": payload.dict()["review"],
-        "reviewer": f"{me['firstname']} {me['lastname']}",
+        "reviewer": reviewer_name,
         "reviewer_id": uuid,
     }
 
     path = f"/users/{user_id}/host_reviews"
-    review, _ = Requester.user_srv_fetch(
+    review, _ = await Requester.user_srv_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -174,7 +178,7 @@ async def create_host_review(
     )
 
     # Send notification
-    notifier.send_new_user_host_review_notification(
+    await notifier.send_new_user_host_review_notification(
         new_payload["reviewer"], user_id
     )
 
@@ -195,19 +199,16 @@ async def create_host_rating(
     if not AuthSender.has_permission_to_comment(uuid, user_id):
         raise UnauthorizedRequestError("You can't create a rating of yourself")
 
-    path = f"/users/{uuid}"
-    me, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    reviewer_name = await UserDirectory.get_display_name(uuid)
 
     new_payload = {
         "rating": payload.dict()["rating"],
-        "reviewer": f"{me['firstname']} {me['lastname']}",
+        "reviewer": reviewer_name,
         "reviewer_id": uuid,
     }
 
     path = f"/users/{user_id}/host_ratings"
-    rating, _ = Requester.user_srv_fetch(
+    rating, _ = await Requester.user_srv_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -215,7 +216,7 @@ async def create_host_rating(
     )
 
     # Send notification
-    notifier.send_new_user_host_rating_notification(
+    await notifier.send_new_user_host_rating_notification(
         new_payload["reviewer"], new_payload["rating"], user_id
     )
 
@@ -236,19 +237,16 @@ async def create_guest_review(
     if not AuthSender.has_permission_to_comment(uuid, user_id):
         raise UnauthorizedRequestError("You can't create a review of yourself")
 
-    path = f"/users/{uuid}"
-    me, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    reviewer_name = await UserDirectory.get_display_name(uuid)
 
     new_payload = {
         "review": payload.dict()["review"],
-        "reviewer": f"{me['firstname']} {me['lastname']}",
+        "reviewer": reviewer_name,
         "reviewer_id": uuid,
     }
 
     path = f"/users/{user_id}/guest_reviews"
-    review, _ = Requester.user_srv_fetch(
+    review, _ = await Requester.user_srv_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -256,7 +254,7 @@ async def create_guest_review(
     )
 
     # Send notification
-    notifier.send_new_user_guest_review_notification(
+    await notifier.send_new_user_guest_review_notification(
         new_payload["reviewer"], user_id
     )
 
@@ -277,19 +275,16 @@ async def create_guest_rating(
     if not AuthSender.has_permission_to_comment(uuid, user_id):
         raise UnauthorizedRequestError("You can't create a rating yourself")
 
-    path = f"/users/{uuid}"
-    me, _ = Requester.user_srv_fetch(
-        method="GET", path=path, expected_statuses={HTTP_200_OK}
-    )
+    reviewer_name = await UserDirectory.get_display_name(uuid)
 
     new_payload = {
         "rating": payload.dict()["rating"],
-        "reviewer": f"{me['firstname']} {me['lastname']}",
+        "reviewer": reviewer_name,
         "reviewer_id": uuid,
     }
 
     path = f"/users/{user_id}/guest_ratings"
-    rating, _ = Requester.user_srv_fetch(
+    rating, _ = await Requester.user_srv_fetch(
         method="POST",
         path=path,
         expected_statuses={HTTP_201_CREATED},
@@ -297,7 +292,7 @@ async def create_guest_rating(
     )
 
     # Send notification
-    notifier.send_new_user_guest_rating_notification(
+    await notifier.send_new_user_guest_rating_notification(
         new_payload["reviewer"], new_payload["rating"], user_id
     )
 
@@ -309,7 +304,7 @@ async def create_guest_rating(
 )
 async def get_host_reviews(user_id: int):
     path = f"/users/{user_id}/host_reviews"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -320,7 +315,7 @@ async def get_host_reviews(user_id: int):
 )
 async def get_host_ratings(user_id: int):
     path = f"/users/{user_id}/host_ratings"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -331,7 +326,7 @@ async def get_host_ratings(user_id: int):
 )
 async def get_guest_reviews(user_id: int):
     path = f"/users/{user_id}/guest_reviews"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -342,7 +337,7 @@ async def get_guest_reviews(user_id: int):
 )
 async def get_guest_ratings(user_id: int):
     path = f"/users/{user_id}/guest_ratings"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -355,7 +350,7 @@ async def get_guest_ratings(user_id: int):
 )
 async def get_single_host_review(user_id: int, review_id: int):
     path = f"/users/{user_id}/host_reviews/{review_id}"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -368,7 +363,7 @@ async def get_single_host_review(user_id: int, review_id: int):
 )
 async def get_single_host_rating(user_id: int, rating_id: int):
     path = f"/users/{user_id}/host_ratings/{rating_id}"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -381,7 +376,7 @@ async def get_single_host_rating(user_id: int, rating_id: int):
 )
 async def get_single_guest_review(user_id: int, review_id: int):
     path = f"/users/{user_id}/guest_reviews/{review_id}"
-    user_reviews, _ = Requester.user_srv_fetch(
+    user_reviews, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_reviews
@@ -394,7 +389,7 @@ async def get_single_guest_review(user_id: int, review_id: int):
 )
 async def get_single_guest_rating(user_id: int, rating_id: int):
     path = f"/users/{user_id}/guest_ratings/{rating_id}"
-    user_ratings, _ = Requester.user_srv_fetch(
+    user_ratings, _ = await Requester.user_srv_fetch(
         method="GET", path=path, expected_statuses={HTTP_200_OK}
     )
     return user_ratings
@@ -414,7 +409,7 @@ async def delete_host_review(
     if not AuthSender.has_permission_to_modify(uuid, user_id):
         raise UnauthorizedRequestError("You can't delete a review of another user")
 
-    review, _ = Requester.user_srv_fetch(
+    review, _ = await Requester.user_srv_fetch(
         method="DELETE", path=review_path, expected_statuses={HTTP_200_OK}
     )
     return review
@@ -434,7 +429,7 @@ async def delete_host_rating(
     if not AuthSender.has_permission_to_modify(uuid, user_id):
         raise UnauthorizedRequestError("You can't delete a rating of another user")
 
-    review, _ = Requester.user_srv_fetch(
+    review, _ = await Requester.user_srv_fetch(
         method="DELETE", path=rating_path, expected_statuses={HTTP_200_OK}
     )
     return review
@@ -454,7 +449,7 @@ async def delete_guest_review(
     if not AuthSender.has_permission_to_modify(uuid, user_id):
         raise UnauthorizedRequestError("You can't delete a review of another user")
 
-    review, _ = Requester.user_srv_fetch(
+    review, _ = await Requester.user_srv_fetch(
         method="DELETE", path=review_path, expected_statuses={HTTP_200_OK}
     )
     return review
@@ -474,7 +469,7 @@ async def delete_guest_rating(
     if not AuthSender.has_permission_to_modify(uuid, user_id):
         raise UnauthorizedRequestError("You can't delete a rating of another user")
 
-    review, _ = Requester.user_srv_fetch(
+    review, _ = await Requester.user_srv_fetch(
         method="DELETE", path=rating_path, expected_statuses={HTTP_200_OK}
     )
     return review
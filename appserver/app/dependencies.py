@@ -13,10 +13,10 @@ async def check_token(x_access_token: Optional[str] = Header(None)):
         logger.warning("No access token in header")
         raise ae.MissingTokenError()
 
-    if not AuthSender.is_valid_token(x_access_token):
+    if not await AuthSender.is_valid_token(x_access_token):
         logger.warning("Invalid access token")
         raise ae.InvalidIdTokenError()
 
 
 async def get_uuid_from_xtoken(x_access_token: Optional[str] = Header(None)):
-    return AuthSender.get_uuid_from_token(x_access_token)
+    return await AuthSender.get_uuid_from_token(x_access_token)
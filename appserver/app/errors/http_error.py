@@ -18,6 +18,11 @@ class BadGatewayError(HTTPException):
         super().__init__(status_code=400, detail=message)
 
 
+class PayloadTooLargeError(HTTPException):
+    def __init__(self, message):
+        super().__init__(status_code=413, detail=message)
+
+
 class UnauthorizedRequestError(HTTPException):
     def __init__(self, message):
         super().__init__(status_code=401, detail=message)
@@ -26,3 +31,8 @@ class UnauthorizedRequestError(HTTPException):
 class NotAllowedRequestError(HTTPException):
     def __init__(self, message):
         super().__init__(status_code=405, detail=message)
+
+
+class ConflictError(HTTPException):
+    def __init__(self, message):
+        super().__init__(status_code=409, detail=message)
@@ -4,6 +4,17 @@ import os
 from app.api.routes import booking_router, me_router, room_router, user_router, recomendation_router
 from app.db import Base, engine
 from app.errors.auth_error import AuthException
+from app.services.authsender import AuthSender
+from app.services.availability import booking_index
+from app.services.chat_hub import chat_hub
+from app.services.notifier import notifier
+from app.services.photouploader import photouploader
+from app.services.requester import Requester
+from app.services.room_directory import RoomDirectory
+from app.services.room_index import room_index
+from app.services.room_search import RoomSearch
+from app.services.token_verifier import token_verifier
+from app.services.user_directory import UserDirectory
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
@@ -27,11 +38,46 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_background_services():
+    token_verifier.start_refresh()
+    notifier.start()
+    room_index.start_refresh()
+    booking_index.start_refresh()
+
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    token_verifier.stop_refresh()
+    room_index.stop_refresh()
+    booking_index.stop_refresh()
+    # pending notifications are delivered before the upstreams go away
+    await notifier.drain()
+    Requester.close_sessions()
+    photouploader.close()
+
+
 @app.get("/ping")
 async def pong():
     return {"message": "appserver"}
 
 
+@app.get("/stats")
+async def stats():
+    return {
+        "upstreams": Requester.pool_stats(),
+        "caches": {
+            "auth_tokens": AuthSender.token_cache.stats(),
+            "users": UserDirectory.stats(),
+            "rooms": RoomDirectory.stats(),
+            "room_searches": RoomSearch.stats(),
+        },
+        "notifications": notifier.stats(),
+        "chat_streams": chat_hub.stats(),
+        "photo_uploads": photouploader.stats.serialize(),
+    }
+
+
 @app.exception_handler(AuthException)
 async def auth_exception_handler(_request, exc):
     error = {"error": exc.detail}
@@ -1,5 +1,5 @@
 from app.db import Base
-from sqlalchemy import Column, Integer
+from sqlalchemy import BigInteger, Column, Integer, String
 
 
 class RoomPhoto(Base):
@@ -7,16 +7,36 @@ class RoomPhoto(Base):
     __tablename__ = "room_photos"
 
     id = Column("id", Integer, primary_key=True)
-    firebase_id = Column(Integer, nullable=False)
+    firebase_id = Column(BigInteger, nullable=False)
     room_photo_id = Column(Integer, nullable=False)
+    content_hash = Column(String(64), index=True)
+    url = Column(String)
+    thumbnail_url = Column(String)
+    medium_url = Column(String)
 
-    def __init__(self, firebase_id, room_photo_id):
+    def __init__(
+        self,
+        firebase_id,
+        room_photo_id,
+        content_hash=None,
+        url=None,
+        thumbnail_url=None,
+        medium_url=None,
+    ):
         self.firebase_id = firebase_id
         self.room_photo_id = room_photo_id
+        self.content_hash = content_hash
+        self.url = url
+        self.thumbnail_url = thumbnail_url
+        self.medium_url = medium_url
 
     def serialize(self):
         return {
             "id": self.id,
             "firebase_id": self.firebase_id,
             "room_photo_id": self.room_photo_id,
+            "content_hash": self.content_hash,
+            "url": self.url,
+            "thumbnail_url": self.thumbnail_url,
+            "medium_url": self.medium_url,
         }
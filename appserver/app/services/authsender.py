@@ -1,9 +1,15 @@
+import hashlib
 import logging
 import os
+import time
 from typing import Any, Dict, List
 
 from app.errors.http_error import NotFoundError
 from app.services.requester import Requester
+from app.services.token_verifier import token_verifier
+from app.utils.cache import TTLCache
+from app.utils.jwt_utils import get_expiration
+from fastapi import HTTPException
 from starlette.status import HTTP_200_OK
 
 logger = logging.getLogger(__name__)
@@ -13,32 +19,51 @@ class AuthSender:
     url = os.environ["AUTHSERVER_URL"]
     mock_db: List[Dict[str, Any]] = []
 
+    token_cache = TTLCache(
+        max_entries=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000")),
+        ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+    )
+
     @classmethod
     def tkn_hdr(cls, token):
         return {"x-access-token": token}
 
     @classmethod
-    def is_valid_token(cls, token):
-        response, code = Requester.auth_srv_fetch(
-            method="POST",
-            path="/auth/sign-in",
-            expected_statuses={HTTP_200_OK},
-            payload={},
-            extra_headers=cls.tkn_hdr(token),
-        )
-        logger.debug(
-            "Auth server validate token response: %s, status_code: %s", response, code
-        )
+    async def is_valid_token(cls, token):
+        try:
+            await cls.verify_token(token)
+        except HTTPException as err:
+            if err.status_code >= 500:
+                raise
+            return False
 
-        return code == 200
+        return True
 
     @classmethod
-    def get_uuid_from_token(cls, token):
-        # if not cls.url:
-        #    cls._mock_get_info(int(token))
-        #    return int(token)
+    async def get_uuid_from_token(cls, token):
+        return await cls.verify_token(token)
+
+    @classmethod
+    async def verify_token(cls, token):
+        """
+        Returns the uuid of the token owner. The token signature is
+        checked locally when possible, otherwise a single auth server
+        call both validates the token and resolves the uuid. The
+        result is cached until the token expires
+        """
+        key = cls._token_key(token)
+        uuid = cls.token_cache.get(key)
+        if uuid is not None:
+            logger.debug("Token verification cache hit for uuid: %d", uuid)
+            return uuid
+
+        uuid = token_verifier.verify(token)
+        if uuid is not None:
+            logger.debug("Token verified locally for uuid: %d", uuid)
+            cls.token_cache.set(key, uuid, ttl=cls._token_ttl(token))
+            return uuid
 
-        response, code = Requester.auth_srv_fetch(
+        response, code = await Requester.auth_srv_fetch(
             method="GET",
             path="/user/id",
             expected_statuses={HTTP_200_OK},
@@ -52,8 +77,33 @@ class AuthSender:
         if code != 200:
             raise NotFoundError("User")
 
-        logger.info("Obtained user uuid: %d", response["uuid"])
-        return response["uuid"]
+        uuid = response["uuid"]
+        cls.token_cache.set(key, uuid, ttl=cls._token_ttl(token))
+
+        logger.info("Obtained user uuid: %d", uuid)
+        return uuid
+
+    @classmethod
+    def invalidate_token(cls, token):
+        cls.token_cache.pop(cls._token_key(token))
+
+    @classmethod
+    def invalidate_user_tokens(cls, uuid):
+        removed = cls.token_cache.discard_if(lambda _key, value: value == uuid)
+        logger.info("Invalidated %d cached tokens of uuid: %d", removed, uuid)
+
+    @classmethod
+    def _token_key(cls, token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def _token_ttl(cls, token):
+        # never trust a cached verification past the token expiration
+        expiration = get_expiration(token)
+        if expiration is None:
+            return cls.token_cache.ttl
+
+        return min(cls.token_cache.ttl, expiration - time.time())
 
     @classmethod
     def has_permission_to_modify(cls, viewer_id, user_id):
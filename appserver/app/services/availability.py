@@ -0,0 +1,183 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from datetime import date, timedelta
+
+from app.services.requester import Requester
+from fastapi import HTTPException
+from requests.exceptions import RequestException
+from starlette.status import HTTP_200_OK
+
+logger = logging.getLogger(__name__)
+
+
+def parse_booking_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+
+def payment_booking_to_index(payment_booking):
+    return {
+        "id": payment_booking["id"],
+        "room_id": payment_booking["roomId"],
+        "date_from": payment_booking["dateFrom"],
+        "date_to": payment_booking["dateTo"],
+        "booking_status": payment_booking["bookingStatus"],
+    }
+
+
+class BookingIndex:
+    """
+    Booked date ranges of every room, sorted by their first night.
+    A booking from date_from to date_to takes the nights in between,
+    so a stay can start the day another one ends. Bookings rejected by
+    the owner (status in rejected_statuses) do not take any night.
+    It is loaded from the payment server bookings every refresh_interval
+    seconds and kept up to date with the bookings made through the
+    appserver. Until the first load it is not ready
+    """
+
+    def __init__(self, refresh_interval=60, rejected_statuses=(3,)):
+        self.refresh_interval = refresh_interval
+        self.rejected_statuses = set(rejected_statuses)
+
+        self._starts = {}
+        self._ranges = {}
+        self._longest = {}
+        self._booking_rooms = {}
+        self.loaded_at = None
+        self._refresh_task = None
+        # changes made while a snapshot is being fetched, replayed on it
+        self._journal = None
+
+    @property
+    def ready(self):
+        return self.loaded_at is not None
+
+    def clear(self):
+        self._starts = {}
+        self._ranges = {}
+        self._longest = {}
+        self._booking_rooms = {}
+        self.loaded_at = None
+
+    def load(self, bookings):
+        self.clear()
+        for booking in bookings:
+            self._add(booking)
+
+        self.loaded_at = time.monotonic()
+        logger.info("Loaded %d bookings in the booking index", len(self._booking_rooms))
+
+    def add(self, booking):
+        """Adds a booking, in the snake case format of BookingDB"""
+        if self._journal is not None:
+            self._journal.append((self._add, booking))
+        self._add(booking)
+
+    def remove(self, booking_id):
+        if self._journal is not None:
+            self._journal.append((self._remove, booking_id))
+        self._remove(booking_id)
+
+    def conflicts(self, room_id, date_from, date_to):
+        """Ids of the bookings of the room taking a night in the range"""
+        starts = self._starts.get(room_id)
+        if not starts:
+            return []
+
+        # only bookings starting less than the longest stay ago can overlap
+        first = bisect.bisect_right(starts, date_from - self._longest[room_id])
+        last = bisect.bisect_left(starts, date_to)
+
+        ranges = self._ranges[room_id]
+        return [
+            booking_id
+            for _, booking_to, booking_id in ranges[first:last]
+            if booking_to > date_from
+        ]
+
+    def is_free(self, room_id, date_from, date_to):
+        return not self.conflicts(room_id, date_from, date_to)
+
+    def _add(self, booking):
+        self._remove(booking["id"])
+        if booking["booking_status"] in self.rejected_statuses:
+            return
+
+        try:
+            date_from = parse_booking_date(booking["date_from"])
+            date_to = parse_booking_date(booking["date_to"])
+        except (TypeError, ValueError):
+            logger.warning("Booking %s has invalid dates, not indexed", booking["id"])
+            return
+
+        room_id = booking["room_id"]
+        item = (date_from, date_to, booking["id"])
+        position = bisect.bisect_left(self._ranges.setdefault(room_id, []), item)
+        self._ranges[room_id].insert(position, item)
+        self._starts.setdefault(room_id, []).insert(position, date_from)
+        self._longest[room_id] = max(
+            self._longest.get(room_id, timedelta(0)), date_to - date_from
+        )
+        self._booking_rooms[booking["id"]] = (room_id, item)
+
+    def _remove(self, booking_id):
+        found = self._booking_rooms.pop(booking_id, None)
+        if found is None:
+            return
+
+        room_id, item = found
+        ranges = self._ranges[room_id]
+        position = bisect.bisect_left(ranges, item)
+        del ranges[position]
+        del self._starts[room_id][position]
+        if not ranges:
+            del self._ranges[room_id]
+            del self._starts[room_id]
+            del self._longest[room_id]
+
+    async def refresh(self):
+        self._journal = []
+        try:
+            bookings, _ = await Requester.payment_fetch(
+                method="GET", path="/bookings", expected_statuses={HTTP_200_OK}
+            )
+            self.load(map(payment_booking_to_index, bookings))
+
+            for change, argument in self._journal:
+                change(argument)
+        finally:
+            self._journal = None
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self.refresh()
+            except (HTTPException, RequestException, KeyError, ValueError) as err:
+                logger.warning("Failed to refresh the booking index: %s", err)
+
+            await asyncio.sleep(self.refresh_interval)
+
+    def start_refresh(self):
+        if self.refresh_interval <= 0 or self._refresh_task is not None:
+            return
+
+        self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+
+    def stop_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+booking_index = BookingIndex(
+    refresh_interval=float(os.getenv("BOOKING_INDEX_REFRESH_INTERVAL", "60")),
+    rejected_statuses=[
+        int(status)
+        for status in os.getenv("BOOKING_REJECTED_STATUSES", "3").split(",")
+    ],
+)
@@ -1,11 +1,23 @@
 import os
+import time
 from datetime import datetime
 
 import firebase_admin
 from app.config import firebase_credentials
-from app.services.notifier import notifier
+from app.services.chat_hub import chat_hub
+from app.services.chat_tail import ChatTail
+from app.utils.cache import TTLCache
+from app.utils.push_id import generate_push_id
 from firebase_admin import db
 
+CHAT_TAIL_SIZE = int(os.getenv("CHAT_TAIL_SIZE", "100"))
+CHAT_TAIL_MAX_CHATS = int(os.getenv("CHAT_TAIL_MAX_CHATS", "1000"))
+CHAT_TAIL_TTL = float(os.getenv("CHAT_TAIL_TTL", "600"))
+# messages sent through other instances show up after at most this long
+CHAT_TAIL_REFRESH_INTERVAL = float(os.getenv("CHAT_TAIL_REFRESH_INTERVAL", "2"))
+INBOX_CACHE_MAX_ENTRIES = int(os.getenv("INBOX_CACHE_MAX_ENTRIES", "5000"))
+INBOX_CACHE_TTL = float(os.getenv("INBOX_CACHE_TTL", "30"))
+
 
 class ChatFirebase:
     def __init__(self, credentials):
@@ -18,9 +30,18 @@ class ChatFirebase:
             credentials, {"databaseURL": db_url}, name="bookbnb-chat"
         )
 
+        self.chat_db_path = chat_db_path
+        self.message_db_path = message_db_path
+
+        self.db_root = db.reference("/", app=self.app)
         self.db_chats = db.reference(f"/{chat_db_path}", app=self.app)
         self.db_messages = db.reference(f"/{message_db_path}", app=self.app)
 
+        self.tails = TTLCache(max_entries=CHAT_TAIL_MAX_CHATS, ttl=CHAT_TAIL_TTL)
+        self.inboxes = TTLCache(
+            max_entries=INBOX_CACHE_MAX_ENTRIES, ttl=INBOX_CACHE_TTL
+        )
+
     def send_message(self, message, sender: dict, receiver: dict):
         chat_name = self._create_chat_name(sender["uuid"], receiver["uuid"])
 
@@ -33,68 +54,212 @@ class ChatFirebase:
             "timestamp": int(datetime.now().timestamp()),
         }
 
-        chat_db_data = {
-            "timestamp": message_data["timestamp"],
-            "last_message": message_data,
-        }
-
-        self.db_messages.child(chat_name).push(message_data)
-        self.db_chats.child("-" + str(sender["uuid"])).child("-" + str(receiver["uuid"])).set(
-            chat_db_data
-        )
-        self.db_chats.child("-" + str(receiver["uuid"])).child("-" + str(sender["uuid"])).set(
-            chat_db_data
+        message_key = generate_push_id()
+        sender_chat = f"{self.chat_db_path}/-{sender['uuid']}/-{receiver['uuid']}"
+        receiver_chat = f"{self.chat_db_path}/-{receiver['uuid']}/-{sender['uuid']}"
+
+        # the message and both previews in a single atomic write
+        self.db_root.update(
+            {
+                f"{self.message_db_path}/{chat_name}/{message_key}": message_data,
+                f"{sender_chat}/timestamp": message_data["timestamp"],
+                f"{sender_chat}/last_message": message_data,
+                f"{sender_chat}/unread": 0,
+                f"{receiver_chat}/timestamp": message_data["timestamp"],
+                f"{receiver_chat}/last_message": message_data,
+                f"{receiver_chat}/unread": {".sv": {"increment": 1}},
+            }
         )
 
-        notifier.send_new_chat_message_notification(
-            sender["name"], receiver["uuid"]
-        )
+        self._update_inbox(sender["uuid"], message_data, unread=False)
+        self._update_inbox(receiver["uuid"], message_data, unread=True)
+
+        tail = self.tails.get(chat_name)
+        if tail is not None:
+            tail.add({message_key: message_data})
 
-        return message_data
+        chat_hub.publish(chat_name, message_key, message_data)
 
-    def get_messages_between(self, user_a_uuid: int, user_b_uuid: int):
+        return {**message_data, "id": message_key}
+
+    def get_messages_between(
+        self, user_a_uuid: int, user_b_uuid: int, limit: int, before: str = None
+    ):
+        """
+        Returns the newest limit messages of the chat, or the ones
+        sent before the given message key, oldest first. The second
+        value is the cursor of the next (older) page, None if there is
+        no older message
+        """
         chat_name = self._create_chat_name(user_a_uuid, user_b_uuid)
 
-        chat = self.db_messages.child(chat_name).get()
+        query = self.db_messages.child(chat_name).order_by_key()
+        if before is not None:
+            # end_at is inclusive, one more to leave the cursor out
+            query = query.end_at(before).limit_to_last(limit + 2)
+        else:
+            query = query.limit_to_last(limit + 1)
+
+        chat = query.get()
 
         if (chat is None):
-            return []
+            return [], None
+
+        keys = [key for key in chat if key != before]
+
+        next_cursor = None
+        if len(keys) > limit:
+            keys = keys[-limit:]
+            next_cursor = keys[0]
 
         messages = []
-        for timestamp, message in chat.items():
-            messages.append(message)
+        for key in keys:
+            messages.append({**chat[key], "id": key})
+
+        return messages, next_cursor
+
+    def get_messages_since(
+        self, user_a_uuid: int, user_b_uuid: int, since: str, limit: int
+    ):
+        """
+        Returns up to limit messages sent after the given message key,
+        oldest first, the cursor to ask for the following ones and
+        whether there are more messages after it.
+        Active chats are answered from an in-memory tail that is synced
+        with Firebase at most every CHAT_TAIL_REFRESH_INTERVAL seconds
+        """
+        chat_name = self._create_chat_name(user_a_uuid, user_b_uuid)
+        now = time.monotonic()
 
-        return messages
+        truncated = False
+        tail = self.tails.get(chat_name)
+        if tail is not None and tail.covers(since):
+            if now - tail.synced_at > CHAT_TAIL_REFRESH_INTERVAL:
+                tail.add(self._get_messages_after(chat_name, tail.synced_key), now)
+        else:
+            messages = self._get_messages_after(chat_name, since, CHAT_TAIL_SIZE + 1)
+            tail = ChatTail(CHAT_TAIL_SIZE, since, now)
+            if len(messages) > CHAT_TAIL_SIZE:
+                # too far behind to be buffered, it catches up page by page
+                tail.size = len(messages)
+                truncated = True
+            else:
+                self.tails.set(chat_name, tail)
+            tail.add(messages, now)
 
-    def get_all_chats_from(self, user_uuid: int):
-        chats = self.db_chats.child("-" + str(user_uuid)).get()
+        page = tail.since(since, limit + 1)
+        has_more = len(page) > limit or truncated
+        page = page[:limit]
+        cursor = page[-1][0] if page else since
+
+        return [{**message, "id": key} for key, message in page], cursor, has_more
+
+    def needs_sync(self, user_a_uuid: int, user_b_uuid: int, max_age: float):
+        """Whether the chat tail was last synced with Firebase over max_age ago"""
+        tail = self.tails.get(self._create_chat_name(user_a_uuid, user_b_uuid))
+        return tail is None or time.monotonic() - tail.synced_at > max_age
+
+    def _get_messages_after(self, chat_name: str, after: str, limit: int = None):
+        query = self.db_messages.child(chat_name).order_by_key()
+        if after is not None:
+            query = query.start_at(after)
+        if limit is not None:
+            # start_at is inclusive, one more to leave the cursor out
+            query = query.limit_to_first(limit + 1 if after is not None else limit)
+
+        chat = query.get()
+
+        if (chat is None):
+            return {}
 
-        if (chats is None):
-            return []
+        return {key: message for key, message in chat.items() if key != after}
 
-        previews = []
-        for uuid, chat in chats.items():
-            if chat is None:
+    def subscribe(self, user_a_uuid: int, user_b_uuid: int):
+        return chat_hub.subscribe(self._create_chat_name(user_a_uuid, user_b_uuid))
+
+    def get_all_chats_from(self, user_uuid: int, limit: int, before: str = None):
+        """
+        Returns the chat previews of the user, the most recently active
+        first, and the cursor of the next page (None on the last one)
+        """
+        previews = sorted(
+            self._get_inbox(user_uuid).values(), key=self._inbox_key, reverse=True
+        )
+
+        if before is not None:
+            before_key = tuple(int(part) for part in before.split("_"))
+            previews = [p for p in previews if self._inbox_key(p) < before_key]
+
+        next_cursor = None
+        if len(previews) > limit:
+            previews = previews[:limit]
+            next_cursor = "{}_{}".format(*self._inbox_key(previews[-1]))
+
+        return [dict(preview) for preview in previews], next_cursor
+
+    def mark_as_read(self, user_uuid: int, other_uuid: int):
+        inbox = self._get_inbox(user_uuid)
+        preview = inbox.get(other_uuid)
+        if preview is None:
+            return None
+
+        self.db_chats.child("-" + str(user_uuid)).child("-" + str(other_uuid)).update(
+            {"unread": 0}
+        )
+        preview["unread"] = 0
+
+        return dict(preview)
+
+    def _get_inbox(self, user_uuid: int):
+        inbox = self.inboxes.get(user_uuid)
+        if inbox is not None:
+            return inbox
+
+        chats = self.db_chats.child("-" + str(user_uuid)).get()
+
+        inbox = {}
+        for uuid, chat in (chats or {}).items():
+            if chat is None or "last_message" not in chat:
                 continue
 
-            last_message = chat["last_message"]
+            preview = self._create_preview(user_uuid, chat["last_message"])
+            preview["unread"] = chat.get("unread", 0)
+            inbox[preview["other_uuid"]] = preview
 
-            if user_uuid == last_message["sender_uuid"]:
-                other_user = last_message["receiver_name"]
-                other_uuid = last_message["receiver_uuid"]
-            else:
-                other_user = last_message["sender_name"]
-                other_uuid = last_message["sender_uuid"]
+        self.inboxes.set(user_uuid, inbox)
+        return inbox
 
-            preview = {
-                "other_user": other_user,
-                "other_uuid": other_uuid,
-                "last_message": last_message["message"],
-            }
+    def _update_inbox(self, user_uuid: int, message_data: dict, unread: bool):
+        inbox = self.inboxes.get(user_uuid)
+        if inbox is None:
+            return
+
+        preview = self._create_preview(user_uuid, message_data)
+        previous = inbox.get(preview["other_uuid"])
+        if unread:
+            preview["unread"] = (previous["unread"] if previous else 0) + 1
+        inbox[preview["other_uuid"]] = preview
 
-            previews.append(preview)
+    @staticmethod
+    def _create_preview(user_uuid: int, last_message: dict):
+        if user_uuid == last_message["sender_uuid"]:
+            other_user = last_message["receiver_name"]
+            other_uuid = last_message["receiver_uuid"]
+        else:
+            other_user = last_message["sender_name"]
+            other_uuid = last_message["sender_uuid"]
+
+        return {
+            "other_user": other_user,
+            "other_uuid": other_uuid,
+            "last_message": last_message["message"],
+            "timestamp": last_message["timestamp"],
+            "unread": 0,
+        }
 
-        return previews
+    @staticmethod
+    def _inbox_key(preview):
+        return preview["timestamp"], preview["other_uuid"]
 
     @staticmethod
     def _create_chat_name(sender_uuid, receiver_uuid):
@@ -113,10 +278,22 @@ class ChatFake:
     def send_message(self, message, sender, receiver):
         return
 
-    def get_messages_between(self, user_a, user_b):
-        return
+    def get_messages_between(self, user_a, user_b, limit, before=None):
+        return [], None
+
+    def get_messages_since(self, user_a, user_b, since, limit):
+        return [], since, False
+
+    def needs_sync(self, user_a, user_b, max_age):
+        return False
+
+    def subscribe(self, user_a, user_b):
+        return chat_hub.subscribe(f"{user_a}-{user_b}")
+
+    def get_all_chats_from(self, user, limit, before=None):
+        return [], None
 
-    def get_all_chats_from(self, user):
+    def mark_as_read(self, user, other_user):
         return
 
 
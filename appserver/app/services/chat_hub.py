@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+CHAT_STREAM_BUFFER = int(os.getenv("CHAT_STREAM_BUFFER", "100"))
+
+
+class Subscription:
+    """
+    Bounded buffer of the messages published to one chat for one
+    connection. When the consumer falls behind and the buffer fills up
+    the newer messages are not queued, the subscription is marked as
+    lagged instead and the consumer has to catch up from its cursor
+    """
+
+    def __init__(self, chat_name, maxsize):
+        self.chat_name = chat_name
+        self.lagged = False
+        self.loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue(maxsize=maxsize)
+
+    async def get(self, timeout):
+        """Returns the next (key, message) or None after timeout seconds"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def get_nowait(self):
+        try:
+            return self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def clear(self):
+        while self.get_nowait() is not None:
+            pass
+        self.lagged = False
+
+    def put_nowait(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class ChatHub:
+    """
+    In-process publish/subscribe of new chat messages keyed by chat name.
+    publish can be called from any thread
+    """
+
+    def __init__(self, buffer_size=CHAT_STREAM_BUFFER):
+        self.buffer_size = buffer_size
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, chat_name):
+        subscription = Subscription(chat_name, self.buffer_size)
+        self._subscriptions[chat_name].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.chat_name)
+        if subscriptions is None:
+            return
+
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.chat_name]
+
+    def publish(self, chat_name, key, message):
+        for subscription in list(self._subscriptions.get(chat_name, ())):
+            subscription.loop.call_soon_threadsafe(
+                subscription.put_nowait, (key, message)
+            )
+
+    def stats(self):
+        return {
+            "chats": len(self._subscriptions),
+            "subscriptions": sum(len(s) for s in self._subscriptions.values()),
+        }
+
+
+chat_hub = ChatHub()
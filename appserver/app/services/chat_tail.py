@@ -0,0 +1,50 @@
+import threading
+
+
+class ChatTail:
+    """
+    Newest messages of a chat kept in memory, keyed by their push key.
+    Every message with a key greater than floor is known to be here as
+    of the last sync with Firebase, so a poll with a cursor at or past
+    floor can be answered without a query
+    """
+
+    def __init__(self, size, floor, synced_at):
+        self.size = size
+        self.floor = floor
+        self.synced_key = floor
+        self.synced_at = synced_at
+        self.messages = {}
+        # polls are served from worker threads
+        self._lock = threading.Lock()
+
+    def covers(self, since):
+        with self._lock:
+            return self.floor is None or (since is not None and since >= self.floor)
+
+    def add(self, messages, synced_at=None):
+        """
+        Merges messages (key -> message), when they come from Firebase
+        synced_at is given and the tail is in sync up to the newest one
+        """
+        with self._lock:
+            self.messages.update(messages)
+
+            if synced_at is not None:
+                self.synced_at = synced_at
+                if messages:
+                    newest = max(messages)
+                    if self.synced_key is None or newest > self.synced_key:
+                        self.synced_key = newest
+
+            overflow = len(self.messages) - self.size
+            if overflow > 0:
+                keys = sorted(self.messages)
+                for key in keys[:overflow]:
+                    del self.messages[key]
+                self.floor = keys[overflow - 1]
+
+    def since(self, since, limit):
+        with self._lock:
+            keys = sorted(key for key in self.messages if since is None or key > since)
+            return [(key, self.messages[key]) for key in keys[:limit]]
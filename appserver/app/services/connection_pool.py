@@ -0,0 +1,137 @@
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.expired_connections = 0
+
+    def record(self, reused, expired):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+            if expired:
+                self.expired_connections += 1
+
+    def serialize(self):
+        reuse_ratio = 0.0
+        if self.requests > 0:
+            reuse_ratio = self.reused_connections / self.requests
+
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "expired_connections": self.expired_connections,
+            "reuse_ratio": reuse_ratio,
+        }
+
+
+class KeepAlivePoolMixin:
+    """
+    Connection pool that drops idle connections older than
+    keepalive_expiry and records whether each checkout reused
+    an already open connection
+    """
+
+    keepalive_expiry = None
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+
+        expired = False
+        last_used = getattr(conn, "last_used", None)
+        if (
+            conn.sock is not None and
+            self.keepalive_expiry is not None and
+            last_used is not None and
+            time.monotonic() - last_used > self.keepalive_expiry
+        ):
+            conn.close()
+            expired = True
+
+        if self.stats is not None:
+            self.stats.record(reused=conn.sock is not None, expired=expired)
+
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.last_used = time.monotonic()
+        super()._put_conn(conn)
+
+    def occupancy(self):
+        idle = sum(
+            1 for conn in list(self.pool.queue)
+            if conn is not None and conn.sock is not None
+        )
+        return {"in_use": self.pool.maxsize - self.pool.qsize(), "idle": idle}
+
+
+class KeepAliveHTTPConnectionPool(KeepAlivePoolMixin, HTTPConnectionPool):
+    pass
+
+
+class KeepAliveHTTPSConnectionPool(KeepAlivePoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class UpstreamAdapter(HTTPAdapter):
+    """
+    Keep-alive adapter for a single upstream server.
+    max_connections is a hard limit per host: when every connection
+    is busy the request waits for one to be released.
+    """
+
+    def __init__(self, max_connections, max_hosts, keepalive_expiry):
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.stats = PoolStats()
+        super().__init__(
+            pool_connections=max_hosts, pool_maxsize=max_connections, pool_block=True
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": KeepAliveHTTPConnectionPool,
+            "https": KeepAliveHTTPSConnectionPool,
+        }
+
+    def get_connection(self, url, proxies=None):
+        pool = super().get_connection(url, proxies)
+        pool.keepalive_expiry = self.keepalive_expiry
+        pool.stats = self.stats
+        return pool
+
+    def pool_stats(self):
+        in_use = 0
+        idle = 0
+        for pool_key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(pool_key)
+            if isinstance(pool, KeepAlivePoolMixin):
+                occupancy = pool.occupancy()
+                in_use += occupancy["in_use"]
+                idle += occupancy["idle"]
+
+        pool_stats = self.stats.serialize()
+        pool_stats.update(
+            {
+                "max_connections": self.max_connections,
+                "hosts": len(self.poolmanager.pools),
+                "in_use": in_use,
+                "idle": idle,
+            }
+        )
+        return pool_stats
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    """
+    Bounded in-process queue of pending notifications drained by
+    worker tasks, so request handlers never wait on the delivery.
+    deliver is a blocking callable run in the threadpool, it gets a
+    batch of up to batch_size notifications and returns one success
+    flag per notification. A worker waits at most flush_interval
+    seconds for a batch to fill up before sending what it has.
+
+    When the queue is full the overflow policy decides what happens:
+    - block: the producer waits up to put_timeout for a free slot
+    - drop_newest: the new notification is discarded
+    - drop_oldest: the oldest pending notification is discarded
+    """
+
+    BLOCK = "block"
+    DROP_NEWEST = "drop_newest"
+    DROP_OLDEST = "drop_oldest"
+    POLICIES = {BLOCK, DROP_NEWEST, DROP_OLDEST}
+
+    def __init__(
+        self,
+        deliver,
+        capacity=1000,
+        workers=2,
+        overflow_policy=DROP_OLDEST,
+        put_timeout=1.0,
+        batch_size=1,
+        flush_interval=0.0,
+    ):
+        if overflow_policy not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.deliver = deliver
+        self.capacity = capacity
+        self.workers = workers
+        self.overflow_policy = overflow_policy
+        self.put_timeout = put_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = None
+        self._worker_tasks = []
+
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @property
+    def running(self):
+        return self._queue is not None
+
+    def start(self):
+        if self.running:
+            return
+
+        # asyncio queues must be created inside the running loop
+        self._queue = asyncio.Queue(maxsize=self.capacity)
+        self._worker_tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.workers)
+        ]
+        logger.info("Started %d notification workers", self.workers)
+
+    async def put(self, notification):
+        if not self.running:
+            # nobody to hand it to (i.e. shutting down), deliver it now
+            await run_in_threadpool(self._deliver, [notification])
+            return
+
+        if self.overflow_policy == self.BLOCK:
+            try:
+                await asyncio.wait_for(self._queue.put(notification), self.put_timeout)
+            except asyncio.TimeoutError:
+                self._drop(notification)
+                return
+        else:
+            if self._queue.full():
+                if self.overflow_policy == self.DROP_NEWEST:
+                    self._drop(notification)
+                    return
+
+                self._drop(self._queue.get_nowait())
+                self._queue.task_done()
+
+            self._queue.put_nowait(notification)
+
+        self.enqueued += 1
+
+    async def drain(self, timeout):
+        """Waits for the pending notifications and stops the workers"""
+        if not self.running:
+            return
+
+        queue = self._queue
+        try:
+            await asyncio.wait_for(queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Notification queue drain timed out, %d left", queue.qsize()
+            )
+
+        self._queue = None
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def stats(self):
+        return {
+            "size": self._queue.qsize() if self.running else 0,
+            "capacity": self.capacity,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    def _drop(self, notification):
+        self.dropped += 1
+        logger.warning("Notification queue full, dropped: %s", notification)
+
+    async def _work(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            try:
+                await self._fill_batch(queue, batch)
+                await run_in_threadpool(self._deliver, batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _fill_batch(self, queue, batch):
+        waited = False
+        while len(batch) < self.batch_size:
+            if queue.empty():
+                if waited or self.flush_interval <= 0:
+                    return
+                # polled instead of awaiting get, a timed out get could
+                # otherwise swallow a notification
+                await asyncio.sleep(self.flush_interval)
+                waited = True
+                continue
+
+            batch.append(queue.get_nowait())
+
+    def _deliver(self, batch):
+        try:
+            results = self.deliver(batch)
+        except Exception:  # pylint: disable=broad-except
+            # a failed delivery must not take a worker down
+            logger.exception("Notification delivery failed: %s", batch)
+            results = [False] * len(batch)
+
+        delivered = sum(1 for success in results if success)
+        self.batches += 1
+        self.delivered += delivered
+        self.failed += len(batch) - delivered
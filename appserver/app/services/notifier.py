@@ -1,10 +1,37 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import firebase_admin
 from app.config import firebase_credentials
+from app.services.notification_queue import NotificationQueue
+from app.utils.cache import TTLCache
 from firebase_admin import db, messaging
 from firebase_admin.exceptions import FirebaseError
 
+NOTIFICATION_QUEUE_CAPACITY = int(os.getenv("NOTIFICATION_QUEUE_CAPACITY", "1000"))
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", "2"))
+NOTIFICATION_OVERFLOW_POLICY = os.getenv("NOTIFICATION_OVERFLOW_POLICY", "drop_oldest")
+NOTIFICATION_DRAIN_TIMEOUT = float(os.getenv("NOTIFICATION_DRAIN_TIMEOUT", "10"))
+# FCM accepts at most 500 messages per send_all call
+NOTIFICATION_BATCH_SIZE = min(int(os.getenv("NOTIFICATION_BATCH_SIZE", "500")), 500)
+NOTIFICATION_FLUSH_INTERVAL = float(os.getenv("NOTIFICATION_FLUSH_INTERVAL", "0.05"))
+
+PUSH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("PUSH_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+PUSH_TOKEN_CACHE_TTL = float(os.getenv("PUSH_TOKEN_CACHE_TTL", "300"))
+# users without a device are remembered for less time, they may register one
+PUSH_TOKEN_NEGATIVE_TTL = float(os.getenv("PUSH_TOKEN_NEGATIVE_TTL", "60"))
+PUSH_TOKEN_FETCH_WORKERS = int(os.getenv("PUSH_TOKEN_FETCH_WORKERS", "8"))
+
+UNREGISTERED_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+)
+
+logger = logging.getLogger(__name__)
+
+_NOT_CACHED = object()
+
 
 class Notifier:
     def __init__(self, credentials):
@@ -16,252 +43,300 @@ class Notifier:
         )
 
         self.db_tokens = db.reference(f"/{notifications_db_path}", app=self.app)
+        self.token_cache = TTLCache(
+            max_entries=PUSH_TOKEN_CACHE_MAX_ENTRIES, ttl=PUSH_TOKEN_CACHE_TTL
+        )
+        self.token_fetcher = ThreadPoolExecutor(max_workers=PUSH_TOKEN_FETCH_WORKERS)
+
+        self.queue = NotificationQueue(
+            self._deliver,
+            capacity=NOTIFICATION_QUEUE_CAPACITY,
+            workers=NOTIFICATION_WORKERS,
+            overflow_policy=NOTIFICATION_OVERFLOW_POLICY,
+            batch_size=NOTIFICATION_BATCH_SIZE,
+            flush_interval=NOTIFICATION_FLUSH_INTERVAL,
+        )
+
+    def start(self):
+        self.queue.start()
+
+    async def drain(self):
+        await self.queue.drain(NOTIFICATION_DRAIN_TIMEOUT)
+        self.token_fetcher.shutdown(wait=False)
+
+    def stats(self):
+        return {"queue": self.queue.stats(), "push_tokens": self.token_cache.stats()}
 
     def set_push_token(self, uuid: int, token: str):
         self.db_tokens.update({str(uuid): token})
+        self.token_cache.set(str(uuid), token)
 
     def get_push_token(self, uuid: int):
-        return self.db_tokens.child(str(uuid)).get()
+        key = str(uuid)
+        token = self.token_cache.get(key, _NOT_CACHED)
+        if token is _NOT_CACHED:
+            token = self._fetch_push_token(key)
+
+        return token
+
+    def prefetch_push_tokens(self, uuids):
+        """
+        Returns the push tokens of the given users, the ones that are
+        not cached are loaded concurrently, one key per request
+        """
+        tokens = {}
+        missing = []
+        for key in {str(uuid) for uuid in uuids}:
+            token = self.token_cache.get(key, _NOT_CACHED)
+            if token is _NOT_CACHED:
+                missing.append(key)
+            else:
+                tokens[key] = token
+
+        fetched = self.token_fetcher.map(self._fetch_push_token, missing)
+        tokens.update(zip(missing, fetched))
+        return tokens
 
     def remove_push_token(self, uuid: int):
         removed_token = self.get_push_token(uuid)
         self.db_tokens.child(str(uuid)).delete()
+        self._cache_push_token(str(uuid), None)
         return removed_token
 
-    def send_notification_test(self, sender: dict, receiver: dict):
+    def _fetch_push_token(self, key: str):
+        token = self.db_tokens.child(key).get()
+        self._cache_push_token(key, token)
+        return token
+
+    def _cache_push_token(self, key: str, token):
+        ttl = PUSH_TOKEN_CACHE_TTL if token else PUSH_TOKEN_NEGATIVE_TTL
+        self.token_cache.set(key, token, ttl=ttl)
+
+    async def send_notification_test(self, sender: dict, receiver: dict):
         title = "New test notification."
         body = f'Body of test notification from {sender["name"]}'
 
-        self.notify(title, body, receiver["id"])
+        await self.notify(title, body, receiver["id"])
 
     # send notification chat new message
-    def send_new_chat_message_notification(
+    async def send_new_chat_message_notification(
         self, sender_name: str, receiver_uuid: int
     ):
         title = "Nuevo mensaje en el chat"
         body = f'Mensaje nuevo de {sender_name}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new booking received for user's room
-    def send_new_booking_received_notification(
+    async def send_new_booking_received_notification(
         self, sender_name: str, room_title: str, receiver_uuid: int
     ):
         title = "Nueva reserva recibida"
         body = f'El usuario {sender_name} hizo una reserva en la habitacion {room_title}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification booking made accepted
-    def send_booking_accepted_notification(
+    async def send_booking_accepted_notification(
         self, sender_name: str, room_title: str, receiver_uuid: int
     ):
         title = "Se confirmo una reserva realizada"
         body = f'El usuario {sender_name} confirmo la reserva realizada en {room_title}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification booking made rejected
-    def send_booking_rejected_notification(
+    async def send_booking_rejected_notification(
         self, sender_name: str, room_title: str, receiver_uuid: int
     ):
         title = "Se rechazo una reserva realizada"
         body = f'El usuario {sender_name} rechazo la reserva realizada en {room_title}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new comment for user's room
-    def send_new_comment_notification(
+    async def send_new_comment_notification(
         self, sender_name: str, room_title: str, receiver_uuid: int
     ):
         title = "Se recibio un nuevo comentario"
         body = f'El usuario {sender_name} comento tu habitacion {room_title}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification comment answered
-    def send_answered_comment_notification(
+    async def send_answered_comment_notification(
         self, sender_name: str, room_title: str, receiver_uuid: int
     ):
         title = "Se respondio tu nuevo comentario"
         body = f'El usuario {sender_name} respondio a tu comentario de {room_title}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new rating for user's room
-    def send_new_room_rating_notification(
+    async def send_new_room_rating_notification(
         self, sender_name: str, room_title: str, rating: int, receiver_uuid: int
     ):
         title = "Nueva calificacion en tu habitacion"
         body = f'El usuario {sender_name} califico tu habitacion {room_title} con {rating}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new review for user's room
-    def send_new_room_review_notification(
+    async def send_new_room_review_notification(
         self, sender_name: str, room_title: str, receiver_uuid: int
     ):
         title = "Nueva reseña en tu habitacion"
         body = f'El usuario {sender_name} escribio una reseña de tu habitacion {room_title}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new guest rating for user
-    def send_new_user_guest_rating_notification(
+    async def send_new_user_guest_rating_notification(
         self, sender_name: str, rating: int, receiver_uuid: int
     ):
         title = "Nueva calificacion recibida"
         body = f'El usuario {sender_name} te califico como huesped con {rating}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new host rating for user
-    def send_new_user_host_rating_notification(
+    async def send_new_user_host_rating_notification(
         self, sender_name: str, rating: int, receiver_uuid: int
     ):
         title = "Nueva calificacion recibida"
         body = f'El usuario {sender_name} te califico como anfitrion con {rating}'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new guest review for user
-    def send_new_user_guest_review_notification(
+    async def send_new_user_guest_review_notification(
         self, sender_name: str, receiver_uuid: int
     ):
         title = "Nueva reseña recibida"
         body = f'El usuario {sender_name} escribio una reseña de huesped de tu usuario'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
     # send notification new host review for user
-    def send_new_user_host_review_notification(
+    async def send_new_user_host_review_notification(
         self, sender_name: str, receiver_uuid: int
     ):
         title = "Nueva reseña recibida"
         body = f'El usuario {sender_name} escribio una reseña de anfitrion de tu usuario'
 
-        self.notify(title, body, receiver_uuid)
+        await self.notify(title, body, receiver_uuid)
 
-    def notify(self, title: str, body: str, uuid: int):
+    async def notify(self, title: str, body: str, uuid: int):
         """
-        Sends a notification to the users device.
-        If the device is not registered to receive notifications,
-        no action is performed
+        Queues a notification to the users device, it is sent
+        in the background. If the device is not registered to
+        receive notifications, no action is performed
         """
 
-        token = self.get_push_token(str(uuid))
-        if not token:
-            return False
-
-        _response = self._send_notification(title, body, str(token))
+        await self.queue.put({"title": title, "body": body, "uuid": uuid})
         return True
 
-    def _send_notification(self, title: str, body: str, token: str):
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            token=token,
-        )
-        success = False
-
+    def _deliver(self, notifications: list):
+        """
+        Sends a batch of notifications in a single FCM call and
+        returns whether each of them was delivered. Tokens FCM
+        reports as no longer registered are removed from the store
+        """
+        results = [False] * len(notifications)
+        messages = []
+        targets = []
+
+        tokens = self.prefetch_push_tokens(n["uuid"] for n in notifications)
+        for index, notification in enumerate(notifications):
+            token = tokens[str(notification["uuid"])]
+            if not token:
+                continue
+
+            messages.append(
+                messaging.Message(
+                    notification=messaging.Notification(
+                        title=notification["title"],
+                        body=notification["body"],
+                    ),
+                    token=str(token),
+                )
+            )
+            targets.append((index, notification["uuid"], str(token)))
+
+        if not messages:
+            return results
+
+        responses = self._send_batch(messages)
+        if responses is None:
+            return results
+
+        for (index, uuid, token), response in zip(targets, responses):
+            results[index] = response.success
+            err = response.exception
+            if err is not None:
+                logger.warning("Notification to %s failed: %s", uuid, err)
+            if isinstance(err, UNREGISTERED_TOKEN_ERRORS):
+                self._prune_push_token(uuid, token)
+
+        return results
+
+    def _send_batch(self, messages: list):
         try:
-            messaging.send(message, app=self.app)
-            print("Success on notification")
-            success = True
-        except FirebaseError as err:
-            print("Notification failed, firebase error")
-            # print(err.message)
-
-        except ValueError as err:
-            print("Notification failed, value error")
-            # print(err.message)
-
-        return success
-
-
-class NotifierFake:
-    def __init__(self, _credentials):
-        return
-
-    def set_push_token(self, uuid: int, token: str):
-        return
-
-    def get_push_token(self, uuid: int):
-        return
-
-    def send_notification_test(self, sender: dict, receiver: dict):
-        title = "New test notification."
-        body = f'Body of test notification from {sender["name"]}'
-
-        self.notify(title, body, receiver["id"])
-
-    def send_new_chat_message_notification(
-        self, sender_name: str, receiver_uuid: int
-    ):
-        return
+            batch_response = messaging.send_all(messages, app=self.app)
+        except (FirebaseError, ValueError) as err:
+            logger.warning("Notification batch of %d failed: %s", len(messages), err)
+            return None
+
+        logger.info(
+            "Sent %d notifications, %d failed",
+            batch_response.success_count,
+            batch_response.failure_count,
+        )
+        return batch_response.responses
 
-    def send_new_booking_received_notification(
-        self, sender_name: str, room_title: str, receiver_uuid: int
-    ):
-        return
+    def _prune_push_token(self, uuid: int, token: str):
+        # the user may have registered a new device in the meantime,
+        # possibly through another instance so the cache is not enough
+        key = str(uuid)
+        current_token = self.db_tokens.child(key).get()
+        if current_token == token:
+            logger.info("Removing unregistered push token of user %s", uuid)
+            self.db_tokens.child(key).delete()
+            current_token = None
 
-    def send_booking_accepted_notification(
-        self, sender_name: str, room_title: str, receiver_uuid: int
-    ):
-        return
+        # the cached token is the failed one either way
+        self._cache_push_token(key, current_token)
 
-    def send_booking_rejected_notification(
-        self, sender_name: str, room_title: str, receiver_uuid: int
-    ):
-        return
 
-    def send_new_comment_notification(
-        self, sender_name: str, room_title: str, receiver_uuid: int
-    ):
-        return
+class NotifierFake(Notifier):
+    """Records the queued notifications instead of sending them"""
 
-    def send_answered_comment_notification(
-        self, sender_name: str, room_title: str, receiver_uuid: int
-    ):
-        return
+    def __init__(self, _credentials):  # pylint: disable=super-init-not-called
+        self.queued = []
 
-    def send_new_room_rating_notification(
-        self, sender_name: str, room_title: str, rating: int,
-        receiver_uuid: int
-    ):
+    def start(self):
         return
 
-    def send_new_room_review_notification(
-        self, sender_name: str, room_title: str, receiver_uuid: int
-    ):
+    async def drain(self):
         return
 
-    def send_new_user_guest_rating_notification(
-        self, sender_name: str, rating: int, receiver_uuid: int
-    ):
-        return
+    def stats(self):
+        return {"queued": len(self.queued)}
 
-    def send_new_user_host_rating_notification(
-        self, sender_name: str, rating: int, receiver_uuid: int
-    ):
+    def set_push_token(self, uuid: int, token: str):
         return
 
-    def send_new_user_guest_review_notification(
-        self, sender_name: str, receiver_uuid: int
-    ):
+    def get_push_token(self, uuid: int):
         return
 
-    def send_new_user_host_review_notification(
-        self, sender_name: str, receiver_uuid: int
-    ):
+    def remove_push_token(self, uuid: int):
         return
 
-    def notify(self, title: str, body: str, uuid: int):
-        return
+    async def notify(self, title: str, body: str, uuid: int):
+        self.queued.append({"title": title, "body": body, "uuid": uuid})
+        return True
 
-    def _send_notification(self, title: str, body: str, token: str):
+    def _send_batch(self, messages: list):
         return
 
 
@@ -1,13 +1,93 @@
+import asyncio
+import hashlib
+import io
 import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import firebase_admin
 from app.config import firebase_credentials, logger
-from app.errors.http_error import NotFoundError
-from app.utils.image_utils import IdGenerator
+from app.errors.http_error import (BadRequestError, NotFoundError,
+                                   PayloadTooLargeError)
+from app.utils.image_utils import Image, IdGenerator, create_variants
 from firebase_admin import storage
+from google.api_core.exceptions import PreconditionFailed
+
+PHOTO_UPLOAD_WORKERS = int(os.getenv("PHOTO_UPLOAD_WORKERS", "4"))
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(10 * 1024 * 1024)))
+# cloud storage requires resumable chunks to be multiples of 256 KiB
+PHOTO_CHUNK_SIZE = 4 * 256 * 1024
+# bodies up to this size go in a single multipart request, larger
+# ones in a resumable upload of PHOTO_CHUNK_SIZE chunks
+PHOTO_MULTIPART_MAX_BYTES = 8 * 1024 * 1024
+PHOTO_RESIZE_WORKERS = int(os.getenv("PHOTO_RESIZE_WORKERS", "2"))
+PHOTO_VARIANT_SIZES = {
+    "thumbnail": int(os.getenv("PHOTO_THUMBNAIL_SIZE", "240")),
+    "medium": int(os.getenv("PHOTO_MEDIUM_SIZE", "1024")),
+}
+
+
+class UploadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.failed_uploads = 0
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.deduplicated = 0
+        self.deduplicated_bytes = 0
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def reused(self, size):
+        with self._lock:
+            self.deduplicated += 1
+            self.deduplicated_bytes += size
+
+    def finished(self, size, duration, success):
+        with self._lock:
+            self.in_flight -= 1
+            self.upload_seconds += duration
+            if success:
+                self.uploads += 1
+                self.uploaded_bytes += size
+            else:
+                self.failed_uploads += 1
+
+    def serialize(self):
+        mean_seconds = 0.0
+        if self.uploads > 0:
+            mean_seconds = self.upload_seconds / self.uploads
+
+        return {
+            "uploads": self.uploads,
+            "failed_uploads": self.failed_uploads,
+            "uploaded_bytes": self.uploaded_bytes,
+            "mean_upload_seconds": mean_seconds,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "deduplicated": self.deduplicated,
+            "deduplicated_bytes": self.deduplicated_bytes,
+        }
 
 
 class PhotoUploader:
+    """
+    Uploads photos to firebase storage. The request body is copied in
+    chunks to a spooled file (rejected once it exceeds PHOTO_MAX_BYTES)
+    and the blocking storage calls run in a bounded thread pool,
+    so the event loop never waits on them.
+    Next to each room photo, a resized JPEG is stored for each of the
+    PHOTO_VARIANT_SIZES, encoded in a pool of worker processes
+    """
+
     ROOM_IMAGES_PATH = "rooms"
     USER_IMAGES_PATH = "users"
 
@@ -17,51 +97,216 @@ class PhotoUploader:
         self.app = firebase_admin.initialize_app(
             credentials, {"storageBucket": storage_bucket}, name="bookbnb-photouploader"
         )
+        self.executor = ThreadPoolExecutor(
+            max_workers=PHOTO_UPLOAD_WORKERS, thread_name_prefix="photouploader"
+        )
+        self.resize_executor = None
+        if Image is not None:
+            self.resize_executor = ProcessPoolExecutor(
+                max_workers=PHOTO_RESIZE_WORKERS
+            )
+        self.stats = UploadStats()
 
         logger.info("Authenticated in firebase successfully")
 
-    def upload_profile_photo(self, file, uuid):
+    async def upload_profile_photo(self, file, uuid):
         _, image_extension = os.path.splitext(file.filename)
         filename = f"{self.USER_IMAGES_PATH}/{uuid}/profile{image_extension}"
 
-        image_url, img_firebase_id = self._upload_image(file, filename)
+        photo = await self._upload_image(file, filename)
 
-        return image_url
+        return photo["url"]
 
-    def upload_room_photo(self, file, room_id):
+    async def upload_room_photo(self, file, room_id, find_duplicate=None):
+        """
+        Returns the url of the original, the url of each variant
+        (as "<variant>_url"), the firebase_id and the content_hash
+        of the photo. find_duplicate is a coroutine function that gets
+        the content hash and returns a photo already stored with the same
+        content, or None; if there is one its urls are reused and nothing
+        is uploaded
+        """
         filename = f"{self.ROOM_IMAGES_PATH}/{room_id}/"
 
-        image_url, img_firebase_id = self._upload_image(file, filename, True)
-
-        return image_url, img_firebase_id
+        return await self._upload_image(
+            file,
+            filename,
+            generate_id=True,
+            with_variants=True,
+            find_duplicate=find_duplicate,
+        )
 
-    def remove_room_photo(self, room_id, img_firebase_id):
+    async def remove_room_photo(self, room_id, img_firebase_id):
         filename = f"{self.ROOM_IMAGES_PATH}/{room_id}/{img_firebase_id}"
-        self._remove_image(filename)
+        await self._run(self._remove_image, filename)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.resize_executor is not None:
+            self.resize_executor.shutdown(wait=False)
+
+    async def _upload_image(
+        self,
+        file,
+        filename,
+        generate_id=False,
+        with_variants=False,
+        find_duplicate=None,
+    ):
+        with tempfile.SpooledTemporaryFile(max_size=PHOTO_CHUNK_SIZE) as content:
+            size, content_hash = await self._copy_limited(file, content)
+
+            duplicate = None
+            if find_duplicate is not None:
+                duplicate = await find_duplicate(content_hash)
+            if duplicate is not None:
+                logger.info("Reusing stored photo with hash %s", content_hash)
+                self.stats.reused(size)
+                return {
+                    "url": duplicate["url"],
+                    "thumbnail_url": duplicate["thumbnail_url"],
+                    "medium_url": duplicate["medium_url"],
+                    "firebase_id": IdGenerator.generate(),
+                    "content_hash": content_hash,
+                }
+
+            variants = {}
+            if with_variants:
+                variants = await self._create_variants(content)
+
+            self.stats.started()
+            start = time.monotonic()
+            success = False
+            try:
+                image_url, img_firebase_id = await self._run(
+                    self._store_image,
+                    content,
+                    size,
+                    file.content_type,
+                    filename,
+                    generate_id,
+                )
+                photo = {
+                    "url": image_url,
+                    "firebase_id": img_firebase_id,
+                    "content_hash": content_hash,
+                }
+
+                # variants are named after the stored original
+                base_filename = filename
+                if generate_id:
+                    base_filename = filename + f"{img_firebase_id}"
+                variant_urls = await asyncio.gather(
+                    *(
+                        self._run(self._store_variant, data, f"{base_filename}_{name}")
+                        for name, data in variants.items()
+                    )
+                )
+                for name, url in zip(variants, variant_urls):
+                    photo[f"{name}_url"] = url
 
-    def _upload_image(self, file, filename, generate_id=False):
+                success = True
+            finally:
+                size += sum(len(data) for data in variants.values())
+                self.stats.finished(size, time.monotonic() - start, success)
+
+        return photo
+
+    async def _create_variants(self, content):
+        if self.resize_executor is None:
+            return {}
+
+        data = content.read()
+        content.seek(0)
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                self.resize_executor, create_variants, data, PHOTO_VARIANT_SIZES
+            )
+        except ValueError as err:
+            raise BadRequestError("The uploaded file is not a valid image") from err
+
+    @staticmethod
+    async def _copy_limited(file, content):
+        """Returns the size and the sha256 hex digest of the content"""
+        digest = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = await file.read(PHOTO_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > PHOTO_MAX_BYTES:
+                raise PayloadTooLargeError(
+                    f"Photos can not be larger than {PHOTO_MAX_BYTES} bytes"
+                )
+            content.write(chunk)
+            digest.update(chunk)
+
+        content.seek(0)
+        return size, digest.hexdigest()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _store_image(self, content, size, content_type, filename, generate_id):
         bucket = storage.bucket(app=self.app)
 
-        img_firebase_id = IdGenerator.generate()
-        new_filename = filename + f"{img_firebase_id}"
-        while (generate_id and bucket.get_blob(new_filename) is not None):
+        if not generate_id:
+            # a fixed name (i.e. the profile photo), replaced on upload
+            public_url = self._upload_blob(
+                bucket, content, size, content_type, filename
+            )
+            return public_url, None
+
+        # ids are unique, the precondition only guards against the unlikely
+        # collision between workers without asking the bucket beforehand
+        while True:
             img_firebase_id = IdGenerator.generate()
             new_filename = filename + f"{img_firebase_id}"
             logger.debug("Trying to upload photo with name " + new_filename)
+            try:
+                public_url = self._upload_blob(
+                    bucket,
+                    content,
+                    size,
+                    content_type,
+                    new_filename,
+                    if_generation_match=0,
+                )
+            except PreconditionFailed:
+                content.seek(0)
+                continue
 
-        if (generate_id):
-            filename = new_filename
-            logger.debug("Trying to upload photo with name " + new_filename)
+            return public_url, img_firebase_id
 
-        existing_blob = bucket.get_blob(filename)
-        if existing_blob is not None:
-            existing_blob.delete()
+    def _store_variant(self, data, filename):
+        bucket = storage.bucket(app=self.app)
+        return self._upload_blob(
+            bucket, io.BytesIO(data), len(data), "image/jpeg", filename
+        )
 
-        blob = bucket.blob(filename)
-        blob.upload_from_file(file.file)
-        blob.make_public()
+    @staticmethod
+    def _upload_blob(bucket, content, size, content_type, filename, **preconditions):
+        # without a size or with a chunk size the upload is always resumable:
+        # one request to start it and at least another one for the data
+        chunk_size = None
+        if size > PHOTO_MULTIPART_MAX_BYTES:
+            chunk_size = PHOTO_CHUNK_SIZE
 
-        return blob.public_url, img_firebase_id
+        blob = bucket.blob(filename, chunk_size=chunk_size)
+        blob.upload_from_file(
+            content,
+            size=size,
+            content_type=content_type,
+            predefined_acl="publicRead",
+            **preconditions,
+        )
+
+        return blob.public_url
 
     def _remove_image(self, filename):
         bucket = storage.bucket(app=self.app)
@@ -73,13 +318,19 @@ class PhotoUploader:
 
 
 class PhotoUploaderFake:
-    def upload_profile_photo(self, file, uuid):
+    def __init__(self):
+        self.stats = UploadStats()
+
+    async def upload_profile_photo(self, file, uuid):
+        return
+
+    async def upload_room_photo(self, file, room_id, find_duplicate=None):
         return
 
-    def upload_room_photo(self, file, room_id):
+    async def remove_room_photo(self, room_id, img_firebase_id):
         return
 
-    def remove_room_photo(self, room_id, img_firebase_id):
+    def close(self):
         return
 
 
@@ -1,8 +1,12 @@
+import asyncio
+import functools
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from app.errors.utils import get_error_message
+from app.services.connection_pool import UpstreamAdapter
 from fastapi import HTTPException
 
 logger = logging.getLogger(__name__)
@@ -19,8 +23,19 @@ class Requester:
     USER_API_URL = os.environ["USERSERVER_URL"]
     PAYMENT_API_URL = os.environ["PAYMENT_URL"]
 
+    POOL_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_MAX_CONNECTIONS", "10"))
+    POOL_MAX_HOSTS = int(os.getenv("UPSTREAM_POOL_MAX_HOSTS", "4"))
+    POOL_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_POOL_KEEPALIVE_EXPIRY", "30"))
+
+    # one long-lived session (and so one connection pool) per upstream,
+    # with its own threads: as many as connections, so a slow upstream
+    # never takes the threads of the shared executor (db, file I/O)
+    _sessions = {}
+    _adapters = {}
+    _executors = {}
+
     @classmethod
-    def room_srv_fetch(
+    async def room_srv_fetch(
         cls, method, path, expected_statuses, payload=None, extra_headers=None
     ):
         header = {"api-key": cls.POST_SERVER_API_KEY}
@@ -31,12 +46,12 @@ class Requester:
         if payload is None:
             payload = {}
 
-        url = cls.POST_API_URL + path
-
-        return cls._fetch(method, url, header, payload, expected_statuses)
+        return await cls._fetch(
+            method, cls.POST_API_URL, path, header, payload, expected_statuses
+        )
 
     @classmethod
-    def auth_srv_fetch(
+    async def auth_srv_fetch(
         cls, method, path, expected_statuses, payload=None, extra_headers=None
     ):
         header = {"api-key": cls.AUTH_SERVER_API_KEY}
@@ -48,12 +63,12 @@ class Requester:
         if payload is None:
             payload = {}
 
-        url = cls.AUTH_API_URL + path
-
-        return cls._fetch(method, url, header, payload, expected_statuses)
+        return await cls._fetch(
+            method, cls.AUTH_API_URL, path, header, payload, expected_statuses
+        )
 
     @classmethod
-    def user_srv_fetch(
+    async def user_srv_fetch(
         cls, method, path, expected_statuses, payload=None, extra_headers=None
     ):
         header = {"api-key": cls.USER_SERVER_API_KEY}
@@ -64,16 +79,17 @@ class Requester:
         if payload is None:
             payload = {}
 
-        url = cls.USER_API_URL + path
         print(
-            f"La url de user es: {url}, la env var resulto: \
+            f"La url de user es: {cls.USER_API_URL + path}, la env var resulto: \
                 {os.environ['USERSERVER_URL']}"
         )
 
-        return cls._fetch(method, url, header, payload, expected_statuses)
+        return await cls._fetch(
+            method, cls.USER_API_URL, path, header, payload, expected_statuses
+        )
 
     @classmethod
-    def payment_fetch(
+    async def payment_fetch(
         cls, method, path, expected_statuses, payload=None, extra_headers=None
     ):
         header = {"api-key": cls.PAYMENT_API_KEY}
@@ -84,16 +100,86 @@ class Requester:
         if payload is None:
             payload = {}
 
-        url = cls.PAYMENT_API_URL + path
+        return await cls._fetch(
+            method, cls.PAYMENT_API_URL, path, header, payload, expected_statuses
+        )
 
-        return cls._fetch(method, url, header, payload, expected_statuses)
+    @staticmethod
+    async def fan_out(*fetches):
+        """
+        Runs independent fetches concurrently and returns their results
+        in order. If one of them fails the rest are cancelled and the
+        first error (usually an HTTPException) is raised
+        """
+        tasks = [asyncio.ensure_future(fetch) for fetch in fetches]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # reap the cancelled ones so their errors are not reported as unhandled
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
     @classmethod
-    def _fetch(cls, method, url, headers, payload, expected_statuses):
+    def get_session(cls, base_url):
+        session = cls._sessions.get(base_url)
+        if session is None:
+            limits = {
+                "max_connections": cls.POOL_MAX_CONNECTIONS,
+                "max_hosts": cls.POOL_MAX_HOSTS,
+                "keepalive_expiry": cls.POOL_KEEPALIVE_EXPIRY,
+            }
+
+            adapter = UpstreamAdapter(**limits)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            cls._sessions[base_url] = session
+            cls._adapters[base_url] = adapter
+            cls._executors[base_url] = ThreadPoolExecutor(
+                max_workers=cls.POOL_MAX_CONNECTIONS, thread_name_prefix="upstream"
+            )
+            logger.info(
+                "Created upstream session for: %s, limits: %s", base_url, limits
+            )
+
+        return session
+
+    @classmethod
+    def pool_stats(cls):
+        return {
+            base_url: adapter.pool_stats()
+            for base_url, adapter in cls._adapters.items()
+        }
+
+    @classmethod
+    def close_sessions(cls):
+        for session in cls._sessions.values():
+            session.close()
+        for executor in cls._executors.values():
+            executor.shutdown(wait=False)
+
+        cls._sessions.clear()
+        cls._adapters.clear()
+        cls._executors.clear()
+
+    @classmethod
+    async def _fetch(cls, method, base_url, path, headers, payload, expected_statuses):
+        url = base_url + path
         logger.info("Sending method %s to url: %s", method, url)
         logger.debug("Header: %s, payload %s", headers, payload)
 
-        response = requests.request(method, url, json=payload, headers=headers)
+        # requests is blocking, run it in the threads of the upstream
+        session = cls.get_session(base_url)
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(
+            cls._executors[base_url],
+            functools.partial(
+                session.request, method, url, json=payload, headers=headers
+            ),
+        )
         response_code = response.status_code
         if response_code not in expected_statuses:
             raise HTTPException(
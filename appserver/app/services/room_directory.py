@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+
+from app.services.requester import Requester
+from app.services.room_index import room_index
+from app.utils.cache import TTLCache
+from fastapi import HTTPException
+from requests.exceptions import RequestException
+from starlette.status import HTTP_200_OK, HTTP_404_NOT_FOUND
+
+logger = logging.getLogger(__name__)
+
+
+class RoomDirectory:
+    """
+    Cache of the post server rooms keyed by room id.
+    Rooms are fresh for ttl seconds. With a stale_ttl greater than
+    zero an older room is still returned for that many extra seconds
+    while it is refreshed in the background (stale-while-revalidate)
+    """
+
+    ttl = float(os.getenv("ROOM_CACHE_TTL", "10"))
+    stale_ttl = float(os.getenv("ROOM_CACHE_STALE_TTL", "0"))
+
+    cache = TTLCache(
+        max_entries=int(os.getenv("ROOM_CACHE_MAX_ENTRIES", "5000")),
+        ttl=ttl + stale_ttl,
+    )
+    _revalidating = set()
+
+    @classmethod
+    async def get_room(cls, room_id):
+        entry = cls.cache.get(room_id)
+        if entry is None:
+            room = await cls._fetch(room_id)
+            return dict(room)
+
+        room, fetched_at = entry
+        if cls.cache.clock() - fetched_at > cls.ttl:
+            if cls.stale_ttl <= 0:
+                room = await cls._fetch(room_id)
+            else:
+                cls._revalidate(room_id)
+
+        return dict(room)
+
+    @classmethod
+    def update(cls, room_id, room):
+        cls.cache.set(room_id, (dict(room), cls.cache.clock()))
+        room_index.upsert(room)
+
+    @classmethod
+    def invalidate(cls, room_id):
+        cls.cache.pop(room_id)
+        room_index.remove(room_id)
+
+    @classmethod
+    def stats(cls):
+        return cls.cache.stats()
+
+    @classmethod
+    async def _fetch(cls, room_id):
+        room, _ = await Requester.room_srv_fetch(
+            method="GET", path=f"/rooms/{room_id}", expected_statuses={HTTP_200_OK}
+        )
+        cls.update(room_id, room)
+        return room
+
+    @classmethod
+    def _revalidate(cls, room_id):
+        if room_id in cls._revalidating:
+            return
+
+        cls._revalidating.add(room_id)
+        asyncio.ensure_future(cls._background_fetch(room_id))
+
+    @classmethod
+    async def _background_fetch(cls, room_id):
+        try:
+            await cls._fetch(room_id)
+        except HTTPException as err:
+            if err.status_code == HTTP_404_NOT_FOUND:
+                cls.invalidate(room_id)
+            logger.warning("Failed to revalidate room %d: %s", room_id, err.detail)
+        except RequestException as err:
+            logger.warning("Failed to revalidate room %d: %s", room_id, err)
+        finally:
+            cls._revalidating.discard(room_id)
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+
+from app.services.requester import Requester
+from fastapi import HTTPException
+from requests.exceptions import RequestException
+from starlette.status import HTTP_200_OK
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+
+def distance_km(lat_a, lon_a, lat_b, lon_b):
+    """Haversine distance between two coordinates"""
+    lat_a, lon_a, lat_b, lon_b = map(math.radians, (lat_a, lon_a, lat_b, lon_b))
+    hav = (
+        math.sin((lat_b - lat_a) / 2) ** 2 +
+        math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(hav))
+
+
+class RoomIndex:
+    """
+    In-memory grid of the bookable (not blocked) rooms by coordinates,
+    with cells of cell_degrees per side. It is loaded from a snapshot
+    of the post server rooms every refresh_interval seconds and kept
+    up to date in between with the rooms the appserver writes or reads.
+    Until the first snapshot is loaded it is not ready and searches
+    have to go to the post server
+    """
+
+    def __init__(self, cell_degrees=0.05, refresh_interval=60, page_size=500):
+        self.cell_degrees = cell_degrees
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+
+        self.rooms = {}
+        self._cells = defaultdict(set)
+        self._room_cells = {}
+        self.loaded_at = None
+        self._refresh_task = None
+
+    @property
+    def ready(self):
+        return self.loaded_at is not None
+
+    def clear(self):
+        self.rooms = {}
+        self._cells = defaultdict(set)
+        self._room_cells = {}
+        self.loaded_at = None
+
+    def load(self, rooms):
+        self.clear()
+        for room in rooms:
+            self.upsert(room)
+
+        self.loaded_at = time.monotonic()
+        logger.info("Loaded %d rooms in the room index", len(self.rooms))
+
+    def upsert(self, room):
+        self.remove(room["id"])
+        if room.get("blocked"):
+            return
+
+        cell = self._cell(room["latitude"], room["longitude"])
+        self.rooms[room["id"]] = dict(room)
+        self._cells[cell].add(room["id"])
+        self._room_cells[room["id"]] = cell
+
+    def remove(self, room_id):
+        cell = self._room_cells.pop(room_id, None)
+        if cell is None:
+            return
+
+        del self.rooms[room_id]
+        self._cells[cell].discard(room_id)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def within_radius(self, latitude, longitude, radius_km, **filters):
+        """Rooms at most radius_km away, the closest first"""
+        lat_delta = radius_km / KM_PER_DEGREE
+        lon_delta = radius_km / (
+            KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+        )
+
+        found = []
+        for room in self._candidates(
+            latitude - lat_delta,
+            longitude - lon_delta,
+            latitude + lat_delta,
+            longitude + lon_delta,
+        ):
+            distance = distance_km(
+                latitude, longitude, room["latitude"], room["longitude"]
+            )
+            if distance <= radius_km and self._matches(room, **filters):
+                found.append((distance, room["id"], room))
+
+        found.sort(key=lambda item: item[:2])
+        return [dict(room) for _, _, room in found]
+
+    def within_bbox(self, south, west, north, east, **filters):
+        """Rooms inside the bounding box, by id"""
+        found = [
+            room
+            for room in self._candidates(south, west, north, east)
+            if south <= room["latitude"] <= north and
+            west <= room["longitude"] <= east and
+            self._matches(room, **filters)
+        ]
+
+        found.sort(key=lambda room: room["id"])
+        return [dict(room) for room in found]
+
+    def matching(self, **filters):
+        """All the rooms matching the filters, by id"""
+        found = [room for room in self.rooms.values() if self._matches(room, **filters)]
+
+        found.sort(key=lambda room: room["id"])
+        return [dict(room) for room in found]
+
+    def _candidates(self, south, west, north, east):
+        south_cell, west_cell = self._cell(south, west)
+        north_cell, east_cell = self._cell(north, east)
+
+        cell_count = (north_cell - south_cell + 1) * (east_cell - west_cell + 1)
+        if cell_count > len(self._cells):
+            # a big area, cheaper to look at the occupied cells only
+            for (lat_cell, lon_cell), room_ids in self._cells.items():
+                if (
+                    south_cell <= lat_cell <= north_cell and
+                    west_cell <= lon_cell <= east_cell
+                ):
+                    for room_id in room_ids:
+                        yield self.rooms[room_id]
+            return
+
+        for lat_cell in range(south_cell, north_cell + 1):
+            for lon_cell in range(west_cell, east_cell + 1):
+                for room_id in self._cells.get((lat_cell, lon_cell), ()):
+                    yield self.rooms[room_id]
+
+    @staticmethod
+    def _matches(room, min_price=None, max_price=None, people=None, types=None):
+        if min_price is not None and room["price_per_day"] < min_price:
+            return False
+        if max_price is not None and room["price_per_day"] > max_price:
+            return False
+        if people is not None and room["capacity"] < people:
+            return False
+        if types and room["type"] not in types:
+            return False
+
+        return True
+
+    def _cell(self, latitude, longitude):
+        return (
+            math.floor(latitude / self.cell_degrees),
+            math.floor(longitude / self.cell_degrees),
+        )
+
+    async def refresh(self):
+        rooms = []
+        cursor = None
+        while True:
+            path = f"/rooms?limit={self.page_size}"
+            if cursor is not None:
+                path = path + f"&cursor={cursor}"
+
+            page = await self._fetch_rooms(path)
+            rooms.extend(page["rooms"])
+
+            cursor = page.get("next_cursor")
+            if cursor is None:
+                break
+
+        if "cursor=" not in path and len(rooms) == self.page_size:
+            # an exactly full first page without a cursor to go on from, the
+            # post server may honor limit but not cursors: the snapshot goes
+            # in one request. A longer page means limit was ignored, it is whole
+            rooms = (await self._fetch_rooms("/rooms"))["rooms"]
+
+        self.load(rooms)
+
+    @staticmethod
+    async def _fetch_rooms(path):
+        page, _ = await Requester.room_srv_fetch(
+            method="GET", path=path, expected_statuses={HTTP_200_OK}
+        )
+        return page
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self.refresh()
+            except (HTTPException, RequestException, KeyError, ValueError) as err:
+                logger.warning("Failed to refresh the room index: %s", err)
+
+            await asyncio.sleep(self.refresh_interval)
+
+    def start_refresh(self):
+        if self.refresh_interval <= 0 or self._refresh_task is not None:
+            return
+
+        self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+
+    def stop_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+room_index = RoomIndex(
+    cell_degrees=float(os.getenv("ROOM_INDEX_CELL_DEGREES", "0.05")),
+    refresh_interval=float(os.getenv("ROOM_INDEX_REFRESH_INTERVAL", "60")),
+    page_size=int(os.getenv("ROOM_INDEX_PAGE_SIZE", "500")),
+)
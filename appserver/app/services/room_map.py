@@ -0,0 +1,60 @@
+import math
+import os
+from collections import defaultdict
+
+MAP_CLUSTER_THRESHOLD = int(os.getenv("MAP_CLUSTER_THRESHOLD", "200"))
+# cluster cells per 256px map tile side, about 64px each
+MAP_CLUSTER_CELLS_PER_TILE = int(os.getenv("MAP_CLUSTER_CELLS_PER_TILE", "4"))
+
+
+def to_marker(room):
+    return {
+        "id": room["id"],
+        "latitude": room["latitude"],
+        "longitude": room["longitude"],
+        "price_per_day": room["price_per_day"],
+        "type": room["type"],
+    }
+
+
+def build_map(rooms, zoom, threshold=None):
+    """
+    Markers of the rooms, or when there are more than threshold of them,
+    clusters of the rooms that fall in the same cell of a grid sized
+    for the zoom level. Cells with a single room stay as a marker
+    """
+    if threshold is None:
+        threshold = MAP_CLUSTER_THRESHOLD
+
+    if len(rooms) <= threshold:
+        markers = [to_marker(room) for room in rooms]
+        return {"amount": len(rooms), "markers": markers, "clusters": []}
+
+    cell_degrees = 360 / (2 ** zoom) / MAP_CLUSTER_CELLS_PER_TILE
+    cells = defaultdict(list)
+    for room in rooms:
+        cell = (
+            math.floor(room["latitude"] / cell_degrees),
+            math.floor(room["longitude"] / cell_degrees),
+        )
+        cells[cell].append(room)
+
+    markers = []
+    clusters = []
+    for _, cell_rooms in sorted(cells.items()):
+        if len(cell_rooms) == 1:
+            markers.append(to_marker(cell_rooms[0]))
+            continue
+
+        prices = [room["price_per_day"] for room in cell_rooms]
+        clusters.append(
+            {
+                "latitude": sum(r["latitude"] for r in cell_rooms) / len(cell_rooms),
+                "longitude": sum(r["longitude"] for r in cell_rooms) / len(cell_rooms),
+                "count": len(cell_rooms),
+                "min_price": min(prices),
+                "max_price": max(prices),
+            }
+        )
+
+    return {"amount": len(rooms), "markers": markers, "clusters": clusters}
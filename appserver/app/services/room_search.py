@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+
+from app.services.requester import Requester
+from app.utils.cache import TTLCache
+from dateutil import parser
+from starlette.status import HTTP_200_OK
+
+logger = logging.getLogger(__name__)
+
+
+class RoomSearch:
+    """
+    Short lived cache of the post server room searches. Equivalent
+    filter sets share an entry (types are sorted, coordinates rounded
+    to coord_decimals and dates normalized) and concurrent identical
+    searches wait on a single upstream call. The whole result is
+    cached, every page of a search is cut from the same entry
+    """
+
+    coord_decimals = int(os.getenv("ROOM_SEARCH_COORD_DECIMALS", "3"))
+
+    cache = TTLCache(
+        max_entries=int(os.getenv("ROOM_SEARCH_CACHE_MAX_ENTRIES", "1000")),
+        ttl=float(os.getenv("ROOM_SEARCH_CACHE_TTL", "5")),
+    )
+    _inflight = {}
+    # searches started before an invalidation must not be cached
+    _generation = 0
+
+    @classmethod
+    async def search(cls, filters):
+        key = cls.normalize(filters)
+
+        rooms = cls.cache.get(key)
+        if rooms is None:
+            # a search started before a room was written is not joined
+            inflight_key = (cls._generation, key)
+            fetch = cls._inflight.get(inflight_key)
+            if fetch is None:
+                fetch = asyncio.ensure_future(cls._fetch(key))
+                cls._inflight[inflight_key] = fetch
+                fetch.add_done_callback(
+                    lambda _: cls._inflight.pop(inflight_key, None)
+                )
+            else:
+                logger.debug("Joining in-flight room search: %s", key)
+
+            # a cancelled request must not cancel the search of the others
+            rooms = await asyncio.shield(fetch)
+
+        return {**rooms, "rooms": [dict(room) for room in rooms["rooms"]]}
+
+    @classmethod
+    def invalidate(cls):
+        cls._generation += 1
+        cls.cache.clear()
+
+    @classmethod
+    def stats(cls):
+        return cls.cache.stats()
+
+    @classmethod
+    def normalize(cls, filters):
+        normalized = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+
+            if name in ("latitude", "longitude"):
+                value = round(value, cls.coord_decimals)
+            elif name in ("date_begins", "date_ends"):
+                value = cls._normalize_date(value)
+            elif name == "types":
+                value = tuple(sorted(set(value)))
+
+            normalized.append((name, value))
+
+        return tuple(sorted(normalized))
+
+    @staticmethod
+    def _normalize_date(value):
+        try:
+            return parser.parse(value).date().isoformat()
+        except (ValueError, OverflowError):
+            # left as it came, the post server reports the error
+            return value
+
+    @classmethod
+    async def _fetch(cls, key):
+        generation = cls._generation
+
+        query = []
+        for name, value in key:
+            if name == "types":
+                for specific_type in value:
+                    query.append(f"types={specific_type}")
+            else:
+                query.append(f"{name}={value}")
+
+        path = "/rooms"
+        if query:
+            path = path + "/?" + "&".join(query)
+
+        rooms, _ = await Requester.room_srv_fetch(
+            method="GET", path=path, expected_statuses={HTTP_200_OK}
+        )
+
+        if generation == cls._generation:
+            cls.cache.set(key, rooms)
+
+        return rooms
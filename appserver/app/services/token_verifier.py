@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+
+import app.errors.auth_error as ae
+from app.services.requester import Requester
+from app.utils.jwt_utils import decode
+from fastapi import HTTPException
+from requests.exceptions import RequestException
+from starlette.status import HTTP_200_OK
+
+logger = logging.getLogger(__name__)
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:  # RS256 tokens are then verified by the auth server
+    serialization = None
+
+
+class TokenVerifier:
+    """
+    Verifies access tokens signatures locally with the auth server key.
+    verify returns the token owner uuid, raises an AuthException if
+    the token is definitely invalid, or returns None when the check is
+    inconclusive (no key loaded, unsupported algorithm, rotated key...)
+    and the auth server has to be asked instead.
+    """
+
+    HMAC_ALGORITHMS = {
+        "HS256": hashlib.sha256,
+        "HS384": hashlib.sha384,
+        "HS512": hashlib.sha512,
+    }
+
+    def __init__(
+        self,
+        secret=None,
+        public_key=None,
+        key_path=None,
+        refresh_interval=600,
+        uuid_claim="uuid",
+    ):
+        self.uuid_claim = uuid_claim
+        self.key_path = key_path
+        self.refresh_interval = refresh_interval
+
+        self.algorithm = None
+        self.key = None
+        self.key_id = None
+        self._refresh_task = None
+
+        if secret:
+            self.set_key("HS256", secret)
+        elif public_key:
+            self.set_key("RS256", public_key)
+
+    def set_key(self, algorithm, key, key_id=None):
+        if algorithm in self.HMAC_ALGORITHMS:
+            key = key.encode()
+        elif algorithm == "RS256" and serialization is not None:
+            key = serialization.load_pem_public_key(key.encode(), default_backend())
+        else:
+            logger.warning("Unsupported token algorithm: %s", algorithm)
+            return
+
+        self.algorithm = algorithm
+        self.key = key
+        self.key_id = key_id
+        logger.info("Loaded %s token verification key", algorithm)
+
+    def clear_key(self):
+        self.algorithm = None
+        self.key = None
+        self.key_id = None
+
+    def verify(self, token):
+        if self.key is None:
+            return None
+
+        decoded = decode(token)
+        if decoded is None:
+            return None
+
+        header, claims, signing_input, signature = decoded
+        if header.get("alg") != self.algorithm:
+            return None
+
+        key_id = header.get("kid")
+        if key_id is not None and self.key_id is not None and key_id != self.key_id:
+            # signed with a key we have not loaded yet
+            return None
+
+        if not self._has_valid_signature(signing_input, signature):
+            logger.warning("Token with invalid signature")
+            raise ae.InvalidIdTokenError()
+
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)) and exp <= time.time():
+            raise ae.ExpiredIdTokenError()
+
+        uuid = claims.get(self.uuid_claim)
+        if not isinstance(uuid, int):
+            return None
+
+        return uuid
+
+    def _has_valid_signature(self, signing_input, signature):
+        if self.algorithm in self.HMAC_ALGORITHMS:
+            digestmod = self.HMAC_ALGORITHMS[self.algorithm]
+            expected = hmac.new(self.key, signing_input, digestmod).digest()
+            return hmac.compare_digest(expected, signature)
+
+        try:
+            self.key.verify(
+                signature, signing_input, padding.PKCS1v15(), hashes.SHA256()
+            )
+        except InvalidSignature:
+            return False
+
+        return True
+
+    async def refresh_key(self):
+        key_data, _ = await Requester.auth_srv_fetch(
+            method="GET", path=self.key_path, expected_statuses={HTTP_200_OK}
+        )
+        self.set_key(key_data["algorithm"], key_data["key"], key_data.get("kid"))
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self.refresh_key()
+            except (HTTPException, RequestException, KeyError, ValueError) as err:
+                logger.warning("Failed to refresh token verification key: %s", err)
+
+            await asyncio.sleep(self.refresh_interval)
+
+    def start_refresh(self):
+        if self.key_path is None or self._refresh_task is not None:
+            return
+
+        self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+
+    def stop_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+token_verifier = TokenVerifier(
+    secret=os.environ.get("AUTH_TOKEN_SECRET"),
+    public_key=os.environ.get("AUTH_TOKEN_PUBLIC_KEY"),
+    key_path=os.environ.get("AUTH_TOKEN_KEY_PATH"),
+    refresh_interval=float(os.getenv("AUTH_TOKEN_KEY_REFRESH_INTERVAL", "600")),
+    uuid_claim=os.getenv("AUTH_TOKEN_UUID_CLAIM", "uuid"),
+)
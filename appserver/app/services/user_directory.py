@@ -0,0 +1,46 @@
+import logging
+import os
+
+from app.services.requester import Requester
+from app.utils.cache import TTLCache
+from starlette.status import HTTP_200_OK
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectory:
+    """
+    Read-through cache of the user server profiles, used where a
+    handler only needs to know who a user is (i.e. its display name)
+    """
+
+    cache = TTLCache(
+        max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "5000")),
+        ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+    )
+
+    @classmethod
+    async def get_user(cls, uuid):
+        user = cls.cache.get(uuid)
+        if user is None:
+            user, _ = await Requester.user_srv_fetch(
+                method="GET", path=f"/users/{uuid}", expected_statuses={HTTP_200_OK}
+            )
+            cls.cache.set(uuid, user)
+        else:
+            logger.debug("User cache hit for uuid: %d", uuid)
+
+        return dict(user)
+
+    @classmethod
+    async def get_display_name(cls, uuid):
+        user = await cls.get_user(uuid)
+        return f"{user['firstname']} {user['lastname']}"
+
+    @classmethod
+    def invalidate(cls, uuid):
+        cls.cache.pop(uuid)
+
+    @classmethod
+    def stats(cls):
+        return cls.cache.stats()
@@ -1,9 +1,81 @@
-import itertools
+import io
+import os
+import random
+import threading
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # photos are then stored without resized variants
+    Image = None
+
+# about a 50 megapixel camera, decoding one takes ~150 MB per resize worker
+PHOTO_MAX_PIXELS = int(os.getenv("PHOTO_MAX_PIXELS", str(50 * 1000 * 1000)))
+if Image is not None:
+    # set on import, so also in the worker processes that decode the photos
+    Image.MAX_IMAGE_PIXELS = PHOTO_MAX_PIXELS
+
+# 2020-01-01T00:00:00Z
+ID_EPOCH = 1577836800
+SEQUENCE_BITS = 21
 
 
 class IdGenerator:
-    gen = itertools.count()
+    """
+    Time ordered ids that fit in 53 bits (safe as JSON numbers):
+    seconds since ID_EPOCH followed by a sequence that starts at a
+    random value every second, so ids do not repeat after a restart
+    and workers are very unlikely to pick the same one
+    """
+
+    _lock = threading.Lock()
+    _last_second = None
+    _sequence = 0
 
     @staticmethod
     def generate() -> int:
-        return next(IdGenerator.gen)
+        with IdGenerator._lock:
+            second = max(int(time.time()) - ID_EPOCH, 0)
+            if IdGenerator._last_second is not None:
+                # never go back, even if the clock does
+                second = max(second, IdGenerator._last_second)
+
+            if second != IdGenerator._last_second:
+                IdGenerator._last_second = second
+                IdGenerator._sequence = random.getrandbits(SEQUENCE_BITS)
+            else:
+                IdGenerator._sequence += 1
+                if IdGenerator._sequence >> SEQUENCE_BITS:
+                    # sequence exhausted, borrow the next second
+                    IdGenerator._last_second += 1
+                    IdGenerator._sequence = 0
+
+            return (IdGenerator._last_second << SEQUENCE_BITS) | IdGenerator._sequence
+
+
+def create_variants(data: bytes, sizes: dict, quality: int = 85) -> dict:
+    """
+    Decodes the image once and returns a JPEG of each variant, scaled
+    so its longest side is at most the given size (name -> bytes).
+    Runs in a worker process, it only takes and returns plain data.
+    Raises ValueError if data is not an image or if it has more pixels
+    than Image.MAX_IMAGE_PIXELS, which is checked before decoding it
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # pillow only refuses images over twice its limit
+            if image.width * image.height > Image.MAX_IMAGE_PIXELS:
+                raise ValueError("The image has too many pixels")
+            image = ImageOps.exif_transpose(image).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as err:
+        raise ValueError("Not a valid image") from err
+
+    variants = {}
+    # largest first, each one is scaled down from the previous
+    for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+        variants[name] = output.getvalue()
+
+    return variants
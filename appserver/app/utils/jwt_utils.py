@@ -0,0 +1,52 @@
+import base64
+import binascii
+import json
+
+
+def _b64decode(segment):
+    padding = "=" * (-len(segment) % 4)
+    return base64.urlsafe_b64decode(segment + padding)
+
+
+def decode(token):
+    """
+    Splits a JWT into (header, claims, signing_input, signature)
+    without verifying it, or returns None if it is not well formed
+    """
+    try:
+        header_segment, payload_segment, signature_segment = token.split(".")
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(payload_segment))
+        signature = _b64decode(signature_segment)
+    except (ValueError, binascii.Error):
+        return None
+
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        return None
+
+    signing_input = f"{header_segment}.{payload_segment}".encode()
+    return header, claims, signing_input, signature
+
+
+def decode_payload(token):
+    """
+    Returns the claims of a JWT without verifying its signature,
+    or None if the token is not a well formed JWT
+    """
+    decoded = decode(token)
+    if decoded is None:
+        return None
+
+    return decoded[1]
+
+
+def get_expiration(token):
+    claims = decode_payload(token)
+    if claims is None:
+        return None
+
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        return None
+
+    return exp
@@ -0,0 +1,60 @@
+import base64
+import binascii
+import json
+import os
+
+from app.errors.http_error import BadRequestError
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+
+def encode_cursor(offset):
+    data = json.dumps({"offset": offset}).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor):
+    if cursor is None:
+        return 0
+
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(cursor + padding))["offset"]
+    except (ValueError, KeyError, TypeError, binascii.Error) as err:
+        raise BadRequestError("Invalid cursor") from err
+
+    if not isinstance(offset, int) or offset < 0:
+        raise BadRequestError("Invalid cursor")
+
+    return offset
+
+
+def page_bounds(total, limit, cursor):
+    """
+    Returns the (start, end) slice of the page and the cursor
+    of the following one, None if it is the last page
+    """
+    start = min(decode_cursor(cursor), total)
+    end = min(start + limit, total)
+
+    next_cursor = None
+    if end < total:
+        next_cursor = encode_cursor(end)
+
+    return start, end, next_cursor
+
+
+def paginate(payload, key, limit, cursor):
+    """
+    Cuts the page of limit items at cursor from a list response of an
+    upstream server. amount stays the total number of items
+    """
+    items = payload[key]
+    start, end, next_cursor = page_bounds(len(items), limit, cursor)
+
+    page = dict(payload)
+    page[key] = items[start:end]
+    page["amount"] = len(items)
+    page["next_cursor"] = next_cursor
+    return page
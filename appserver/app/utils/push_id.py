@@ -0,0 +1,44 @@
+import random
+import threading
+import time
+
+# same alphabet as the Firebase clients, ordered so keys sort by time
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+_lock = threading.Lock()
+_last_time = 0
+_last_random = [0] * 12
+_random = random.SystemRandom()
+
+
+def generate_push_id(now=None):
+    """
+    Generates a Realtime DB push key locally, without the round trip
+    of ref.push(). Keys made in the same millisecond stay ordered
+    """
+    global _last_time  # pylint: disable=global-statement
+
+    if now is None:
+        now = int(time.time() * 1000)
+
+    with _lock:
+        if now == _last_time:
+            # increments the random part as a base 64 number
+            for i in range(11, -1, -1):
+                if _last_random[i] != 63:
+                    _last_random[i] += 1
+                    break
+                _last_random[i] = 0
+        else:
+            _last_time = now
+            for i in range(12):
+                _last_random[i] = _random.randrange(64)
+
+        random_chars = "".join(PUSH_CHARS[i] for i in _last_random)
+
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+
+    return "".join(reversed(time_chars)) + random_chars
@@ -0,0 +1,12 @@
+-- create_all does not alter existing tables. Run this once on
+-- databases created before photo ids became 53 bits and photos were
+-- indexed by content.
+-- The post server stores the same firebase_id with its room photos:
+-- its column has to hold 64 bit integers too (ids are about 4e14,
+-- far over a 32 bit INTEGER) before this version is deployed.
+ALTER TABLE room_photos ALTER COLUMN firebase_id TYPE BIGINT;
+ALTER TABLE room_photos ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+ALTER TABLE room_photos ADD COLUMN IF NOT EXISTS url VARCHAR;
+ALTER TABLE room_photos ADD COLUMN IF NOT EXISTS thumbnail_url VARCHAR;
+ALTER TABLE room_photos ADD COLUMN IF NOT EXISTS medium_url VARCHAR;
+CREATE INDEX IF NOT EXISTS ix_room_photos_content_hash ON room_photos (content_hash);
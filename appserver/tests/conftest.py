@@ -3,6 +3,13 @@ import tempfile
 import pytest
 from app.db import Base, get_db
 from app.main import app
+from app.services.authsender import AuthSender
+from app.services.availability import booking_index
+from app.services.notifier import notifier
+from app.services.room_directory import RoomDirectory
+from app.services.room_index import room_index
+from app.services.room_search import RoomSearch
+from app.services.user_directory import UserDirectory
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -30,3 +37,15 @@ def test_app():
     app.dependency_overrides[get_db] = get_testing_db
 
     yield client  # testing happens here
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # every test mocks its own upstream responses
+    AuthSender.token_cache.clear()
+    UserDirectory.cache.clear()
+    RoomDirectory.cache.clear()
+    RoomSearch.invalidate()
+    room_index.clear()
+    booking_index.clear()
+    notifier.queued.clear()
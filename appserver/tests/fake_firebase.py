@@ -0,0 +1,124 @@
+from collections import OrderedDict
+
+from app.services.chat import ChatFirebase
+from app.utils.cache import TTLCache
+
+
+def key_order(key):
+    # the Realtime DB sorts integer-like keys numerically before the rest
+    try:
+        return 0, int(key), ""
+    except ValueError:
+        return 1, 0, key
+
+
+def _split(path):
+    return [part for part in path.split("/") if part]
+
+
+class FakeReference:
+    """
+    In-memory stand-in of a firebase_admin db.Reference over a nested dict,
+    with the key queries and multi-path updates the services use
+    """
+
+    def __init__(self, data=None, path=()):
+        self.data = data if data is not None else {}
+        self.path = tuple(path)
+        self.reads = []
+
+    def child(self, path):
+        child = FakeReference(self.data, self.path + tuple(_split(path)))
+        child.reads = self.reads
+        return child
+
+    def order_by_key(self):
+        return FakeQuery(self)
+
+    def get(self):
+        self.reads.append("/".join(self.path))
+        return self._value()
+
+    def set(self, value):
+        *parents, last = self.path
+        node = self.data
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[last] = value
+
+    def update(self, values):
+        for path, value in values.items():
+            child = self.child(path)
+            if isinstance(value, dict) and ".sv" in value:
+                value = (child._value() or 0) + value[".sv"]["increment"]
+            child.set(value)
+
+    def delete(self):
+        *parents, last = self.path
+        node = self.data
+        for part in parents:
+            node = node.get(part, {})
+        node.pop(last, None)
+
+    def _value(self):
+        node = self.data
+        for part in self.path:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+
+class FakeQuery:
+    def __init__(self, reference):
+        self.reference = reference
+        self.start = None
+        self.end = None
+        self.first = None
+        self.last = None
+
+    def start_at(self, key):
+        self.start = key
+        return self
+
+    def end_at(self, key):
+        self.end = key
+        return self
+
+    def limit_to_first(self, limit):
+        self.first = limit
+        return self
+
+    def limit_to_last(self, limit):
+        self.last = limit
+        return self
+
+    def get(self):
+        value = self.reference.get()
+        if value is None:
+            return None
+
+        keys = sorted(value, key=key_order)
+        if self.start is not None:
+            keys = [key for key in keys if key_order(key) >= key_order(self.start)]
+        if self.end is not None:
+            keys = [key for key in keys if key_order(key) <= key_order(self.end)]
+        if self.first is not None:
+            keys = keys[:self.first]
+        if self.last is not None:
+            keys = keys[-self.last:]
+
+        return OrderedDict((key, value[key]) for key in keys)
+
+
+def make_chat_service(data=None):
+    """A ChatFirebase over a FakeReference, as chats/ and messages/"""
+    chat = ChatFirebase.__new__(ChatFirebase)
+    chat.chat_db_path = "chats"
+    chat.message_db_path = "messages"
+    chat.db_root = FakeReference(data)
+    chat.db_chats = chat.db_root.child("chats")
+    chat.db_messages = chat.db_root.child("messages")
+    chat.tails = TTLCache(max_entries=100, ttl=600)
+    chat.inboxes = TTLCache(max_entries=100, ttl=30)
+    return chat
@@ -0,0 +1,184 @@
+import hashlib
+import hmac
+import json
+import re
+import time
+
+import responses
+from app.services.authsender import AuthSender
+from app.services.token_verifier import token_verifier
+from starlette.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED
+from tests.mock_models.user_models import MockUserResponse
+from tests.utils import (APPSERVER_URL, AUTH_API_URL, AUTH_REGEX, USER_REGEX,
+                         b64encode)
+
+
+TEST_SECRET = "elsecretodelauth"
+
+
+def make_token(claims, secret=TEST_SECRET):
+    header = b64encode(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = b64encode(json.dumps(claims).encode())
+    signing_input = f"{header}.{payload}".encode()
+    signature = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+    return f"{header}.{payload}.{b64encode(signature)}"
+
+
+def use_test_secret(monkeypatch):
+    monkeypatch.setattr(token_verifier, "algorithm", "HS256")
+    monkeypatch.setattr(token_verifier, "key", TEST_SECRET.encode())
+
+
+def auth_calls():
+    return [
+        call for call in responses.calls if call.request.url.startswith(AUTH_API_URL)
+    ]
+
+
+@responses.activate
+def test_token_verification_is_cached(test_app):
+    test_user = MockUserResponse().dict()
+    header = {"x-access-token": "tokencacheado"}
+
+    responses.add(
+        responses.GET,
+        re.compile(AUTH_REGEX),
+        json={"uuid": test_user["id"]},
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.GET,
+        re.compile(USER_REGEX),
+        json=test_user,
+        status=HTTP_200_OK,
+    )
+
+    first_response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+    second_response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+
+    assert first_response.status_code == HTTP_200_OK
+    assert second_response.status_code == HTTP_200_OK
+    # both dependencies of both requests are served by a single auth call
+    assert len(auth_calls()) == 1
+
+
+@responses.activate
+def test_invalid_token_is_rejected(test_app):
+    header = {"x-access-token": "tokeninvalido"}
+
+    responses.add(
+        responses.GET,
+        re.compile(AUTH_REGEX),
+        json={"error": "invalid token"},
+        status=HTTP_401_UNAUTHORIZED,
+    )
+
+    response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+
+    assert response.status_code == HTTP_401_UNAUTHORIZED
+    assert AuthSender.token_cache.get(AuthSender._token_key("tokeninvalido")) is None
+
+
+@responses.activate
+def test_delete_user_invalidates_cached_tokens(test_app):
+    test_user = MockUserResponse().dict()
+    test_user_id = test_user["id"]
+    header = {"x-access-token": "tokendeborrado"}
+
+    responses.add(
+        responses.GET,
+        re.compile(AUTH_REGEX),
+        json={"uuid": test_user_id},
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.DELETE,
+        re.compile(AUTH_REGEX),
+        json={"email": test_user["email"], "uuid": test_user_id},
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.DELETE,
+        re.compile(USER_REGEX),
+        json=test_user,
+        status=HTTP_200_OK,
+    )
+
+    response = test_app.delete(f"{APPSERVER_URL}/users/{test_user_id}", headers=header)
+
+    assert response.status_code == HTTP_200_OK
+    assert AuthSender.token_cache.get(AuthSender._token_key("tokendeborrado")) is None
+
+
+@responses.activate
+def test_token_verified_locally(test_app, monkeypatch):
+    test_user = MockUserResponse().dict()
+    token = make_token({"uuid": test_user["id"], "exp": time.time() + 60})
+    header = {"x-access-token": token}
+
+    use_test_secret(monkeypatch)
+    responses.add(
+        responses.GET,
+        re.compile(USER_REGEX),
+        json=test_user,
+        status=HTTP_200_OK,
+    )
+
+    response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+
+    assert response.status_code == HTTP_200_OK
+    assert len(auth_calls()) == 0
+
+
+@responses.activate
+def test_token_with_invalid_signature_rejected_locally(test_app, monkeypatch):
+    token = make_token({"uuid": 1, "exp": time.time() + 60}, secret="otrosecreto")
+    header = {"x-access-token": token}
+
+    use_test_secret(monkeypatch)
+
+    response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+
+    assert response.status_code == HTTP_401_UNAUTHORIZED
+    assert response.json()["error"] == "Invalid token"
+    assert len(auth_calls()) == 0
+
+
+@responses.activate
+def test_expired_token_rejected_locally(test_app, monkeypatch):
+    token = make_token({"uuid": 1, "exp": time.time() - 60})
+    header = {"x-access-token": token}
+
+    use_test_secret(monkeypatch)
+
+    response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+
+    assert response.status_code == HTTP_401_UNAUTHORIZED
+    assert response.json()["error"] == "Token has expired"
+    assert len(auth_calls()) == 0
+
+
+@responses.activate
+def test_token_without_uuid_claim_verified_by_auth_server(test_app, monkeypatch):
+    test_user = MockUserResponse().dict()
+    token = make_token({"email": test_user["email"], "exp": time.time() + 60})
+    header = {"x-access-token": token}
+
+    use_test_secret(monkeypatch)
+    responses.add(
+        responses.GET,
+        re.compile(AUTH_REGEX),
+        json={"uuid": test_user["id"]},
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.GET,
+        re.compile(USER_REGEX),
+        json=test_user,
+        status=HTTP_200_OK,
+    )
+
+    response = test_app.get(f"{APPSERVER_URL}/me", headers=header)
+
+    assert response.status_code == HTTP_200_OK
+    assert len(auth_calls()) == 1
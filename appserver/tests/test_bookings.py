@@ -2,7 +2,8 @@ import re
 
 import responses
 from app.services.authsender import AuthSender
-from starlette.status import HTTP_200_OK, HTTP_201_CREATED
+from app.services.availability import booking_index
+from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_409_CONFLICT
 from tests.mock_models.booking_models import (MockBookingAcceptedResponse,
                                               MockBookingListResponse,
                                               MockBookingRejectedResponse,
@@ -13,7 +14,7 @@ from tests.mock_models.room_models import MockRoomResponse
 from tests.utils import (APPSERVER_URL, PAYMENT_BOOKING_ACCEPT_REGEX,
                          PAYMENT_BOOKING_REGEX, PAYMENT_BOOKING_REJECT_REGEX,
                          POSTSERVER_ROOM_BOOKING_REGEX, POSTSERVER_ROOM_REGEX,
-                         USER_REGEX, check_responses_equality)
+                         USER_REGEX, async_return, check_responses_equality)
 
 
 def payment_camel_to_snake(payment_payload):
@@ -62,9 +63,9 @@ def test_add_room_booking(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "can_book_room", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -101,6 +102,39 @@ def test_add_room_booking(test_app, monkeypatch):
     check_responses_equality(response.json(), test_camel, attrs_to_test)
 
 
+@responses.activate
+def test_add_conflicting_room_booking(test_app, monkeypatch):
+    test_booking = MockBookingResponse().dict()
+    test_room = MockRoomResponse().dict()
+    header = {"x-access-token": "tokenrefalso"}
+    test_user_id = 1
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "can_book_room", lambda x, y: True)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+    booking_index.load([payment_camel_to_snake(test_booking)])
+
+    # starts the last night of the existing booking
+    response = test_app.post(
+        f"{APPSERVER_URL}/bookings",
+        json={
+            "room_id": test_booking["roomId"],
+            "date_from": "2020-12-18",
+            "date_to": "2020-12-22",
+        },
+        headers=header,
+    )
+    assert response.status_code == HTTP_409_CONFLICT
+    assert not any(call.request.method == "POST" for call in responses.calls)
+
+
 # Mock accept
 @responses.activate
 def test_accept_room_booking(test_app, monkeypatch):
@@ -125,9 +159,9 @@ def test_accept_room_booking(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -187,9 +221,9 @@ def test_reject_room_booking(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -324,9 +358,9 @@ def test_delete_room_booking(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -0,0 +1,426 @@
+import re
+
+import responses
+from app.api.routes import me_router
+from app.services import chat as chat_module
+from app.services.authsender import AuthSender
+from app.services.chat_tail import ChatTail
+from app.services.notifier import notifier
+from app.utils.push_id import generate_push_id
+from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_404_NOT_FOUND
+from tests.fake_firebase import make_chat_service
+from tests.mock_models.user_models import MockUserResponse
+from tests.utils import APPSERVER_URL, USER_REGEX, async_return, run
+
+USER_UUID = 1
+OTHER_UUID = 2
+CHAT_NAME = "2-1"
+
+
+def make_message(number, sender_uuid=USER_UUID, receiver_uuid=OTHER_UUID):
+    return {
+        "sender_name": f"user {sender_uuid}",
+        "receiver_name": f"user {receiver_uuid}",
+        "sender_uuid": sender_uuid,
+        "receiver_uuid": receiver_uuid,
+        "message": f"message {number}",
+        "timestamp": 1600000000 + number,
+    }
+
+
+def message_key(number):
+    # sorts before the push keys generated now
+    return f"-A{number:04d}"
+
+
+def make_chat(amount):
+    messages = {message_key(i): make_message(i) for i in range(amount)}
+    return make_chat_service({"messages": {CHAT_NAME: messages}})
+
+
+def test_get_messages_between_returns_the_newest_page():
+    chat = make_chat(5)
+
+    messages, next_cursor = chat.get_messages_between(USER_UUID, OTHER_UUID, 2)
+
+    assert [m["id"] for m in messages] == [message_key(3), message_key(4)]
+    assert next_cursor == message_key(3)
+
+
+def test_get_messages_between_pages_back_without_repeating_the_cursor():
+    chat = make_chat(5)
+
+    messages, cursor = chat.get_messages_between(USER_UUID, OTHER_UUID, 2)
+    seen = [m["id"] for m in messages]
+    while cursor is not None:
+        messages, cursor = chat.get_messages_between(USER_UUID, OTHER_UUID, 2, cursor)
+        seen = [m["id"] for m in messages] + seen
+
+    assert seen == [message_key(i) for i in range(5)]
+
+
+def test_get_messages_between_last_page_has_no_cursor():
+    chat = make_chat(3)
+
+    messages, next_cursor = chat.get_messages_between(
+        USER_UUID, OTHER_UUID, 2, message_key(2)
+    )
+
+    assert [m["id"] for m in messages] == [message_key(0), message_key(1)]
+    assert next_cursor is None
+
+
+def test_get_messages_between_empty_chat():
+    chat = make_chat_service()
+
+    assert chat.get_messages_between(USER_UUID, OTHER_UUID, 10) == ([], None)
+
+
+def test_get_chat_route_is_paginated(test_app, monkeypatch):
+    monkeypatch.setattr(me_router, "chat_service", make_chat(3))
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(USER_UUID))
+    header = {"x-access-token": "tokenrefalso"}
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/me/chats/{OTHER_UUID}", params={"limit": 2}, headers=header
+    )
+
+    assert response.status_code == HTTP_200_OK
+    response_json = response.json()
+    assert response_json["amount"] == 2
+    assert response_json["next_cursor"] == message_key(1)
+    assert response_json["messages"][0]["message"] == "message 1"
+
+
+def test_chat_tail_covers_cursors_from_its_floor():
+    tail = ChatTail(size=3, floor=message_key(2), synced_at=0)
+
+    assert tail.covers(message_key(2))
+    assert tail.covers(message_key(5))
+    assert not tail.covers(message_key(1))
+    assert not tail.covers(None)
+    assert ChatTail(size=3, floor=None, synced_at=0).covers(None)
+
+
+def test_chat_tail_drops_the_oldest_messages_and_raises_its_floor():
+    tail = ChatTail(size=3, floor=None, synced_at=0)
+
+    tail.add({message_key(i): make_message(i) for i in range(5)}, synced_at=1)
+
+    assert sorted(tail.messages) == [message_key(2), message_key(3), message_key(4)]
+    assert tail.floor == message_key(1)
+    assert not tail.covers(message_key(0))
+    assert tail.covers(message_key(1))
+
+
+def test_chat_tail_synced_key_only_follows_firebase():
+    tail = ChatTail(size=10, floor=None, synced_at=0)
+    tail.add({message_key(1): make_message(1)}, synced_at=1)
+
+    # sent through this instance, newer messages of others may be missing
+    tail.add({message_key(2): make_message(2)})
+    assert tail.synced_key == message_key(1)
+    assert tail.synced_at == 1
+
+    tail.add({message_key(3): make_message(3)}, synced_at=2)
+    assert tail.synced_key == message_key(3)
+
+
+def test_chat_tail_since_is_ordered_and_limited():
+    tail = ChatTail(size=10, floor=None, synced_at=0)
+    tail.add({message_key(i): make_message(i) for i in (3, 1, 2, 0)}, synced_at=1)
+
+    assert [key for key, _ in tail.since(message_key(0), 2)] == [
+        message_key(1),
+        message_key(2),
+    ]
+    assert [key for key, _ in tail.since(None, 10)] == [
+        message_key(i) for i in range(4)
+    ]
+
+
+def test_get_messages_since_is_answered_from_the_tail(monkeypatch):
+    monkeypatch.setattr(chat_module, "CHAT_TAIL_REFRESH_INTERVAL", 1000)
+    chat = make_chat(3)
+
+    messages, cursor, _ = chat.get_messages_since(USER_UUID, OTHER_UUID, None, 10)
+    assert [m["id"] for m in messages] == [message_key(i) for i in range(3)]
+    assert cursor == message_key(2)
+
+    reads = len(chat.db_root.reads)
+    chat.send_message(
+        "hi", {"name": "a", "uuid": USER_UUID}, {"name": "b", "uuid": OTHER_UUID}
+    )
+    messages, cursor, _ = chat.get_messages_since(USER_UUID, OTHER_UUID, cursor, 10)
+
+    assert [m["message"] for m in messages] == ["hi"]
+    assert cursor == messages[0]["id"]
+    assert len(chat.db_root.reads) == reads
+
+
+def test_get_messages_since_syncs_a_stale_tail(monkeypatch):
+    monkeypatch.setattr(chat_module, "CHAT_TAIL_REFRESH_INTERVAL", 1000)
+    chat = make_chat(3)
+    _, cursor, _ = chat.get_messages_since(USER_UUID, OTHER_UUID, None, 10)
+
+    # sent through another instance
+    chat.db_messages.child(CHAT_NAME).child(message_key(3)).set(make_message(3))
+    messages, _, _ = chat.get_messages_since(USER_UUID, OTHER_UUID, cursor, 10)
+    assert messages == []
+
+    monkeypatch.setattr(chat_module, "CHAT_TAIL_REFRESH_INTERVAL", 0)
+    messages, cursor, _ = chat.get_messages_since(USER_UUID, OTHER_UUID, cursor, 10)
+    assert [m["id"] for m in messages] == [message_key(3)]
+    assert cursor == message_key(3)
+
+
+def test_get_messages_since_far_behind_is_not_cached(monkeypatch):
+    monkeypatch.setattr(chat_module, "CHAT_TAIL_SIZE", 3)
+    chat = make_chat(10)
+
+    messages, cursor, has_more = chat.get_messages_since(
+        USER_UUID, OTHER_UUID, message_key(0), 10
+    )
+
+    assert [m["id"] for m in messages] == [message_key(i) for i in range(1, 5)]
+    assert cursor == message_key(4)
+    assert has_more
+    assert chat.tails.get(CHAT_NAME) is None
+
+
+def test_get_messages_since_reports_more_until_caught_up(monkeypatch):
+    monkeypatch.setattr(chat_module, "CHAT_TAIL_SIZE", 3)
+    chat = make_chat(10)
+
+    seen = []
+    cursor, has_more = message_key(0), True
+    while has_more:
+        messages, cursor, has_more = chat.get_messages_since(
+            USER_UUID, OTHER_UUID, cursor, 2
+        )
+        seen.extend(m["id"] for m in messages)
+
+    assert seen == [message_key(i) for i in range(1, 10)]
+
+
+def test_needs_sync_follows_the_last_firebase_sync():
+    chat = make_chat(3)
+    assert chat.needs_sync(USER_UUID, OTHER_UUID, 60)
+
+    chat.get_messages_since(USER_UUID, OTHER_UUID, None, 10)
+    assert not chat.needs_sync(USER_UUID, OTHER_UUID, 60)
+    assert chat.needs_sync(USER_UUID, OTHER_UUID, -1)
+
+
+def test_get_chat_updates_route(test_app, monkeypatch):
+    monkeypatch.setattr(me_router, "chat_service", make_chat(3))
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(USER_UUID))
+    header = {"x-access-token": "tokenrefalso"}
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/me/chats/{OTHER_UUID}/updates",
+        params={"since": message_key(0)},
+        headers=header,
+    )
+
+    assert response.status_code == HTTP_200_OK
+    response_json = response.json()
+    assert [m["id"] for m in response_json["messages"]] == [
+        message_key(1),
+        message_key(2),
+    ]
+    assert response_json["cursor"] == message_key(2)
+    assert not response_json["has_more"]
+
+
+def test_chat_stream_sends_the_whole_backlog_before_live_messages(monkeypatch):
+    chat = make_chat(300)
+    monkeypatch.setattr(me_router, "chat_service", chat)
+
+    async def read_stream():
+        events = me_router._chat_events(USER_UUID, OTHER_UUID, message_key(0))
+        ids = []
+        try:
+            while len(ids) < 299:
+                ids.append(event_id(await events.__anext__()))
+
+            # the stream is live once the backlog is sent
+            sent = chat.send_message(
+                "hi",
+                {"name": "a", "uuid": USER_UUID},
+                {"name": "b", "uuid": OTHER_UUID},
+            )
+            ids.append(event_id(await events.__anext__()))
+        finally:
+            await events.aclose()
+
+        return ids, sent["id"]
+
+    ids, sent_id = run(read_stream())
+
+    assert ids == [message_key(i) for i in range(1, 300)] + [sent_id]
+
+
+def event_id(event):
+    return event.split("\n")[0][len("id: "):]
+
+
+def make_inbox_chat(previews):
+    """previews: other uuid -> (timestamp, unread) of the chats of USER_UUID"""
+    chats = {}
+    for other_uuid, (timestamp, unread) in previews.items():
+        last_message = make_message(0, other_uuid, USER_UUID)
+        last_message["timestamp"] = timestamp
+        chats[f"-{other_uuid}"] = {
+            "timestamp": timestamp,
+            "last_message": last_message,
+            "unread": unread,
+        }
+
+    return make_chat_service({"chats": {f"-{USER_UUID}": chats}})
+
+
+def test_inbox_is_sorted_by_the_most_recent_chat():
+    chat = make_inbox_chat({2: (100, 0), 3: (300, 1), 4: (200, 0), 5: (300, 2)})
+
+    previews, next_cursor = chat.get_all_chats_from(USER_UUID, 10)
+
+    assert [p["other_uuid"] for p in previews] == [5, 3, 4, 2]
+    assert [p["unread"] for p in previews] == [2, 1, 0, 0]
+    assert next_cursor is None
+
+
+def test_inbox_pages_with_ties_on_the_timestamp():
+    chat = make_inbox_chat({2: (100, 0), 3: (300, 1), 4: (200, 0), 5: (300, 2)})
+
+    previews, cursor = chat.get_all_chats_from(USER_UUID, 1)
+    assert [p["other_uuid"] for p in previews] == [5]
+    assert cursor == "300_5"
+
+    seen = [5]
+    while cursor is not None:
+        previews, cursor = chat.get_all_chats_from(USER_UUID, 1, cursor)
+        seen.extend(p["other_uuid"] for p in previews)
+
+    assert seen == [5, 3, 4, 2]
+
+
+def test_inbox_follows_the_messages_sent():
+    chat = make_inbox_chat({2: (100, 0), 3: (300, 0)})
+    chat.get_all_chats_from(USER_UUID, 10)
+
+    chat.send_message("hi", {"name": "b", "uuid": 2}, {"name": "a", "uuid": USER_UUID})
+    previews, _ = chat.get_all_chats_from(USER_UUID, 10)
+
+    assert previews[0]["other_uuid"] == 2
+    assert previews[0]["last_message"] == "hi"
+    assert previews[0]["unread"] == 1
+    assert chat.db_chats.child(f"-{USER_UUID}/-2/unread").get() == 1
+
+
+def test_mark_as_read_resets_the_unread_count():
+    chat = make_inbox_chat({2: (100, 4)})
+
+    preview = chat.mark_as_read(USER_UUID, 2)
+
+    assert preview["unread"] == 0
+    assert chat.get_all_chats_from(USER_UUID, 10)[0][0]["unread"] == 0
+    assert chat.db_chats.child(f"-{USER_UUID}/-2/unread").get() == 0
+    assert chat.mark_as_read(USER_UUID, 9) is None
+
+
+def test_get_all_chats_route(test_app, monkeypatch):
+    chat = make_inbox_chat({2: (100, 0), 3: (300, 1)})
+    monkeypatch.setattr(me_router, "chat_service", chat)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(USER_UUID))
+    header = {"x-access-token": "tokenrefalso"}
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/me/chats", params={"limit": 1}, headers=header
+    )
+
+    assert response.status_code == HTTP_200_OK
+    response_json = response.json()
+    assert response_json["amount"] == 1
+    assert response_json["chats"][0]["other_uuid"] == 3
+    assert response_json["next_cursor"] == "300_3"
+
+
+def test_mark_chat_as_read_route(test_app, monkeypatch):
+    chat = make_inbox_chat({2: (100, 3)})
+    monkeypatch.setattr(me_router, "chat_service", chat)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(USER_UUID))
+    header = {"x-access-token": "tokenrefalso"}
+
+    response = test_app.post(f"{APPSERVER_URL}/me/chats/2/read", headers=header)
+    assert response.status_code == HTTP_200_OK
+    assert response.json()["unread"] == 0
+
+    response = test_app.post(f"{APPSERVER_URL}/me/chats/9/read", headers=header)
+    assert response.status_code == HTTP_404_NOT_FOUND
+
+
+def test_push_ids_sort_by_time():
+    keys = [generate_push_id(now) for now in (1000, 999999, 1600000000000)]
+
+    assert keys == sorted(keys)
+    assert all(len(key) == 20 for key in keys)
+    assert generate_push_id(0).startswith("--------")
+
+
+def test_push_ids_of_the_same_millisecond_stay_ordered():
+    keys = [generate_push_id(1600000000000) for _ in range(100)]
+
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    assert all(key[:8] == keys[0][:8] for key in keys)
+
+
+def test_send_message_is_a_single_write(monkeypatch):
+    chat = make_chat_service()
+    writes = []
+    update = chat.db_root.update
+    monkeypatch.setattr(chat.db_root, "update", lambda values: writes.append(values))
+
+    message = chat.send_message(
+        "hi", {"name": "a", "uuid": USER_UUID}, {"name": "b", "uuid": OTHER_UUID}
+    )
+
+    assert len(writes) == 1
+    update(writes[0])
+    stored = chat.db_messages.child(f"{CHAT_NAME}/{message['id']}").get()
+    assert stored["message"] == "hi"
+    for user_chat in (f"-{USER_UUID}/-{OTHER_UUID}", f"-{OTHER_UUID}/-{USER_UUID}"):
+        assert chat.db_chats.child(user_chat).get()["last_message"] == stored
+    assert chat.db_chats.child(f"-{USER_UUID}/-{OTHER_UUID}/unread").get() == 0
+    assert chat.db_chats.child(f"-{OTHER_UUID}/-{USER_UUID}/unread").get() == 1
+
+
+@responses.activate
+def test_send_message_route(test_app, monkeypatch):
+    chat = make_chat_service()
+    monkeypatch.setattr(me_router, "chat_service", chat)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(USER_UUID))
+    header = {"x-access-token": "tokenrefalso"}
+    responses.add(
+        responses.GET,
+        re.compile(USER_REGEX),
+        json=MockUserResponse().dict(),
+        status=HTTP_200_OK,
+    )
+
+    response = test_app.post(
+        f"{APPSERVER_URL}/me/chats/{OTHER_UUID}",
+        json={"message": "hi"},
+        headers=header,
+    )
+
+    assert response.status_code == HTTP_201_CREATED
+    message_id = response.json()["id"]
+    assert chat.db_messages.child(f"{CHAT_NAME}/{message_id}").get()["message"] == "hi"
+    assert notifier.queued[0]["uuid"] == OTHER_UUID
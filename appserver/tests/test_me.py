@@ -12,7 +12,7 @@ from tests.mock_models.user_models import (MockPaymentWalletResponse,
 from tests.utils import (APPSERVER_ME_REGEX, APPSERVER_URL,
                          APPSERVER_WALLET_REGEX, PAYMENT_BOOKING_REGEX,
                          PAYMENT_WALLET_REGEX, POSTSERVER_ROOM_REGEX,
-                         USER_REGEX, FAVORITE_ROOM_REGEX,
+                         USER_REGEX, FAVORITE_ROOM_REGEX, async_return,
                          check_responses_equality)
 
 
@@ -52,8 +52,8 @@ def test_get_self_user(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     responses.add(
         responses.GET,
         re.compile(USER_REGEX),
@@ -81,8 +81,8 @@ def test_get_self_user_wallet(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     responses.add(
         responses.GET,
         re.compile(PAYMENT_WALLET_REGEX),
@@ -119,8 +119,8 @@ def test_get_self_user_bookings(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -196,8 +196,8 @@ def test_get_self_user_rooms(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -224,6 +224,33 @@ def test_get_self_user_rooms(test_app, monkeypatch):
         check_responses_equality(room, test_rooms[i], attrs_to_test)
 
 
+@responses.activate
+def test_get_self_user_rooms_paginated(test_app, monkeypatch):
+    test_room_list = MockRoomListResponse().dict()
+    header = {"x-access-token": "tokenrefalso"}
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_list,
+        status=HTTP_200_OK,
+    )
+
+    first = test_app.get(f"{APPSERVER_URL}/me/rooms?limit=1", headers=header).json()
+    second = test_app.get(
+        f"{APPSERVER_URL}/me/rooms?limit=1&cursor={first['next_cursor']}",
+        headers=header,
+    ).json()
+
+    assert first["amount"] == second["amount"] == len(test_room_list["rooms"])
+    assert second["rooms"][0]["id"] == test_room_list["rooms"][1]["id"]
+    assert second["next_cursor"] is None
+    # the appserver cursor is not sent to the post server
+    assert all("cursor" not in call.request.url for call in responses.calls)
+
+
 @responses.activate
 def test_create_self_favorite_room(test_app, monkeypatch):
     # POST {appserver_url}/me/favorite_rooms
@@ -248,9 +275,9 @@ def test_create_self_favorite_room(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -294,8 +321,8 @@ def test_get_self_favorite_rooms(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
@@ -348,9 +375,9 @@ def test_delete_self_favorite_rooms(test_app, monkeypatch):
     header = {"x-access-token": "tokenrefalso"}
     test_user_id = 1
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.GET,
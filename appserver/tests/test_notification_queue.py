@@ -0,0 +1,184 @@
+import asyncio
+import threading
+
+from app.services.notification_queue import NotificationQueue
+from tests.utils import run
+
+
+class HeldDelivery:
+    """Records the delivered batches, the first one waits for release"""
+
+    def __init__(self, results=None):
+        self.batches = []
+        self.results = results
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, batch):
+        self.started.set()
+        self.release.wait(1)
+        self.batches.append(list(batch))
+        if self.results is not None:
+            return self.results
+        return [True] * len(batch)
+
+
+async def hold_first_notification(queue, delivery):
+    """Starts the queue and puts one notification the worker is left holding"""
+    queue.start()
+    await queue.put("first")
+    while not delivery.started.is_set():
+        await asyncio.sleep(0.001)
+
+
+def test_drop_oldest_discards_the_oldest_pending_notification():
+    delivery = HeldDelivery()
+    queue = NotificationQueue(
+        delivery, capacity=2, workers=1, overflow_policy=NotificationQueue.DROP_OLDEST
+    )
+
+    async def overflow():
+        await hold_first_notification(queue, delivery)
+        for notification in ("second", "third", "fourth"):
+            await queue.put(notification)
+        delivery.release.set()
+        await queue.drain(timeout=1)
+
+    run(overflow())
+
+    assert delivery.batches == [["first"], ["third"], ["fourth"]]
+    assert queue.stats()["dropped"] == 1
+    # the dropped one had been enqueued
+    assert queue.stats()["enqueued"] == 4
+    assert queue.stats()["delivered"] == 3
+
+
+def test_drop_newest_discards_the_new_notification():
+    delivery = HeldDelivery()
+    queue = NotificationQueue(
+        delivery, capacity=2, workers=1, overflow_policy=NotificationQueue.DROP_NEWEST
+    )
+
+    async def overflow():
+        await hold_first_notification(queue, delivery)
+        for notification in ("second", "third", "fourth"):
+            await queue.put(notification)
+        delivery.release.set()
+        await queue.drain(timeout=1)
+
+    run(overflow())
+
+    assert delivery.batches == [["first"], ["second"], ["third"]]
+    assert queue.stats()["dropped"] == 1
+    assert queue.stats()["enqueued"] == 3
+
+
+def test_block_drops_the_notification_after_put_timeout():
+    delivery = HeldDelivery()
+    queue = NotificationQueue(
+        delivery,
+        capacity=1,
+        workers=1,
+        overflow_policy=NotificationQueue.BLOCK,
+        put_timeout=0.01,
+    )
+
+    async def overflow():
+        await hold_first_notification(queue, delivery)
+        await queue.put("second")
+        await queue.put("third")
+        delivery.release.set()
+        await queue.drain(timeout=1)
+
+    run(overflow())
+
+    assert delivery.batches == [["first"], ["second"]]
+    assert queue.stats()["dropped"] == 1
+
+
+def test_block_waits_for_a_free_slot():
+    delivery = HeldDelivery()
+    queue = NotificationQueue(
+        delivery,
+        capacity=1,
+        workers=1,
+        overflow_policy=NotificationQueue.BLOCK,
+        put_timeout=1,
+    )
+
+    async def overflow():
+        await hold_first_notification(queue, delivery)
+        await queue.put("second")
+        blocked = asyncio.ensure_future(queue.put("third"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        delivery.release.set()
+        await blocked
+        await queue.drain(timeout=1)
+
+    run(overflow())
+
+    assert delivery.batches == [["first"], ["second"], ["third"]]
+    assert queue.stats()["dropped"] == 0
+
+
+def test_notifications_are_sent_in_batches():
+    delivery = HeldDelivery()
+    delivery.release.set()
+    queue = NotificationQueue(delivery, workers=1, batch_size=3, flush_interval=0.01)
+
+    async def send():
+        queue.start()
+        for notification in ("a", "b", "c", "d"):
+            await queue.put(notification)
+        await queue.drain(timeout=1)
+
+    run(send())
+
+    # the last batch is flushed after flush_interval without filling up
+    assert delivery.batches == [["a", "b", "c"], ["d"]]
+    assert queue.stats()["batches"] == 2
+    assert queue.stats()["delivered"] == 4
+
+
+def test_failed_deliveries_are_counted():
+    delivery = HeldDelivery(results=[True, False])
+    delivery.release.set()
+    queue = NotificationQueue(delivery, workers=1, batch_size=2)
+
+    def broken_delivery(batch):
+        raise ConnectionError("fcm is down")
+
+    async def send(queue):
+        queue.start()
+        for notification in ("a", "b"):
+            await queue.put(notification)
+        await queue.drain(timeout=1)
+
+    run(send(queue))
+    broken_queue = NotificationQueue(broken_delivery, workers=1)
+    run(send(broken_queue))
+
+    assert queue.stats()["delivered"] == 1
+    assert queue.stats()["failed"] == 1
+    assert broken_queue.stats()["failed"] == 2
+
+
+def test_drain_delivers_the_pending_notifications_and_stops():
+    delivery = HeldDelivery()
+    queue = NotificationQueue(delivery, workers=1)
+
+    async def shut_down():
+        await hold_first_notification(queue, delivery)
+        await queue.put("second")
+        delivery.release.set()
+        await queue.drain(timeout=1)
+        # after shutting down they are delivered right away
+        await queue.put("late")
+
+    run(shut_down())
+
+    assert delivery.batches == [["first"], ["second"], ["late"]]
+    assert not queue.running
+    assert queue.stats()["size"] == 0
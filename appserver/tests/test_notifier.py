@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.notifier import Notifier
+from app.utils.cache import TTLCache
+from firebase_admin import exceptions, messaging
+
+
+class FakeChild:
+    def __init__(self, parent, key):
+        self.parent = parent
+        self.key = key
+
+    def get(self):
+        self.parent.reads.append(self.key)
+        return self.parent.values.get(self.key)
+
+    def delete(self):
+        self.parent.values.pop(self.key, None)
+
+
+class FakeReference:
+    """Push token store, records the keys read"""
+
+    def __init__(self, values):
+        self.values = values
+        self.reads = []
+
+    def child(self, key):
+        return FakeChild(self, key)
+
+
+def make_notifier(tokens):
+    notifier = Notifier.__new__(Notifier)
+    notifier.app = None
+    notifier.db_tokens = FakeReference(tokens)
+    notifier.token_cache = TTLCache(max_entries=100, ttl=60)
+    notifier.token_fetcher = ThreadPoolExecutor(max_workers=2)
+    return notifier
+
+
+def test_prefetch_push_tokens_with_mixed_width_uuids():
+    notifier = make_notifier({"9": "token-9", "10": "token-10", "100": "token-100"})
+
+    tokens = notifier.prefetch_push_tokens([9, 10, 100, 55])
+
+    assert tokens == {
+        "9": "token-9",
+        "10": "token-10",
+        "100": "token-100",
+        "55": None,
+    }
+    assert sorted(notifier.db_tokens.reads) == ["10", "100", "55", "9"]
+
+
+def test_prefetch_push_tokens_reads_only_the_missing_ones():
+    notifier = make_notifier({"9": "token-9", "10": "token-10"})
+    notifier.prefetch_push_tokens([9])
+
+    tokens = notifier.prefetch_push_tokens([9, 10])
+
+    assert tokens == {"9": "token-9", "10": "token-10"}
+    assert sorted(notifier.db_tokens.reads) == ["10", "9"]
+
+
+def fake_send_all(outcomes, sent):
+    """
+    send_all answering each message with the error outcomes has for its
+    token (None for a delivered one), the sent tokens are recorded
+    """
+
+    def send_all(messages, app=None):
+        responses = []
+        for message in messages:
+            sent.append(message.token)
+            error = outcomes.get(message.token)
+            if error is None:
+                responses.append(messaging.SendResponse({"name": "msg"}, None))
+            else:
+                responses.append(messaging.SendResponse(None, error))
+        return messaging.BatchResponse(responses)
+
+    return send_all
+
+
+def notification(uuid):
+    return {"title": "Nuevo mensaje", "body": "Hola", "uuid": uuid}
+
+
+def test_deliver_maps_the_batch_results_to_each_notification(monkeypatch):
+    notifier = make_notifier({"1": "token-1", "3": "token-3", "4": "token-4"})
+    sent = []
+    outcomes = {"token-3": exceptions.UnavailableError("try later")}
+    monkeypatch.setattr(messaging, "send_all", fake_send_all(outcomes, sent))
+
+    results = notifier._deliver([notification(uuid) for uuid in (1, 2, 3, 4)])
+
+    # 2 has no device, nothing is sent to it
+    assert results == [True, False, False, True]
+    assert sent == ["token-1", "token-3", "token-4"]
+    # a failure that is not about the token keeps it
+    assert notifier.db_tokens.values["3"] == "token-3"
+
+
+def test_deliver_prunes_unregistered_tokens(monkeypatch):
+    notifier = make_notifier(
+        {"5": "token-5", "6": "token-6", "7": "token-7", "8": "token-8"}
+    )
+    outcomes = {
+        "token-5": messaging.UnregisteredError("unregistered"),
+        "token-6": messaging.SenderIdMismatchError("sender id mismatch"),
+    }
+    monkeypatch.setattr(messaging, "send_all", fake_send_all(outcomes, []))
+
+    results = notifier._deliver([notification(uuid) for uuid in (5, 6, 7)])
+
+    assert results == [False, False, True]
+    assert notifier.db_tokens.values == {"7": "token-7", "8": "token-8"}
+    assert notifier.get_push_token(5) is None
+    assert notifier.get_push_token(6) is None
+
+
+def test_deliver_keeps_a_token_registered_after_the_failed_one(monkeypatch):
+    notifier = make_notifier({"9": "token-9"})
+    notifier.prefetch_push_tokens([9])
+    # a new device registered through another instance
+    notifier.db_tokens.values["9"] = "new-token-9"
+    outcomes = {"token-9": messaging.UnregisteredError("unregistered")}
+    monkeypatch.setattr(messaging, "send_all", fake_send_all(outcomes, []))
+
+    assert notifier._deliver([notification(9)]) == [False]
+    assert notifier.db_tokens.values == {"9": "new-token-9"}
+    # the next notifications go to the new device
+    assert notifier.get_push_token(9) == "new-token-9"
+
+
+def test_deliver_fails_every_notification_when_the_batch_fails(monkeypatch):
+    notifier = make_notifier({"1": "token-1", "2": "token-2"})
+
+    def send_all(messages, app=None):
+        raise exceptions.UnavailableError("fcm is down")
+
+    monkeypatch.setattr(messaging, "send_all", send_all)
+
+    assert notifier._deliver([notification(1), notification(2)]) == [False, False]
+    assert notifier.db_tokens.values == {"1": "token-1", "2": "token-2"}
@@ -1,17 +1,34 @@
+import hashlib
+import io
+import json
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+import pytest
 import responses
+from app.api.crud.room_photo_dao import RoomPhotoDAO
+from app.api.routes import room_router
+from app.db import get_db
+from app.errors.http_error import BadRequestError, PayloadTooLargeError
+from app.main import app
+from app.services import photouploader as photouploader_module
 from app.services.authsender import AuthSender
-from app.services.photouploader import photouploader
+from app.services.photouploader import PhotoUploader, UploadStats, photouploader
+from app.utils import image_utils
+from app.utils.image_utils import (ID_EPOCH, SEQUENCE_BITS, IdGenerator, Image,
+                                   create_variants)
+from fastapi import UploadFile
 from firebase_admin import storage
-from starlette.status import HTTP_200_OK, HTTP_201_CREATED
+from starlette.status import (HTTP_200_OK, HTTP_201_CREATED,
+                              HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 from tests.mock_models.photo_upload_models import (MockFirebaseBucketResponse,
                                                    MockRoomPhotoList,
                                                    MockRoomPhotoUploadResponse)
 from tests.mock_models.room_models import MockRoomResponse
 from tests.mock_models.user_models import MockUserResponse
 from tests.utils import (APPSERVER_URL, POSTSERVER_ROOM_REGEX, USER_REGEX,
-                         check_responses_equality)
+                         async_return, check_responses_equality, run)
 
 
 def upload_photo(test_app, test_room_id, header):
@@ -41,11 +58,11 @@ def test_change_profile_picture(test_app, monkeypatch):
 
     expected_image_url = test_user["photo"]
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     monkeypatch.setattr(
-        photouploader, "upload_profile_photo", lambda x, y: expected_image_url
+        photouploader, "upload_profile_photo", async_return(expected_image_url)
     )
 
     responses.add(
@@ -81,18 +98,18 @@ def test_upload_room_photo(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    expected_upload_service_response = (
-        test_room_photo["url"],
-        test_room_photo["firebase_id"],
-    )
+    expected_upload_service_response = {
+        "url": test_room_photo["url"],
+        "firebase_id": test_room_photo["firebase_id"],
+    }
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     monkeypatch.setattr(
         photouploader,
         "upload_room_photo",
-        lambda x, y: expected_upload_service_response,
+        async_return(expected_upload_service_response),
     )
 
     responses.add(
@@ -116,6 +133,153 @@ def test_upload_room_photo(test_app, monkeypatch):
     check_responses_equality(response_json, test_room_photo, attrs_to_test)
 
 
+@responses.activate
+def test_upload_room_photo_returns_variants(test_app, monkeypatch):
+    test_room_photo = MockRoomPhotoUploadResponse().dict()
+    test_room = MockRoomResponse().dict()
+    test_room_id = test_room_photo["room_id"]
+    test_files = {"file": ("test_image.png", b"laimageeennnrefake")}
+    header = {"x-access-token": "tokenrefalso"}
+
+    uploaded_photo = {
+        "url": test_room_photo["url"],
+        "thumbnail_url": f"{test_room_photo['url']}_thumbnail",
+        "medium_url": f"{test_room_photo['url']}_medium",
+        "firebase_id": test_room_photo["firebase_id"],
+    }
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    monkeypatch.setattr(
+        photouploader, "upload_room_photo", async_return(uploaded_photo)
+    )
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.POST,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_photo,
+        status=HTTP_201_CREATED,
+    )
+    response = test_app.post(
+        f"{APPSERVER_URL}/rooms/{test_room_id}/photos", files=test_files, headers=header
+    )
+
+    assert response.status_code == HTTP_201_CREATED
+    check_responses_equality(
+        response.json(), uploaded_photo, ["url", "thumbnail_url", "medium_url"]
+    )
+
+
+@responses.activate
+def test_upload_room_photos_batch(test_app, monkeypatch):
+    test_room_photo = MockRoomPhotoUploadResponse().dict()
+    test_room = MockRoomResponse().dict()
+    test_room_id = test_room_photo["room_id"]
+    test_files = [
+        ("files", ("first.png", b"laimageeennnrefake")),
+        ("files", ("broken.png", b"notanimage")),
+        ("files", ("second.png", b"otraimagenfake")),
+    ]
+    header = {"x-access-token": "tokenrefalso"}
+
+    async def upload_room_photo(file, room_id, find_duplicate=None):
+        if file.filename == "broken.png":
+            raise BadRequestError("The uploaded file is not a valid image")
+        return {"url": test_room_photo["url"], "firebase_id": 0}
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    monkeypatch.setattr(photouploader, "upload_room_photo", upload_room_photo)
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.POST,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_photo,
+        status=HTTP_201_CREATED,
+    )
+    response = test_app.post(
+        f"{APPSERVER_URL}/rooms/{test_room_id}/photos/batch",
+        files=test_files,
+        headers=header,
+    )
+    results = response.json()["results"]
+
+    assert response.status_code == HTTP_201_CREATED
+    assert [result["filename"] for result in results] == [
+        "first.png",
+        "broken.png",
+        "second.png",
+    ]
+    assert results[1]["photo"] is None
+    assert results[1]["error"] == "The uploaded file is not a valid image"
+    for result in (results[0], results[2]):
+        check_responses_equality(result["photo"], test_room_photo, ["url", "id"])
+    # the room is fetched once for the whole batch
+    room_gets = [c for c in responses.calls if c.request.method == "GET"]
+    assert len(room_gets) == 1
+
+
+@responses.activate
+def test_upload_room_photos_batch_reports_unexpected_errors(test_app, monkeypatch):
+    test_room_photo = MockRoomPhotoUploadResponse().dict()
+    test_room = MockRoomResponse().dict()
+    test_room_id = test_room_photo["room_id"]
+    test_files = [
+        ("files", ("first.png", b"laimageeennnrefake")),
+        ("files", ("unlucky.png", b"otraimagenfake")),
+    ]
+    header = {"x-access-token": "tokenrefalso"}
+
+    async def upload_room_photo(file, room_id, find_duplicate=None):
+        if file.filename == "unlucky.png":
+            raise ConnectionError("storage is down")
+        return {"url": test_room_photo["url"], "firebase_id": 0}
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    monkeypatch.setattr(photouploader, "upload_room_photo", upload_room_photo)
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.POST,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_photo,
+        status=HTTP_201_CREATED,
+    )
+    response = test_app.post(
+        f"{APPSERVER_URL}/rooms/{test_room_id}/photos/batch",
+        files=test_files,
+        headers=header,
+    )
+    first, unlucky = response.json()["results"]
+
+    assert response.status_code == HTTP_201_CREATED
+    check_responses_equality(first["photo"], test_room_photo, ["url", "id"])
+    assert first["error"] is None
+    assert unlucky["photo"] is None
+    assert unlucky["error"] == "The photo could not be stored"
+
+
 @responses.activate
 def test_get_all_room_photos(test_app, monkeypatch):
     mock_room_photos = MockRoomPhotoList().dict()
@@ -148,6 +312,54 @@ def test_get_all_room_photos(test_app, monkeypatch):
         )
 
 
+@responses.activate
+def test_room_photos_include_the_stored_variants(test_app):
+    mock_room_photos = MockRoomPhotoList().dict()
+    test_room_id = mock_room_photos["room_id"]
+    stored_photo, other_photo = mock_room_photos["room_photos"]
+    # ids no other test stores
+    stored_photo["firebase_id"] = 4_000_000_000_001
+    other_photo["firebase_id"] = 4_000_000_000_002
+
+    db = next(app.dependency_overrides[get_db]())
+    RoomPhotoDAO.add_new_room_photo(
+        db,
+        stored_photo["firebase_id"],
+        stored_photo["id"],
+        {
+            "url": stored_photo["url"],
+            "thumbnail_url": "urlpiola_thumbnail",
+            "medium_url": "urlpiola_medium",
+        },
+    )
+    db.close()
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=mock_room_photos,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=stored_photo,
+        status=HTTP_200_OK,
+    )
+
+    room_photos = test_app.get(f"{APPSERVER_URL}/rooms/{test_room_id}/photos").json()
+    room_photo = test_app.get(
+        f"{APPSERVER_URL}/rooms/{test_room_id}/photos/{stored_photo['firebase_id']}"
+    ).json()
+
+    first, second = room_photos["room_photos"]
+    for photo in (first, room_photo):
+        assert photo["thumbnail_url"] == "urlpiola_thumbnail"
+        assert photo["medium_url"] == "urlpiola_medium"
+    assert second["thumbnail_url"] is None
+    assert second["medium_url"] is None
+
+
 @responses.activate
 def test_delete_room_photo(test_app, monkeypatch):
     test_room_photo = MockRoomPhotoUploadResponse().dict()
@@ -165,10 +377,10 @@ def test_delete_room_photo(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
-    monkeypatch.setattr(photouploader, "remove_room_photo", lambda x, y: None)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
+    monkeypatch.setattr(photouploader, "remove_room_photo", async_return(None))
 
     responses.add(
         responses.GET,
@@ -177,15 +389,15 @@ def test_delete_room_photo(test_app, monkeypatch):
         status=expected_status,
     )
 
-    expected_upload_service_response = (
-        test_room_photo["url"],
-        test_room_photo["firebase_id"],
-    )
+    expected_upload_service_response = {
+        "url": test_room_photo["url"],
+        "firebase_id": test_room_photo["firebase_id"],
+    }
 
     monkeypatch.setattr(
         photouploader,
         "upload_room_photo",
-        lambda x, y: expected_upload_service_response,
+        async_return(expected_upload_service_response),
     )
     responses.add(
         responses.POST,
@@ -209,3 +421,285 @@ def test_delete_room_photo(test_app, monkeypatch):
 
     assert room_response.status_code == expected_status
     check_responses_equality(room_response.json(), test_room_photo, attrs_to_test)
+
+
+def make_uploader(monkeypatch):
+    """A PhotoUploader storing to a fake bucket, returns it and the uploaded names"""
+    uploader = PhotoUploader.__new__(PhotoUploader)
+    uploader.app = None
+    uploader.executor = ThreadPoolExecutor(max_workers=2)
+    # variants are rendered in a thread instead of a worker process
+    uploader.resize_executor = ThreadPoolExecutor(max_workers=1)
+    uploader.stats = UploadStats()
+    uploaded = []
+
+    def upload_blob(_bucket, _content, _size, _content_type, filename, **_kwargs):
+        uploaded.append(filename)
+        return f"https://storage.test/{filename}"
+
+    monkeypatch.setattr(storage, "bucket", lambda app=None: None)
+    monkeypatch.setattr(uploader, "_upload_blob", upload_blob)
+    return uploader, uploaded
+
+
+def make_upload_file(data, filename="test_image.png"):
+    file = UploadFile(filename, content_type="image/png")
+    run(file.write(data))
+    run(file.seek(0))
+    return file
+
+
+def test_copy_limited_copies_in_chunks_and_hashes(monkeypatch):
+    monkeypatch.setattr(photouploader_module, "PHOTO_CHUNK_SIZE", 100)
+    data = bytes(range(256)) * 4
+
+    with tempfile.TemporaryFile() as content:
+        size, content_hash = run(
+            PhotoUploader._copy_limited(make_upload_file(data), content)
+        )
+        assert content.read() == data
+
+    assert size == len(data)
+    assert content_hash == hashlib.sha256(data).hexdigest()
+
+
+def test_copy_limited_rejects_files_over_the_limit(monkeypatch):
+    monkeypatch.setattr(photouploader_module, "PHOTO_CHUNK_SIZE", 100)
+    monkeypatch.setattr(photouploader_module, "PHOTO_MAX_BYTES", 1000)
+
+    with tempfile.TemporaryFile() as content:
+        with pytest.raises(PayloadTooLargeError):
+            run(PhotoUploader._copy_limited(make_upload_file(b"x" * 1001), content))
+
+
+@responses.activate
+def test_upload_room_photo_too_large(test_app, monkeypatch):
+    test_room = MockRoomResponse().dict()
+    header = {"x-access-token": "tokenrefalso"}
+    uploader, uploaded = make_uploader(monkeypatch)
+
+    monkeypatch.setattr(photouploader_module, "PHOTO_MAX_BYTES", 1000)
+    monkeypatch.setattr(room_router, "photouploader", uploader)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+
+    response = test_app.post(
+        f"{APPSERVER_URL}/rooms/{test_room['id']}/photos",
+        files={"file": ("test_image.png", b"x" * 1001)},
+        headers=header,
+    )
+
+    assert response.status_code == HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert uploaded == []
+
+
+def test_stats_exposes_the_photo_uploads(test_app):
+    response = test_app.get(f"{APPSERVER_URL}/stats")
+
+    assert response.status_code == HTTP_200_OK
+    assert response.json()["photo_uploads"]["uploads"] == 0
+
+
+def make_image(size, color=(200, 30, 30), image_format="PNG"):
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, image_format)
+    return output.getvalue()
+
+
+def test_create_variants_scales_down_the_longest_side():
+    variants = create_variants(
+        make_image((2000, 1000)), {"thumbnail": 240, "medium": 1024}
+    )
+
+    sizes = {}
+    for name, data in variants.items():
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.format == "JPEG"
+            sizes[name] = image.size
+
+    assert sizes == {"thumbnail": (240, 120), "medium": (1024, 512)}
+
+
+def test_create_variants_rejects_data_that_is_not_an_image():
+    with pytest.raises(ValueError):
+        create_variants(b"laimageeennnrefake", {"thumbnail": 240})
+
+
+def test_create_variants_rejects_images_with_too_many_pixels(monkeypatch):
+    # over the limit, pillow only warns about it
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 6000)
+    with pytest.raises(ValueError):
+        create_variants(make_image((100, 100)), {"thumbnail": 240})
+
+    # over twice the limit, pillow refuses to open it
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(ValueError):
+        create_variants(make_image((100, 100)), {"thumbnail": 240})
+
+
+def test_upload_room_photo_with_too_many_pixels(monkeypatch):
+    uploader, uploaded = make_uploader(monkeypatch)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+
+    with pytest.raises(BadRequestError):
+        run(uploader.upload_room_photo(make_upload_file(make_image((100, 100))), 3))
+
+    assert uploaded == []
+
+
+def test_profile_photos_are_stored_without_variants(monkeypatch):
+    uploader, uploaded = make_uploader(monkeypatch)
+
+    url = run(uploader.upload_profile_photo(make_upload_file(make_image((50, 50))), 7))
+
+    assert uploaded == ["users/7/profile.png"]
+    assert url == "https://storage.test/users/7/profile.png"
+
+
+@responses.activate
+def test_upload_same_room_photo_twice_reuses_the_stored_one(test_app, monkeypatch):
+    test_room_photo = MockRoomPhotoUploadResponse().dict()
+    test_room = MockRoomResponse().dict()
+    header = {"x-access-token": "tokenrefalso"}
+    uploader, uploaded = make_uploader(monkeypatch)
+    # a color no other test uploads
+    test_image = make_image((64, 48), color=(12, 34, 56))
+
+    monkeypatch.setattr(room_router, "photouploader", uploader)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.POST,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_photo,
+        status=HTTP_201_CREATED,
+    )
+
+    sent_photos = []
+    for _ in range(2):
+        response = test_app.post(
+            f"{APPSERVER_URL}/rooms/{test_room['id']}/photos",
+            files={"file": ("test_image.png", test_image)},
+            headers=header,
+        )
+        assert response.status_code == HTTP_201_CREATED
+        sent_photos.append(json.loads(responses.calls[-1].request.body))
+
+    first, second = sent_photos
+    assert len(uploaded) == 3  # the original and its two variants, once
+    assert first["url"] == f"https://storage.test/{uploaded[0]}"
+    for url in ("url", "thumbnail_url", "medium_url"):
+        assert second[url] == first[url]
+    assert second["firebase_id"] != first["firebase_id"]
+    assert uploader.stats.serialize()["deduplicated"] == 1
+
+
+class FakeBlob:
+    def __init__(self, name, chunk_size):
+        self.public_url = f"https://storage.test/{name}"
+        self.chunk_size = chunk_size
+        self.uploads = []
+
+    def upload_from_file(self, content, **kwargs):
+        self.uploads.append(kwargs)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.blobs = []
+
+    def blob(self, name, chunk_size=None):
+        blob = FakeBlob(name, chunk_size)
+        self.blobs.append(blob)
+        return blob
+
+
+def test_small_photos_are_uploaded_in_a_single_request():
+    bucket = FakeBucket()
+
+    PhotoUploader._upload_blob(bucket, io.BytesIO(b"thumb"), 5, "image/jpeg", "t")
+
+    blob, = bucket.blobs
+    # no chunk size and a known size make it a multipart upload
+    assert blob.chunk_size is None
+    assert blob.uploads[0]["size"] == 5
+
+
+def test_large_photos_are_uploaded_in_chunks():
+    bucket = FakeBucket()
+    size = photouploader_module.PHOTO_MULTIPART_MAX_BYTES + 1
+
+    PhotoUploader._upload_blob(bucket, io.BytesIO(), size, "image/png", "big")
+
+    blob, = bucket.blobs
+    assert blob.chunk_size == photouploader_module.PHOTO_CHUNK_SIZE
+    assert blob.uploads[0]["size"] == size
+
+
+def set_clock(monkeypatch, second):
+    monkeypatch.setattr(image_utils.time, "time", lambda: ID_EPOCH + second)
+
+
+@pytest.fixture
+def id_generator(monkeypatch):
+    monkeypatch.setattr(IdGenerator, "_last_second", None)
+    monkeypatch.setattr(IdGenerator, "_sequence", 0)
+    monkeypatch.setattr(image_utils.random, "getrandbits", lambda bits: 0)
+    return IdGenerator
+
+
+def test_photo_ids_increase_within_a_second_and_across_seconds(
+    id_generator, monkeypatch
+):
+    set_clock(monkeypatch, 100)
+    same_second = [id_generator.generate() for _ in range(3)]
+    set_clock(monkeypatch, 101)
+    next_second = id_generator.generate()
+
+    ids = same_second + [next_second]
+    assert ids == sorted(set(ids))
+    assert same_second[0] == 100 << SEQUENCE_BITS
+    assert next_second == 101 << SEQUENCE_BITS
+    # safe as JSON numbers
+    assert all(photo_id < 2 ** 53 for photo_id in ids)
+
+
+def test_photo_ids_borrow_the_next_second_when_the_sequence_runs_out(
+    id_generator, monkeypatch
+):
+    set_clock(monkeypatch, 100)
+    monkeypatch.setattr(
+        image_utils.random, "getrandbits", lambda bits: (1 << bits) - 1
+    )
+
+    last = id_generator.generate()
+    rolled_over = id_generator.generate()
+
+    assert last == (100 << SEQUENCE_BITS) | ((1 << SEQUENCE_BITS) - 1)
+    assert rolled_over == 101 << SEQUENCE_BITS
+    assert rolled_over > last
+
+
+def test_photo_ids_keep_increasing_when_the_clock_goes_back(
+    id_generator, monkeypatch
+):
+    set_clock(monkeypatch, 100)
+    before = id_generator.generate()
+    set_clock(monkeypatch, 40)
+    after = id_generator.generate()
+
+    assert after == before + 1
@@ -0,0 +1,113 @@
+import asyncio
+import re
+import socket
+import threading
+
+import pytest
+import responses
+from app.services import connection_pool
+from app.services.connection_pool import (KeepAliveHTTPConnectionPool,
+                                          PoolStats)
+from app.services.requester import Requester
+from fastapi import HTTPException
+from starlette.status import HTTP_200_OK
+from tests.utils import APPSERVER_URL, POSTSERVER_ROOM_REGEX, run
+
+
+def checkout_open_connection(pool):
+    conn = pool._get_conn()
+    local, remote = socket.socketpair()
+    conn.sock = local
+    pool._put_conn(conn)
+    return remote
+
+
+def test_pool_reuses_connections_within_keepalive_expiry(monkeypatch):
+    pool = KeepAliveHTTPConnectionPool("upstream.test", maxsize=1)
+    pool.keepalive_expiry = 30
+    pool.stats = PoolStats()
+    remote = checkout_open_connection(pool)
+
+    now = connection_pool.time.monotonic()
+    monkeypatch.setattr(connection_pool.time, "monotonic", lambda: now + 10)
+    conn = pool._get_conn()
+
+    assert conn.sock is not None
+    assert pool.stats.serialize()["reused_connections"] == 1
+    assert pool.stats.serialize()["expired_connections"] == 0
+    conn.close()
+    remote.close()
+
+
+def test_pool_drops_idle_connections_after_keepalive_expiry(monkeypatch):
+    pool = KeepAliveHTTPConnectionPool("upstream.test", maxsize=1)
+    pool.keepalive_expiry = 30
+    pool.stats = PoolStats()
+    remote = checkout_open_connection(pool)
+
+    now = connection_pool.time.monotonic()
+    monkeypatch.setattr(connection_pool.time, "monotonic", lambda: now + 31)
+    conn = pool._get_conn()
+
+    assert conn.sock is None
+    assert pool.stats.serialize() == {
+        "requests": 2,
+        "new_connections": 2,
+        "reused_connections": 0,
+        "expired_connections": 1,
+        "reuse_ratio": 0.0,
+    }
+    remote.close()
+
+
+@responses.activate
+def test_fetches_run_in_the_threads_of_the_upstream():
+    threads = []
+
+    def record_thread(request):
+        threads.append(threading.current_thread().name)
+        return HTTP_200_OK, {}, "{}"
+
+    responses.add_callback(
+        responses.GET, re.compile(POSTSERVER_ROOM_REGEX), callback=record_thread
+    )
+
+    run(Requester.room_srv_fetch("GET", "/rooms/1", {HTTP_200_OK}))
+
+    assert threads[0].startswith("upstream")
+    executor = Requester._executors[Requester.POST_API_URL]
+    assert executor._max_workers == Requester.POOL_MAX_CONNECTIONS
+
+
+def test_stats_exposes_the_upstream_pools(test_app):
+    response = test_app.get(f"{APPSERVER_URL}/stats")
+
+    assert response.status_code == HTTP_200_OK
+    assert "upstreams" in response.json()
+
+
+def test_fan_out_cancels_the_other_fetches_when_one_fails():
+    cancelled = []
+
+    async def slow_fetch():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def failing_fetch():
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    with pytest.raises(HTTPException):
+        run(Requester.fan_out(slow_fetch(), failing_fetch()))
+
+    assert cancelled == [True]
+
+
+def test_fan_out_returns_the_results_in_order():
+    async def fetch(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    assert run(Requester.fan_out(fetch(1, 0.02), fetch(2, 0))) == [1, 2]
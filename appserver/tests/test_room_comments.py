@@ -8,7 +8,7 @@ from tests.mock_models.room_comments_models import (MockCommentListResponse,
 from tests.mock_models.room_models import MockRoomResponse
 from tests.mock_models.user_models import MockUserResponse
 from tests.utils import (APPSERVER_URL, COMMENT_REGEX, POSTSERVER_ROOM_REGEX,
-                         USER_REGEX, check_responses_equality)
+                         USER_REGEX, async_return, check_responses_equality)
 
 
 @responses.activate
@@ -31,10 +31,10 @@ def test_post_room_comment(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_comment", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_comment["commentator_id"]
+        AuthSender, "get_uuid_from_token", async_return(test_comment["commentator_id"])
     )
     responses.add(
         responses.GET,
@@ -114,10 +114,10 @@ def test_delete_room_comment(test_app, monkeypatch):
     expected_status = HTTP_200_OK
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_comment["commentator_id"]
+        AuthSender, "get_uuid_from_token", async_return(test_comment["commentator_id"])
     )
     responses.add(
         responses.GET,
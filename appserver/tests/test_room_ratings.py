@@ -2,13 +2,14 @@ import re
 
 import responses
 from app.services.authsender import AuthSender
+from app.services.notifier import notifier
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
 from tests.mock_models.room_models import MockRoomResponse
 from tests.mock_models.room_ratings_models import (MockRatingListResponse,
                                                    MockRatingResponse)
 from tests.mock_models.user_models import MockUserResponse
 from tests.utils import (APPSERVER_URL, POSTSERVER_ROOM_REGEX, RATING_REGEX,
-                         USER_REGEX, check_responses_equality)
+                         USER_REGEX, async_return, check_responses_equality)
 
 
 @responses.activate
@@ -20,10 +21,10 @@ def test_post_room_rating(test_app, monkeypatch):
     attrs_to_test = ["rating", "reviewer", "reviewer_id", "room_id", "id"]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_comment", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_rating["reviewer_id"]
+        AuthSender, "get_uuid_from_token", async_return(test_rating["reviewer_id"])
     )
     responses.add(
         responses.GET,
@@ -50,6 +51,7 @@ def test_post_room_rating(test_app, monkeypatch):
     )
     assert response.status_code == expected_status
     check_responses_equality(response.json(), test_rating, attrs_to_test)
+    assert [n["uuid"] for n in notifier.queued] == [test_room["owner_uuid"]]
 
 
 @responses.activate
@@ -111,10 +113,10 @@ def test_delete_room_rating(test_app, monkeypatch):
     expected_status = HTTP_200_OK
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_rating["reviewer_id"]
+        AuthSender, "get_uuid_from_token", async_return(test_rating["reviewer_id"])
     )
     responses.add(
         responses.GET,
@@ -8,7 +8,7 @@ from tests.mock_models.room_reviews_models import (MockReviewListResponse,
                                                    MockReviewResponse)
 from tests.mock_models.user_models import MockUserResponse
 from tests.utils import (APPSERVER_URL, POSTSERVER_ROOM_REGEX, REVIEW_REGEX,
-                         USER_REGEX, check_responses_equality)
+                         USER_REGEX, async_return, check_responses_equality)
 
 
 @responses.activate
@@ -20,10 +20,10 @@ def test_post_room_review(test_app, monkeypatch):
     attrs_to_test = ["review", "reviewer", "reviewer_id", "room_id", "id"]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_comment", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_review["reviewer_id"]
+        AuthSender, "get_uuid_from_token", async_return(test_review["reviewer_id"])
     )
     responses.add(
         responses.GET,
@@ -112,10 +112,10 @@ def test_delete_room_review(test_app, monkeypatch):
     expected_status = HTTP_200_OK
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_review["reviewer_id"]
+        AuthSender, "get_uuid_from_token", async_return(test_review["reviewer_id"])
     )
     responses.add(
         responses.GET,
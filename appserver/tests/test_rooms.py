@@ -1,8 +1,19 @@
+import asyncio
+import json
 import re
+import threading
 
 import responses
 from app.services.authsender import AuthSender
-from starlette.status import HTTP_200_OK, HTTP_201_CREATED
+from app.services.availability import booking_index
+from app.services import room_map
+from app.services.requester import Requester
+from app.services.room_directory import RoomDirectory
+from app.services.room_index import room_index
+from app.services.room_search import RoomSearch
+from app.utils.cache import TTLCache
+from requests.exceptions import RequestException
+from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_404_NOT_FOUND
 from tests.mock_models.room_models import (MockPaymentRoomResponse,
                                            MockRoomListResponse,
                                            MockRoomResponse)
@@ -10,8 +21,8 @@ from tests.mock_models.user_models import (MockUserResponse,
                                            MockFavoriteRoomResponse)
 from tests.utils import (APPSERVER_URL, PAYMENT_ROOM_REGEX,
                          POSTSERVER_ROOM_REGEX, USER_REGEX,
-                         POSTSERVER_RECOMENDED_REGEX,
-                         FAVORITE_ROOM_REGEX, check_responses_equality)
+                         POSTSERVER_RECOMENDED_REGEX, FAVORITE_ROOM_REGEX,
+                         async_return, check_responses_equality, run)
 
 
 @responses.activate
@@ -37,9 +48,9 @@ def test_create_room(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_room["owner_uuid"]
+        AuthSender, "get_uuid_from_token", async_return(test_room["owner_uuid"])
     )
 
     responses.add(
@@ -102,6 +113,400 @@ def test_get_all_rooms(test_app):
         check_responses_equality(room, test_rooms[i], attrs_to_test)
 
 
+@responses.activate
+def test_get_all_rooms_paginated(test_app):
+    test_room_list = MockRoomListResponse().dict()
+    test_rooms = test_room_list["rooms"]
+    expected_status = HTTP_200_OK
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_list,
+        status=expected_status,
+    )
+
+    seen_ids = []
+    cursor = None
+    for _ in test_rooms:
+        params = {"limit": 1}
+        if cursor is not None:
+            params["cursor"] = cursor
+
+        response = test_app.get(f"{APPSERVER_URL}/rooms", params=params)
+        assert response.status_code == expected_status
+        response_json = response.json()
+
+        assert response_json["amount"] == len(test_rooms)
+        assert len(response_json["rooms"]) == 1
+        seen_ids.append(response_json["rooms"][0]["id"])
+        cursor = response_json["next_cursor"]
+
+    assert seen_ids == [room["id"] for room in test_rooms]
+    assert cursor is None
+
+
+@responses.activate
+def test_equivalent_room_searches_share_the_cache(test_app):
+    test_room_list = MockRoomListResponse().dict()
+    expected_status = HTTP_200_OK
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_list,
+        status=expected_status,
+    )
+
+    first = test_app.get(
+        f"{APPSERVER_URL}/rooms",
+        params={"types": ["House", "Apartment"], "latitude": -34.60372},
+    )
+    second = test_app.get(
+        f"{APPSERVER_URL}/rooms",
+        params={"types": ["Apartment", "House"], "latitude": -34.60368},
+    )
+
+    assert first.status_code == expected_status
+    assert second.json() == first.json()
+    assert len(responses.calls) == 1
+    assert "types=Apartment&types=House" in responses.calls[0].request.url
+
+
+@responses.activate
+def test_pages_of_a_room_search_share_the_cache(test_app):
+    test_room_list = MockRoomListResponse().dict()
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room_list,
+        status=HTTP_200_OK,
+    )
+
+    first = test_app.get(f"{APPSERVER_URL}/rooms", params={"people": 2, "limit": 1})
+    second = test_app.get(
+        f"{APPSERVER_URL}/rooms",
+        params={"people": 2, "limit": 1, "cursor": first.json()["next_cursor"]},
+    )
+
+    assert second.status_code == HTTP_200_OK
+    assert second.json()["rooms"][0]["id"] == test_room_list["rooms"][1]["id"]
+    assert len(responses.calls) == 1
+    assert "limit" not in responses.calls[0].request.url
+
+
+def test_room_searches_after_a_write_do_not_join_older_fetches(monkeypatch):
+    test_room_list = MockRoomListResponse().dict()
+    fetched_paths = []
+
+    async def room_srv_fetch(method, path, expected_statuses):
+        fetched_paths.append(path)
+        await asyncio.sleep(0.01)
+        return test_room_list, HTTP_200_OK
+
+    monkeypatch.setattr(Requester, "room_srv_fetch", room_srv_fetch)
+
+    async def search_around_a_write():
+        before = asyncio.ensure_future(RoomSearch.search({"people": 2}))
+        await asyncio.sleep(0)
+        RoomSearch.invalidate()
+        after = asyncio.ensure_future(RoomSearch.search({"people": 2}))
+        return await asyncio.gather(before, after)
+
+    run(search_around_a_write())
+
+    assert len(fetched_paths) == 2
+
+
+@responses.activate
+def test_radius_search_is_answered_by_the_room_index(test_app):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    # about 1km and 50km north of the search point
+    test_rooms[0].update({"latitude": 0.009, "longitude": 0.0})
+    test_rooms[1].update({"latitude": 0.45, "longitude": 0.0})
+    room_index.load(test_rooms)
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/rooms",
+        params={"latitude": 0.0, "longitude": 0.0, "radius": 10},
+    )
+
+    assert response.status_code == HTTP_200_OK
+    assert [room["id"] for room in response.json()["rooms"]] == [test_rooms[0]["id"]]
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_date_search_is_answered_by_the_booking_index(test_app):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    room_index.load(test_rooms)
+    booking_index.load(
+        [
+            {
+                "id": 1,
+                "room_id": test_rooms[0]["id"],
+                "date_from": "2020-12-14",
+                "date_to": "2020-12-19",
+                "booking_status": 0,
+            }
+        ]
+    )
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/rooms",
+        params={"date_begins": "2020-12-10", "date_ends": "2020-12-15"},
+    )
+    assert response.status_code == HTTP_200_OK
+    assert [room["id"] for room in response.json()["rooms"]] == [test_rooms[1]["id"]]
+
+    # checking in the day the booking checks out
+    response = test_app.get(
+        f"{APPSERVER_URL}/rooms",
+        params={"date_begins": "2020-12-19", "date_ends": "2020-12-21"},
+    )
+    assert response.json()["amount"] == len(test_rooms)
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_rooms_map_returns_markers_inside_the_viewport(test_app):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    test_rooms[0].update({"latitude": 1.0, "longitude": 1.0})
+    test_rooms[1].update({"latitude": 10.0, "longitude": 10.0})
+    room_index.load(test_rooms)
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/rooms/map",
+        params={"south": 0, "west": 0, "north": 5, "east": 5, "zoom": 10},
+    )
+
+    assert response.status_code == HTTP_200_OK
+    assert response.json() == {
+        "amount": 1,
+        "markers": [
+            {
+                "id": test_rooms[0]["id"],
+                "latitude": 1.0,
+                "longitude": 1.0,
+                "price_per_day": test_rooms[0]["price_per_day"],
+                "type": test_rooms[0]["type"],
+            }
+        ],
+        "clusters": [],
+    }
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_rooms_map_clusters_close_rooms(test_app, monkeypatch):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    for test_room in test_rooms:
+        test_room.update({"latitude": 1.0, "longitude": 1.0})
+    room_index.load(test_rooms)
+    monkeypatch.setattr(room_map, "MAP_CLUSTER_THRESHOLD", 1)
+
+    response = test_app.get(
+        f"{APPSERVER_URL}/rooms/map",
+        params={"south": 0, "west": 0, "north": 5, "east": 5, "zoom": 3},
+    )
+
+    assert response.status_code == HTTP_200_OK
+    response_json = response.json()
+    assert response_json["markers"] == []
+    assert response_json["clusters"][0]["count"] == len(test_rooms)
+
+
+@responses.activate
+def test_room_index_refresh_follows_the_cursors(monkeypatch):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    monkeypatch.setattr(room_index, "page_size", 1)
+    for index, test_room in enumerate(test_rooms):
+        last = index == len(test_rooms) - 1
+        responses.add(
+            responses.GET,
+            re.compile(POSTSERVER_ROOM_REGEX),
+            json={"rooms": [test_room], "next_cursor": None if last else index + 1},
+            status=HTTP_200_OK,
+        )
+
+    run(room_index.refresh())
+
+    assert sorted(room_index.rooms) == sorted(room["id"] for room in test_rooms)
+    assert "cursor=1" in responses.calls[1].request.url
+
+
+@responses.activate
+def test_room_index_refresh_without_cursors_is_not_cut_off(monkeypatch):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    monkeypatch.setattr(room_index, "page_size", 1)
+
+    def honor_limit_only(request):
+        rooms = test_rooms[:1] if "limit=" in request.url else test_rooms
+        return HTTP_200_OK, {}, json.dumps({"rooms": rooms})
+
+    responses.add_callback(
+        responses.GET, re.compile(POSTSERVER_ROOM_REGEX), callback=honor_limit_only
+    )
+
+    run(room_index.refresh())
+
+    assert sorted(room_index.rooms) == sorted(room["id"] for room in test_rooms)
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_room_index_refresh_ignoring_limit_fetches_once(monkeypatch):
+    test_rooms = MockRoomListResponse().dict()["rooms"]
+    monkeypatch.setattr(room_index, "page_size", 1)
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json={"rooms": test_rooms},
+        status=HTTP_200_OK,
+    )
+
+    run(room_index.refresh())
+
+    assert sorted(room_index.rooms) == sorted(room["id"] for room in test_rooms)
+    assert len(responses.calls) == 1
+
+
+def make_stale_room_directory(monkeypatch, fetch_room):
+    """
+    RoomDirectory with rooms fresh for 10 seconds and served stale for
+    30 more, on a clock the test moves; returns the clock
+    """
+    now = [0.0]
+    monkeypatch.setattr(RoomDirectory, "ttl", 10)
+    monkeypatch.setattr(RoomDirectory, "stale_ttl", 30)
+    monkeypatch.setattr(
+        RoomDirectory, "cache", TTLCache(max_entries=10, ttl=40, clock=lambda: now[0])
+    )
+    monkeypatch.setattr(Requester, "room_srv_fetch", fetch_room)
+    return now
+
+
+async def wait_for_revalidation():
+    while RoomDirectory._revalidating:
+        await asyncio.sleep(0.001)
+
+
+def test_stale_rooms_are_served_while_a_single_refresh_runs(monkeypatch):
+    test_room = MockRoomResponse().dict()
+    fetched_paths = []
+    refreshed = {}
+
+    async def fetch_room(method, path, expected_statuses):
+        fetched_paths.append(path)
+        await refreshed["release"].wait()
+        return {**test_room, "title": "refreshed"}, HTTP_200_OK
+
+    now = make_stale_room_directory(monkeypatch, fetch_room)
+
+    async def get_rooms_while_stale():
+        refreshed["release"] = asyncio.Event()
+        RoomDirectory.update(test_room["id"], test_room)
+        now[0] = 15
+
+        stale = [await RoomDirectory.get_room(test_room["id"]) for _ in range(3)]
+        await asyncio.sleep(0)
+        refreshed["release"].set()
+        await wait_for_revalidation()
+
+        return stale, await RoomDirectory.get_room(test_room["id"])
+
+    stale, fresh = run(get_rooms_while_stale())
+
+    assert [room["title"] for room in stale] == [test_room["title"]] * 3
+    assert fresh["title"] == "refreshed"
+    assert fetched_paths == [f"/rooms/{test_room['id']}"]
+
+
+def test_failed_refresh_keeps_the_stale_room(monkeypatch):
+    test_room = MockRoomResponse().dict()
+    fetched_paths = []
+
+    async def fetch_room(method, path, expected_statuses):
+        fetched_paths.append(path)
+        raise RequestException("post server is down")
+
+    now = make_stale_room_directory(monkeypatch, fetch_room)
+
+    async def get_room_while_stale():
+        RoomDirectory.update(test_room["id"], test_room)
+        now[0] = 15
+
+        stale = await RoomDirectory.get_room(test_room["id"])
+        await wait_for_revalidation()
+        return stale
+
+    stale = run(get_room_while_stale())
+
+    assert stale["title"] == test_room["title"]
+    assert len(fetched_paths) == 1
+    cached_room, fetched_at = RoomDirectory.cache.get(test_room["id"])
+    assert cached_room["title"] == test_room["title"]
+    assert fetched_at == 0
+
+
+@responses.activate
+def test_get_room_fetches_the_room_and_the_favorite_concurrently(
+    test_app, monkeypatch
+):
+    test_room = MockRoomResponse().dict()
+    header = {"x-access-token": "tokenrefalso"}
+    # each upstream answers only once the other one was asked too
+    both_asked = threading.Barrier(2, timeout=1)
+
+    def answer(body):
+        def callback(request):
+            both_asked.wait()
+            return HTTP_200_OK, {}, json.dumps(body)
+
+        return callback
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    responses.add_callback(
+        responses.GET, re.compile(POSTSERVER_ROOM_REGEX), callback=answer(test_room)
+    )
+    responses.add_callback(
+        responses.GET,
+        re.compile(FAVORITE_ROOM_REGEX),
+        callback=answer({"room_id": test_room["id"]}),
+    )
+
+    response = test_app.get(f"{APPSERVER_URL}/rooms/{test_room['id']}", headers=header)
+
+    assert response.status_code == HTTP_200_OK
+    assert response.json()["favorite"] is True
+
+
+@responses.activate
+def test_get_room_fails_when_the_room_fetch_fails(test_app, monkeypatch):
+    header = {"x-access-token": "tokenrefalso"}
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(1))
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json={"error": "room 99 not found"},
+        status=HTTP_404_NOT_FOUND,
+    )
+    responses.add(
+        responses.GET,
+        re.compile(FAVORITE_ROOM_REGEX),
+        json={},
+        status=HTTP_404_NOT_FOUND,
+    )
+
+    response = test_app.get(f"{APPSERVER_URL}/rooms/99", headers=header)
+
+    assert response.status_code == HTTP_404_NOT_FOUND
+
+
 @responses.activate
 def test_get_recomended_rooms(test_app):
     test_room_list = MockRoomListResponse().dict()
@@ -159,9 +564,9 @@ def test_get_room_by_id(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_room["owner_uuid"]
+        AuthSender, "get_uuid_from_token", async_return(test_room["owner_uuid"])
     )
 
     responses.add(
@@ -186,6 +591,61 @@ def test_get_room_by_id(test_app, monkeypatch):
     assert response_json["id"] == test_room_id
 
 
+@responses.activate
+def test_room_is_cached_until_updated(test_app, monkeypatch):
+    test_room = MockRoomResponse().dict()
+    test_favorite = MockFavoriteRoomResponse().dict()
+    test_room_id = test_room["id"]
+    updated_room = {**test_room, "title": "Updated offer in Las Toninas"}
+    header = {"x-access-token": "tokenrefalso"}
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
+    monkeypatch.setattr(
+        AuthSender, "get_uuid_from_token", async_return(test_room["owner_uuid"])
+    )
+
+    responses.add(
+        responses.GET,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=test_room,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.PATCH,
+        re.compile(POSTSERVER_ROOM_REGEX),
+        json=updated_room,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.GET,
+        re.compile(FAVORITE_ROOM_REGEX),
+        json=test_favorite,
+        status=HTTP_200_OK,
+    )
+
+    def room_fetches():
+        return [
+            call for call in responses.calls
+            if call.request.method == "GET" and "favorite" not in call.request.url
+        ]
+
+    test_app.get(f"{APPSERVER_URL}/rooms/{test_room_id}", headers=header)
+    test_app.get(f"{APPSERVER_URL}/rooms/{test_room_id}", headers=header)
+    assert len(room_fetches()) == 1
+
+    test_app.patch(
+        f"{APPSERVER_URL}/rooms/{test_room_id}",
+        json={"title": updated_room["title"]},
+        headers=header,
+    )
+    response = test_app.get(f"{APPSERVER_URL}/rooms/{test_room_id}", headers=header)
+
+    assert response.status_code == HTTP_200_OK
+    assert response.json()["title"] == updated_room["title"]
+    assert len(room_fetches()) == 1
+
+
 @responses.activate
 def test_update_room(test_app, monkeypatch):
     test_full_room = MockRoomResponse().dict()
@@ -204,10 +664,10 @@ def test_update_room(test_app, monkeypatch):
     test_room = {attr: test_full_room[attr] for attr in attrs_to_test}
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_full_room["owner_uuid"]
+        AuthSender, "get_uuid_from_token", async_return(test_full_room["owner_uuid"])
     )
     responses.add(
         responses.GET,
@@ -248,10 +708,10 @@ def test_delete_room(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
     monkeypatch.setattr(
-        AuthSender, "get_uuid_from_token", lambda x: test_room["owner_uuid"]
+        AuthSender, "get_uuid_from_token", async_return(test_room["owner_uuid"])
     )
     responses.add(
         responses.GET,
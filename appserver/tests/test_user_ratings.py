@@ -7,7 +7,8 @@ from tests.mock_models.user_models import MockUserResponse
 from tests.mock_models.user_ratings_models import (MockUserRatingListResponse,
                                                    MockUserRatingResponse)
 from tests.utils import (APPSERVER_URL, USER_REGEX, GUEST_RATING_REGEX,
-                         HOST_RATING_REGEX, check_responses_equality)
+                         HOST_RATING_REGEX, async_return,
+                         check_responses_equality)
 
 
 @responses.activate
@@ -20,9 +21,11 @@ def test_post_host_rating(test_app, monkeypatch):
     attrs_to_test = ["rating", "reviewer", "reviewer_id"]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_comment", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_rating)
+    monkeypatch.setattr(
+        AuthSender, "get_uuid_from_token", async_return(test_rating["reviewer_id"])
+    )
 
     responses.add(
         responses.GET,
@@ -55,9 +58,11 @@ def test_post_guest_rating(test_app, monkeypatch):
     attrs_to_test = ["rating", "reviewer", "reviewer_id"]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_comment", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_rating)
+    monkeypatch.setattr(
+        AuthSender, "get_uuid_from_token", async_return(test_rating["reviewer_id"])
+    )
     
     responses.add(
         responses.GET,
@@ -178,9 +183,9 @@ def test_delete_host_rating(test_app, monkeypatch):
     expected_status = HTTP_200_OK
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     responses.add(
         responses.DELETE,
         re.compile(HOST_RATING_REGEX),
@@ -203,9 +208,9 @@ def test_delete_guest_rating(test_app, monkeypatch):
     expected_status = HTTP_200_OK
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     responses.add(
         responses.DELETE,
         re.compile(GUEST_RATING_REGEX),
@@ -2,14 +2,16 @@ import re
 
 import responses
 from app.services.authsender import AuthSender
+from app.services.user_directory import UserDirectory
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
 from tests.mock_models.user_models import (MockPaymentWalletResponse,
                                            MockUserListResponse,
                                            MockUserResponse)
+from tests.mock_models.user_reviews_models import MockUserReviewResponse
 from tests.utils import (APPSERVER_ME_REGEX, APPSERVER_URL,
-                         APPSERVER_WALLET_REGEX, AUTH_REGEX,
-                         PAYMENT_WALLET_REGEX, USER_REGEX,
-                         check_responses_equality)
+                         APPSERVER_WALLET_REGEX, AUTH_REGEX, HOST_REVIEW_REGEX,
+                         PAYMENT_WALLET_REGEX, USER_REGEX, async_return,
+                         check_responses_equality, run)
 
 
 @responses.activate
@@ -28,7 +30,7 @@ def test_create_user(test_app, monkeypatch):
     ]
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     responses.add(
         responses.POST,
         re.compile(AUTH_REGEX),
@@ -89,9 +91,9 @@ def test_edit_user(test_app, monkeypatch):
     test_user = {attr: test_full_user[attr] for attr in attrs_to_test}
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
     responses.add(
         responses.PATCH,
         re.compile(USER_REGEX),
@@ -106,6 +108,60 @@ def test_edit_user(test_app, monkeypatch):
     check_responses_equality(response.json(), test_user, attrs_to_test)
 
 
+@responses.activate
+def test_edit_user_invalidates_cached_profile(test_app, monkeypatch):
+    test_user = MockUserResponse().dict()
+    test_user_id = test_user["id"]
+    test_review = MockUserReviewResponse().dict()
+    reviewed_user_id = test_user_id + 1
+    header = {"x-access-token": "tokenrefalso"}
+
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
+    responses.add(
+        responses.POST,
+        re.compile(HOST_REVIEW_REGEX),
+        json=test_review,
+        status=HTTP_201_CREATED,
+    )
+    responses.add(
+        responses.GET,
+        re.compile(USER_REGEX),
+        json=test_user,
+        status=HTTP_200_OK,
+    )
+    responses.add(
+        responses.PATCH,
+        re.compile(USER_REGEX),
+        json=test_user,
+        status=HTTP_200_OK,
+    )
+
+    def post_review():
+        return test_app.post(
+            f"{APPSERVER_URL}/users/{reviewed_user_id}/host_reviews",
+            json={"review": test_review["review"]},
+            headers=header,
+        )
+
+    def user_fetches():
+        return [call for call in responses.calls if call.request.method == "GET"]
+
+    assert post_review().status_code == HTTP_201_CREATED
+    assert post_review().status_code == HTTP_201_CREATED
+    assert len(user_fetches()) == 1
+
+    response = test_app.patch(
+        f"{APPSERVER_URL}/users/{test_user_id}",
+        json={"firstname": test_user["firstname"]},
+        headers=header,
+    )
+    assert response.status_code == HTTP_200_OK
+
+    assert post_review().status_code == HTTP_201_CREATED
+    assert len(user_fetches()) == 2
+
+
 @responses.activate
 def test_delete_user(test_app, monkeypatch):
     test_user = MockUserResponse().dict()
@@ -113,9 +169,9 @@ def test_delete_user(test_app, monkeypatch):
     expected_status = HTTP_200_OK
     header = {"x-access-token": "tokenrefalso"}
 
-    monkeypatch.setattr(AuthSender, "is_valid_token", lambda x: True)
+    monkeypatch.setattr(AuthSender, "is_valid_token", async_return(True))
     monkeypatch.setattr(AuthSender, "has_permission_to_modify", lambda x, y: True)
-    monkeypatch.setattr(AuthSender, "get_uuid_from_token", lambda x: test_user_id)
+    monkeypatch.setattr(AuthSender, "get_uuid_from_token", async_return(test_user_id))
 
     responses.add(
         responses.DELETE,
@@ -165,3 +221,24 @@ def test_get_all_users(test_app):
 
     for i, user in enumerate(response_users):
         check_responses_equality(user, test_users[i], attrs_to_test)
+
+
+@responses.activate
+def test_stats_exposes_the_cache_hits_and_misses(test_app):
+    test_user = MockUserResponse().dict()
+    responses.add(
+        responses.GET, re.compile(USER_REGEX), json=test_user, status=HTTP_200_OK
+    )
+
+    before = test_app.get(f"{APPSERVER_URL}/stats").json()["caches"]["users"]
+    for _ in range(2):
+        run(UserDirectory.get_display_name(test_user["id"]))
+    stats = test_app.get(f"{APPSERVER_URL}/stats").json()
+
+    users = stats["caches"]["users"]
+    assert users["misses"] - before["misses"] == 1
+    assert users["hits"] - before["hits"] == 1
+    assert users["size"] == 1
+    assert set(stats["caches"]) == {"auth_tokens", "users", "rooms", "room_searches"}
+    assert "queued" in stats["notifications"]
+    assert "subscriptions" in stats["chat_streams"]
@@ -1,3 +1,5 @@
+import asyncio
+import base64
 import json
 import os
 from typing import Any, Dict, List
@@ -44,3 +46,22 @@ def check_responses_equality(
 ):
     for attr in test_attrs:
         assert response[attr] == test_response[attr]
+
+
+def async_return(value):
+    async def mock_coroutine(*_args, **_kwargs):
+        return value
+
+    return mock_coroutine
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()